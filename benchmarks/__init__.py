@@ -0,0 +1,5 @@
+import os
+
+# benchmarks run against local stubs and the local cache, never AWS
+print('INFO: Benchmarks will be using local cache.')
+os.environ["BIRDDOG_USE_LOCAL_CACHE"] = "True"
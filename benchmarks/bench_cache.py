@@ -0,0 +1,105 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+"""
+Benchmark parallel cache throughput with and without one process-wide lock around
+all cache I/O (as birddog.cache had before per-key locking).
+
+Runs the local filesystem backend in a temporary folder, and the S3 code path
+(TieredCache, without local tiers so every load reaches the remote) against a
+stand-in remote store that adds a delay per request for the S3 round trip.
+Each thread saves and loads its own objects.
+
+    python -m benchmarks.bench_cache [--objects N] [--threads N] [--latency MS]
+"""
+
+import os
+os.environ['BIRDDOG_USE_LOCAL_CACHE'] = 'True' # before birddog.cache is imported
+
+import argparse
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import birddog.cache
+from birddog.cache import TieredCache, save_cached_object, load_cached_object
+
+def _page(i):
+    # about the size of an opus page
+    return {'title': {'uk': f'ДАЖО/1/{i}'}, 'children': [
+        [{'text': {'uk': str(n), 'en': str(n)}, 'link': f'/wiki/Архів:ДАЖО/1/{i}/{n}'},
+         {'text': {'uk': f'Справа про {n}'}, 'link': None}] for n in range(200)]}
+
+class _SlowRemote:
+    """Stands in for S3: a fixed delay per request."""
+    def __init__(self, latency):
+        self._latency = latency
+        self._objects = {}
+
+    def get(self, path, etag=None):
+        time.sleep(self._latency)
+        return self._objects.get(path)
+
+    def put(self, path, body):
+        time.sleep(self._latency)
+        self._objects[path] = (f'"{len(body)}"', body)
+        return self._objects[path][0]
+
+    def delete(self, path):
+        time.sleep(self._latency)
+        self._objects.pop(path, None)
+
+def _serialized(fn, lock):
+    def locked(*args):
+        with lock:
+            return fn(*args)
+    return locked
+
+def _run(save, load, objects, threads):
+    def work(i):
+        save(_page(i), f'bench/{i % threads}/{i}.json')
+        load(f'bench/{i % threads}/{i}.json')
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(work, range(objects)))
+    return 2 * objects / (time.perf_counter() - start)
+
+def _local(objects, threads, serialize):
+    with tempfile.TemporaryDirectory() as folder, patch('birddog.cache.CACHE_DIR', folder):
+        save, load = save_cached_object, load_cached_object
+        if serialize:
+            lock = threading.Lock()
+            save, load = _serialized(save, lock), _serialized(load, lock)
+        return _run(save, load, objects, threads)
+
+def _tiered(objects, threads, latency, serialize):
+    remote = _SlowRemote(latency)
+    if serialize:
+        lock = threading.Lock()
+        remote.get, remote.put = _serialized(remote.get, lock), _serialized(remote.put, lock)
+    store = TieredCache(remote)
+    save = lambda obj, path: store.save(path, json.dumps(obj).encode())
+    load = lambda path: json.loads(store.load(path))
+    return _run(save, load, objects, threads)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=20, help='simulated S3 round trip in ms')
+    args = parser.parse_args()
+
+    print(f'{args.objects} objects, {args.threads} threads, {args.latency} ms simulated S3 latency')
+    for label, run in (
+            ('local', lambda serialize: _local(args.objects, args.threads, serialize)),
+            ('s3', lambda serialize: _tiered(args.objects, args.threads, args.latency / 1000, serialize))):
+        before = run(True)
+        after = run(False)
+        print(f'{label:>6}: global lock {before:8.1f} ops/s   per-key {after:8.1f} ops/s   '
+              f'({after / before:.1f}x)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+"""
+Benchmark page comparison on synthetic tables.
+
+Compares the previous positional check_page_changes algorithm with the
+row-keyed diff engine on a large table with a realistic mix of edits:
+changed cells, inserted, deleted and reordered rows, and duplicate ids.
+
+    python -m benchmarks.bench_diff [--rows N] [--cols N] [--repeat N]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from copy import deepcopy
+
+from birddog.diff import diff_rows
+from birddog.utility import equal_text, get_text, is_linked
+
+def _cell(text, link=None):
+    item = {'text': {'uk': text, 'en': text.upper()}}
+    if link:
+        item['link'] = link
+    return item
+
+def _table(num_rows, num_cols, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(num_rows):
+        entry_id = str(i // 2 if i % 50 == 0 else i) # occasional duplicate ids
+        row = [_cell(entry_id, f'/wiki/Архів:ДАЖО/1/{entry_id}')]
+        row += [_cell(f'справа {i} поле {j} {rng.random():.6f}') for j in range(1, num_cols)]
+        rows.append(row)
+    return rows
+
+def _edit(rows, seed=1):
+    """A later version: ~2% cells changed, ~1% rows inserted, removed and moved."""
+    rng = random.Random(seed)
+    rows = deepcopy(rows)
+    for row in rows:
+        if rng.random() < 0.02:
+            j = rng.randrange(1, len(row))
+            row[j] = _cell(row[j]['text']['uk'] + ' (виправлено)')
+    n = len(rows)
+    for _ in range(n // 100):
+        del rows[rng.randrange(len(rows))]
+    for k in range(n // 100):
+        rows.insert(rng.randrange(len(rows)), [_cell(f'new{k}')] + deepcopy(rows[0][1:]))
+    for _ in range(n // 100):
+        rows.insert(rng.randrange(len(rows)), rows.pop(rng.randrange(len(rows))))
+    return rows
+
+def _positional(rows, ref_rows):
+    # the previous check_page_changes loop: first-cell index, cells zipped by position
+    rows = deepcopy(rows) # it annotated in place
+    ref_children = dict((get_text(c[0]['text']), c) for c in ref_rows)
+    for child in rows:
+        index = get_text(child[0]['text'])
+        if index in ref_children:
+            ref_child = ref_children[index]
+            for item, ref_item in zip(child, ref_child):
+                changed = not equal_text(item['text'], ref_item['text'])
+                item['edit'] = 'changed' if changed else None
+                if 'link' in item and is_linked(item['link']):
+                    if 'link' in ref_item and is_linked(ref_item['link']):
+                        item['link_edit'] = 'changed' if item['link'] != ref_item['link'] else None
+                    else:
+                        item['link_edit'] = 'added'
+        else:
+            for item in child:
+                item['edit'] = 'added'
+    return rows
+
+def _keyed(rows, ref_rows):
+    return diff_rows(rows, ref_rows)
+
+def _time(fn, *args, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    ref_rows = _table(args.rows, args.cols)
+    rows = _edit(ref_rows)
+    print(f'{args.rows} rows x {args.cols} columns, median of {args.repeat}')
+    print(f'positional: {_time(_positional, rows, ref_rows, repeat=args.repeat):8.1f} ms (incl. copy)')
+    print(f'     keyed: {_time(_keyed, rows, ref_rows, repeat=args.repeat):8.1f} ms')
+    print(f'  no edits: {_time(_keyed, ref_rows, ref_rows, repeat=args.repeat):8.1f} ms')
+
+    result, removed = diff_rows(rows, ref_rows)
+    counts = {}
+    for row in result:
+        edits = [item.get('edit') for item in row]
+        kind = ('added' if edits[0] == 'added' else 'moved' if edits[0] == 'moved' else
+                'changed' if any(edits) else 'unchanged')
+        counts[kind] = counts.get(kind, 0) + 1
+    print('    ' + ', '.join(f'{k}: {v}' for k, v in sorted(counts.items())) + f', removed: {len(removed)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+"""
+Benchmark fetch_url with and without connection pooling.
+
+Runs against a local stub HTTP server so no wiki traffic is generated.
+The stub can add a delay to every new connection to stand in for the
+TCP+TLS handshake cost of talking to uk.wikisource.org.
+
+    python -m benchmarks.bench_fetch [--requests N] [--threads N] [--connect-delay MS]
+"""
+
+import argparse
+import gzip
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from birddog.utility import (
+    MAX_CONCURRENT_FETCHES,
+    fetch_url,
+    fetch_stats,
+    _url_headers,
+    )
+
+_PAYLOAD = json.dumps({'query': {'pages': {str(i): {'title': f'Архів:ДАЖО/{i}'} for i in range(50)}}}).encode()
+
+def _make_handler(connect_delay):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            time.sleep(connect_delay) # simulated handshake, once per connection
+
+        def do_GET(self):
+            body = _PAYLOAD
+            gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if gzipped:
+                body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return StubHandler
+
+def _unpooled_get(url):
+    # the previous fetch_url transport: a fresh connection per request
+    return requests.get(url, timeout=10, headers=_url_headers).json()
+
+def _pooled_get(url):
+    return fetch_url(url, json=True)
+
+def _run(fetch, url, num_requests, threads):
+    latencies = []
+    def timed(_):
+        start = time.perf_counter()
+        fetch(url)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(timed, range(num_requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'throughput': num_requests / elapsed,
+    }
+
+def _report(label, result):
+    print(f'{label:>10}: mean {result["mean_ms"]:7.2f} ms   '
+          f'p95 {result["p95_ms"]:7.2f} ms   {result["throughput"]:8.1f} req/s')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=MAX_CONCURRENT_FETCHES)
+    parser.add_argument('--connect-delay', type=float, default=20, help='per-connection delay in ms')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(args.connect_delay / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/w/api.php'
+
+    print(f'{args.requests} requests, {args.threads} threads, {args.connect_delay} ms connect delay')
+    _report('unpooled', _run(_unpooled_get, url, args.requests, args.threads))
+    _report('pooled', _run(_pooled_get, url, args.requests, args.threads))
+    stats = fetch_stats()
+    print(f'    pooled: {stats["connections"]} connections opened, '
+          f'{stats["reused"]} reused ({stats["reuse_ratio"]:.1%}), '
+          f'{stats["gzip_responses"]}/{stats["requests"]} gzip responses')
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+"""
+Report the size and load time of cached pages in the legacy format (plain JSON)
+against the compact format of birddog.pageformat.
+
+Reads every page under the page_cache folder of the local cache (or --folder),
+in either format. Without cached pages, a synthetic opus page is used instead.
+
+    python -m benchmarks.bench_page_format [--folder DIR] [--repeat N]
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from birddog.pageformat import pack_page, unpack_page, orjson, zstandard
+from birddog.wiki import _parse_mw_page
+
+_CACHE_DIR = Path(__file__).resolve().parent.parent / '.cache' / 'page_cache'
+
+def _synthetic(rows=5000):
+    lines = ['{{Архіви|назва=Опис справ|рік=1920—1930}}', '{| class="wikitable"',
+             '! Справа || Назва || Роки || Аркушів']
+    for i in range(1, rows + 1):
+        lines += ['|-', f'| [[/{i}/]] || Листування з повітовими установами про справу № {i} || 1920 || {i % 300}']
+    lines.append('|}')
+    page, _ = _parse_mw_page('Архів:ДАЖО/1/74', '\n'.join(lines), 'ДАЖО/1/74')
+    for row in page['children']:
+        row[1]['text']['en'] = f'Correspondence with district institutions, case {row[0]["text"]["uk"]}'
+    return {'synthetic': page}
+
+def _cached(folder):
+    pages = {}
+    for file in sorted(Path(folder).rglob('*.json')):
+        pages[str(file.relative_to(folder))] = unpack_page(file.read_bytes())
+    return pages
+
+def _time(fn, data, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000 # least disturbed by the rest of the machine
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--folder', default=_CACHE_DIR, help='page_cache folder of a local cache')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = (_cached(args.folder) if Path(args.folder).is_dir() else {}) or _synthetic()
+    print(f'{len(pages)} pages, json: {"orjson" if orjson else "json"}, '
+          f'compression: {"zstd" if zstandard else "gzip"}')
+    totals = [0, 0, 0.0, 0.0]
+    for name, page in pages.items():
+        legacy = json.dumps(page).encode('utf8')
+        packed = pack_page(page)
+        assert unpack_page(packed) == page
+        legacy_ms = _time(json.loads, legacy, args.repeat)
+        packed_ms = _time(unpack_page, packed, args.repeat)
+        for i, value in enumerate((len(legacy), len(packed), legacy_ms, packed_ms)):
+            totals[i] += value
+        if len(pages) <= 20:
+            print(f'{name}: {len(page.get("children") or [])} rows')
+            print(f'  legacy: {len(legacy) / 1024:9.1f} KB {legacy_ms:8.2f} ms')
+            print(f'  packed: {len(packed) / 1024:9.1f} KB {packed_ms:8.2f} ms')
+    legacy_bytes, packed_bytes, legacy_ms, packed_ms = totals
+    print(f'total legacy: {legacy_bytes / 1024:9.1f} KB {legacy_ms:8.2f} ms to load')
+    print(f'total packed: {packed_bytes / 1024:9.1f} KB {packed_ms:8.2f} ms to load '
+          f'({legacy_bytes / packed_bytes:.1f}x smaller)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+"""
+Benchmark page loading from rendered HTML (read_page) against wikitext
+(mw_read_page) on saved fixtures, with the network stubbed out. Also counts
+the API calls mw_read_page makes.
+
+Fixtures are pairs of files in benchmarks/fixtures: <name>.html (the rendered
+page) and <name>.json (the action=parse API response). Save real pages with
+
+    python -m benchmarks.bench_parse --save "ДАЖО/1/74"
+
+Without saved fixtures a synthetic opus page is generated instead.
+
+    python -m benchmarks.bench_parse [--rows N] [--repeat N]
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from unittest.mock import patch
+from urllib.parse import quote
+
+from birddog.utility import fetch_url
+from birddog.wiki import (
+    API_URL,
+    ARCHIVE_BASE,
+    wiki_title,
+    get_title,
+    read_page,
+    mw_read_page,
+    _parse_mw_page,
+    )
+
+_FIXTURE_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+# stand-in for the skin, navigation and footer around the content of a rendered page
+_SKIN = '<div class="vector-menu"><ul>' + ''.join(
+    f'<li id="n-{i}"><a href="/wiki/Special:Page{i}" title="Службова {i}">Службова сторінка {i}</a></li>'
+    for i in range(400)) + '</ul></div>'
+
+def _synthetic(rows):
+    title = 'ДАЖО/1/74'
+    full_title = wiki_title(title)
+    lines = ['{{Архіви|назва=Опис справ|рік=1920—1930}}', '{| class="wikitable"', '! Справа || Назва || Роки || Аркушів']
+    html_rows = ['<tr><th>Справа</th><th>Назва</th><th>Роки</th><th>Аркушів</th></tr>']
+    for i in range(1, rows + 1):
+        name = f'Листування з повітовими установами про справу № {i}'
+        lines += ['|-', f'| [[/{i}/]] || {name} || 1920 || {i % 300}']
+        href = '/wiki/' + quote(f'{full_title}/{i}', safe='/:')
+        html_rows.append(
+            f'<tr><td><a href="{href}" title="{full_title}/{i}">{i}</a></td>'
+            f'<td>{name}</td><td>1920</td><td>{i % 300}</td></tr>')
+    lines.append('|}')
+    html = (
+        f'<html><head><title>{full_title}</title></head><body>{_SKIN}'
+        f'<h1><span class="mw-page-title-main">{title}</span></h1>'
+        f'<span id="header_section_text">Опис справ</span>'
+        f'<table class="wikitable"><tbody>{"".join(html_rows)}</tbody></table>'
+        f'<ul><li id="footer-info-lastmod"> Цю сторінку востаннє відредаговано о 10:00, 1 березня 2024.</li></ul>'
+        f'{_SKIN}</body></html>')
+    parse = {'parse': {'title': full_title, 'revid': 1, 'wikitext': {'*': '\n'.join(lines)}}}
+    return {'synthetic': (title, html, parse)}
+
+def _saved():
+    fixtures = {}
+    for html_file in sorted(_FIXTURE_DIR.glob('*.html')):
+        json_file = html_file.with_suffix('.json')
+        if json_file.exists():
+            parse = json.loads(json_file.read_text())
+            title = parse['parse']['title'].split(':', 1)[1]
+            fixtures[html_file.stem] = (title, html_file.read_text(), parse)
+    return fixtures
+
+def _save(title):
+    url = f'{ARCHIVE_BASE}/wiki/{quote(wiki_title(title))}'
+    name = title.replace('/', '_')
+    _FIXTURE_DIR.mkdir(exist_ok=True)
+    (_FIXTURE_DIR / f'{name}.html').write_text(fetch_url(url))
+    parse = fetch_url(API_URL, params={
+        'action': 'parse', 'page': wiki_title(title), 'prop': 'wikitext|revid', 'format': 'json'}, json=True)
+    (_FIXTURE_DIR / f'{name}.json').write_text(json.dumps(parse, ensure_ascii=False))
+    print(f'saved {name}')
+
+def _api_stub(parse, calls):
+    # serves the page from its action=parse fixture; all linked pages exist
+    page_title = parse['parse']['title']
+    _, links = _parse_mw_page(page_title, parse['parse']['wikitext']['*'], page_title)
+    linked = sorted(get_title(link).replace('_', ' ') for link in links)
+    async def fetch(url, params=None, json=False):
+        calls.append(params)
+        if params.get('prop') == 'revisions':
+            return {'query': {'pages': {'1': {'title': parse['parse']['title'], 'revisions': [{
+                'revid': parse['parse']['revid'], 'timestamp': '2024-03-01T10:00:00Z',
+                'slots': {'main': {'*': parse['parse']['wikitext']['*']}}}]}}}}
+        if params.get('generator') == 'links':
+            start = int(params.get('gplcontinue', 0))
+            data = {'query': {'pages': {str(i): {'title': t} for i, t in enumerate(linked[start:start + 500])}}}
+            if start + 500 < len(linked):
+                data['continue'] = {'gplcontinue': str(start + 500), 'continue': 'gplcontinue||'}
+            return data
+        return {'query': {'pages': {str(i): {'title': t} for i, t in enumerate(params['titles'].split('|'))}}}
+    return fetch
+
+def _time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000, help='rows in the synthetic page')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='TITLE', help='save a page from the wiki as a fixture')
+    args = parser.parse_args()
+    if args.save:
+        _save(args.save)
+        return
+
+    fixtures = _saved() or _synthetic(args.rows)
+    for name, (title, html, parse) in fixtures.items():
+        url = f'{ARCHIVE_BASE}/wiki/{quote(wiki_title(title))}'
+        with patch('birddog.wiki.fetch_url', lambda *a, **k: html):
+            html_ms, html_page = _time(lambda: read_page(url), args.repeat)
+        calls = []
+        with patch('birddog.wiki.async_fetch_url', _api_stub(parse, calls)):
+            mw_ms, mw_page = _time(lambda: mw_read_page(url), args.repeat)
+        html_kb = len(html.encode()) / 1024
+        mw_kb = len(json.dumps(parse, ensure_ascii=False).encode()) / 1024
+        print(f'{name}: {len(html_page["children"])} rows (html) / {len(mw_page["children"])} rows (wikitext)')
+        print(f'      html: {html_ms:8.1f} ms  {html_kb:8.1f} KB')
+        print(f'  wikitext: {mw_ms:8.1f} ms  {mw_kb:8.1f} KB  {len(calls) // args.repeat} API calls')
+
+if __name__ == '__main__':
+    main()
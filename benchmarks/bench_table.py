@@ -0,0 +1,93 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+"""
+Benchmark wikitable parsing throughput in rows per second.
+
+Parses a synthetic opus page with the fast table tokenizer (falling back to
+mwparserfromhell for complex cells) and with mwparserfromhell alone, and checks
+that both give the same page data. Saved action=parse fixtures in
+benchmarks/fixtures (see bench_parse) are used as well when present.
+
+    python -m benchmarks.bench_table [--rows N] [--repeat N]
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from birddog.wiki import _parse_mw_page
+from birddog.wikitable import parse_cell
+
+_FIXTURE_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+def _synthetic(rows):
+    lines = ['{{Архіви|назва=Опис справ|рік=1920—1930}}', '{| class="wikitable sortable"',
+             '! Справа || Назва || Роки || Аркушів || Примітки']
+    for i in range(1, rows + 1):
+        name = f'Листування з повітовими установами про справу № {i}'
+        if i % 10 == 0:
+            name = f"''{name}''"
+        if i % 25 == 0:
+            name += f' ([[ДАЖО/2/{i}|див. також]])'
+        notes = ''
+        if i % 40 == 0:
+            notes = f'[https://example.org/scan/{i} скан]'
+        if i % 100 == 0:
+            notes = f'{{{{ref|{i}}}}} пошкоджено<br/>частково'
+        lines += ['|-', f'| [[/{i}/]] || {name} || 1920—1921 || {i % 300} || {notes}']
+    lines.append('|}')
+    return {'synthetic': ('ДАЖО/1/74', '\n'.join(lines))}
+
+def _saved():
+    fixtures = {}
+    for json_file in sorted(_FIXTURE_DIR.glob('*.json')):
+        parse = json.loads(json_file.read_text())['parse']
+        fixtures[json_file.stem] = (parse['title'].split(':', 1)[1], parse['wikitext']['*'])
+    return fixtures
+
+def _full_parse(page_title, wikitext):
+    # mwparserfromhell for the whole page and every cell, as before the tokenizer
+    with patch('birddog.wiki.split_table', lambda wikitext: None), \
+         patch('birddog.wiki.parse_cell', lambda cell_text: None):
+        return _parse_mw_page(page_title, wikitext, page_title)
+
+def _fast_parse(page_title, wikitext):
+    return _parse_mw_page(page_title, wikitext, page_title)
+
+def _time(fn, args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+def _fallback_cells(wikitext):
+    cells = [c.strip(" |") for line in wikitext.split('\n') if line.startswith('| ')
+             for c in line.split('||')]
+    return sum(1 for c in cells if parse_cell(c) is None), len(cells)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000, help='rows in the synthetic page')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    fixtures = {**_synthetic(args.rows), **_saved()}
+    for name, (page_title, wikitext) in fixtures.items():
+        full_s, (full_page, full_links) = _time(_full_parse, (page_title, wikitext), args.repeat)
+        fast_s, (fast_page, fast_links) = _time(_fast_parse, (page_title, wikitext), args.repeat)
+        rows = len(fast_page['children'])
+        fallback, cells = _fallback_cells(wikitext)
+        same = full_page == fast_page and full_links == fast_links
+        print(f'{name}: {rows} rows, {fallback} of {cells} cells need the full parser, '
+              f'{"same" if same else "DIFFERENT"} results')
+        print(f'  mwparserfromhell: {full_s * 1000:8.1f} ms {rows / full_s:10.0f} rows/s')
+        print(f'         tokenizer: {fast_s * 1000:8.1f} ms {rows / fast_s:10.0f} rows/s')
+
+if __name__ == '__main__':
+    main()
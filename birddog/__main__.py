@@ -1,6 +1,12 @@
 import sys
 from birddog.wiki import update_master_archive_list
 
+def _print_crawl_progress(progress):
+    status = 'done' if progress['done'] else f"at {progress['last']}"
+    print(f"{progress['prefix']}: {progress['pages']} pages ({progress['saved']} saved, "
+          f"{progress['cached']} already cached, {progress['unmapped']} unmapped, "
+          f"{progress['failed']} failed), {progress['elapsed']:.0f}s, {status}")
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python -m birddog <command>")
@@ -10,6 +16,22 @@ def main():
 
     if command == "update_master_archive_list":
         update_master_archive_list()
+    elif command == "crawl":
+        # python -m birddog crawl <archive> [--restart]
+        if len(sys.argv) < 3:
+            print("Usage: python -m birddog crawl <archive> [--restart]")
+            sys.exit(1)
+        from birddog.core import ArchiveCrawler
+        crawler = ArchiveCrawler(sys.argv[2])
+        crawler.crawl(restart="--restart" in sys.argv[3:], progress_callback=_print_crawl_progress)
+    elif command == "crawl_status":
+        # python -m birddog crawl_status <archive>
+        from birddog.core import ArchiveCrawler
+        progress = ArchiveCrawler(sys.argv[2]).progress() if len(sys.argv) > 2 else None
+        if progress is None:
+            print("No crawl found")
+            sys.exit(1)
+        _print_crawl_progress(progress)
     else:
         print(f"Unknown command: {command}")
         sys.exit(1)
@@ -5,16 +5,31 @@
 
 import json
 import os
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from threading import Lock
 from pathlib import Path
 
+from cachetools import LRUCache
+
 from birddog.logging import get_logger
 _logger = get_logger()
 
-_cache_lock = Lock() # could be overkill?
-
 USE_LOCAL_FILESYSTEM = os.getenv("BIRDDOG_USE_LOCAL_CACHE", False) in ("true", "True", "1")
 
+# local tiers in front of S3
+MEMORY_CACHE_BYTES = int(os.getenv("BIRDDOG_MEMORY_CACHE_MB", 256)) * 1024 * 1024
+DISK_CACHE_DIR = os.getenv("BIRDDOG_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), 'birddog-cache'))
+DISK_CACHE_BYTES = int(os.getenv("BIRDDOG_DISK_CACHE_MB", 2048)) * 1024 * 1024
+REVALIDATE_AFTER = float(os.getenv("BIRDDOG_CACHE_REVALIDATE_SECONDS", 60)) # seconds
+
+# concurrent requests of one batch load or save
+CACHE_IO_THREADS = int(os.getenv("BIRDDOG_CACHE_IO_THREADS", 16))
+
 class CacheMissError(Exception):
     """Exception raised on cache miss.
 
@@ -25,6 +40,305 @@ class CacheMissError(Exception):
         self.path = path
         super().__init__(self.path)
 
+def _write_atomically(path, data, times=None):
+    """Write bytes to a file through a temporary file and a rename, so that readers
+    never see a partial file and concurrent writers need no lock (the last one wins).
+    times are the (atime, mtime) to give the file."""
+    temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp, 'wb') as file:
+            file.write(data)
+        if times:
+            os.utime(temp, times)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+class _KeyLocks:
+    """A lock per key, which only exists while it is held or waited for."""
+    def __init__(self):
+        self._locks = {} # key -> [lock, number of holders and waiters]
+        self._lock = Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+def _in_parallel(fn, args):
+    """fn applied to each of args, up to CACHE_IO_THREADS at a time."""
+    args = list(args)
+    if len(args) <= 1:
+        return [fn(*arg) for arg in args]
+    with ThreadPoolExecutor(max_workers=min(CACHE_IO_THREADS, len(args))) as pool:
+        return list(pool.map(lambda arg: fn(*arg), args))
+
+# -------------------------------------------------------------------------------
+# Tiered store: memory and local disk in front of a remote store
+#
+# Entries are (etag, body bytes, time last verified against the remote).
+
+class MemoryTier:
+    """Bounded LRU of entries, limited by the total size of their bodies."""
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+        self._lru = LRUCache(maxsize=max_bytes, getsizeof=lambda entry: len(entry[1]) + 1)
+        self._lock = Lock()
+
+    def get(self, path):
+        with self._lock:
+            return self._lru.get(path)
+
+    def put(self, path, entry):
+        if len(entry[1]) + 1 > self._lru.maxsize:
+            return # too large to keep
+        with self._lock:
+            self._lru[path] = entry
+
+    def touch(self, path, verified):
+        with self._lock:
+            entry = self._lru.get(path)
+            if entry is not None:
+                self._lru[path] = (entry[0], entry[1], verified)
+
+    def remove(self, path):
+        with self._lock:
+            self._lru.pop(path, None)
+
+class DiskTier:
+    """Entries in a local folder, least recently used evicted beyond max_bytes.
+    Each file holds the ETag on its first line and then the body. Its mtime is the
+    time the entry was verified and its atime the time it was last used.
+
+    Worker processes share the folder, so the folder is rescanned after every
+    max_bytes / RESCAN_FRACTION bytes written here, to count (and evict) the files
+    written by the others too.
+    """
+    RESCAN_FRACTION = 16
+    STALE_TEMP_FILE = 10 * 60 # seconds after which a temporary file was left by an interrupted write
+
+    def __init__(self, folder=DISK_CACHE_DIR, max_bytes=DISK_CACHE_BYTES):
+        self._folder = Path(folder)
+        self._max_bytes = max_bytes
+        self._sizes = OrderedDict() # file -> size, least recently used first
+        self._total = 0
+        self._unscanned = 0 # bytes written here since the last scan
+        self._lock = Lock()
+        self._scan()
+
+    def _scan(self):
+        files = []
+        now = time.time()
+        if self._folder.is_dir():
+            for file in self._folder.rglob('*'):
+                if not file.is_file():
+                    continue
+                try:
+                    stat = file.stat()
+                except FileNotFoundError:
+                    continue # removed by another worker
+                if file.suffix == '.tmp':
+                    if now - stat.st_mtime > self.STALE_TEMP_FILE:
+                        file.unlink(missing_ok=True)
+                    continue
+                files.append((stat.st_atime, str(file), stat.st_size))
+        with self._lock:
+            self._sizes = OrderedDict((file, size) for _, file, size in sorted(files))
+            self._total = sum(self._sizes.values())
+            self._unscanned = 0
+        self._evict()
+
+    def _file(self, path):
+        return str(self._folder / path)
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            while self._total > self._max_bytes and self._sizes:
+                file, size = self._sizes.popitem(last=False)
+                self._total -= size
+                evicted.append(file)
+        for file in evicted:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def size(self):
+        return self._total
+
+    def get(self, path):
+        file = self._file(path)
+        try:
+            with open(file, 'rb') as f:
+                etag = f.readline().rstrip(b'\n').decode("utf8")
+                body = f.read()
+            verified = os.stat(file).st_mtime
+            os.utime(file, (time.time(), verified))
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if file in self._sizes:
+                self._sizes.move_to_end(file)
+        return etag, body, verified
+
+    def put(self, path, entry):
+        etag, body, verified = entry
+        data = f'{etag}\n'.encode("utf8") + body
+        if len(data) > self._max_bytes:
+            return
+        file = self._file(path)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        _write_atomically(file, data, (time.time(), verified))
+        with self._lock:
+            self._total += len(data) - self._sizes.pop(file, 0)
+            self._sizes[file] = len(data)
+            self._unscanned += len(data)
+            rescan = self._unscanned * self.RESCAN_FRACTION > self._max_bytes
+        if rescan:
+            self._scan() # evicts
+        else:
+            self._evict()
+
+    def touch(self, path, verified):
+        try:
+            os.utime(self._file(path), (time.time(), verified))
+        except FileNotFoundError:
+            pass
+
+    def remove(self, path):
+        file = self._file(path)
+        with self._lock:
+            self._total -= self._sizes.pop(file, 0)
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+class TieredCache:
+    """Read-through store of serialized objects: memory, then local disk, then the
+    remote store (which has get(path, etag), put(path, body) and delete(path)).
+
+    An entry verified against the remote within revalidate_after seconds is served
+    from the nearest tier that has it. Older entries are revalidated with a
+    conditional get on their ETag, so unchanged objects are not downloaded again.
+    Writes go through to the remote and then fill the local tiers.
+
+    A fresh load revalidates the local copy however recent it is: read-modify-write
+    callers use it so as not to overwrite the writes of other workers.
+
+    Requests for different paths run in parallel. Those for the same path are
+    serialized, so concurrent loads of an object make one remote request and the
+    local tiers keep the order of the writes.
+    """
+    def __init__(self, remote, memory=None, disk=None, revalidate_after=REVALIDATE_AFTER):
+        self._remote = remote
+        self._memory = memory
+        self._disk = disk
+        self._revalidate_after = revalidate_after
+        self._stats = {
+            'memory': {'hits': 0, 'misses': 0},
+            'disk': {'hits': 0, 'misses': 0},
+            'remote': {'hits': 0, 'revalidated': 0, 'misses': 0},
+        }
+        self._stats_lock = Lock()
+        self._keys = _KeyLocks()
+
+    def _count(self, tier, outcome):
+        with self._stats_lock:
+            self._stats[tier][outcome] += 1
+
+    def _tiers(self):
+        return [tier for tier in (self._memory, self._disk) if tier is not None]
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry[2] < self._revalidate_after
+
+    def load(self, path, fresh=False):
+        """Bytes stored at path, or None if there are none. If fresh, the local copy
+        is checked against the remote even if it was verified recently."""
+        if self._memory is not None and not fresh:
+            entry = self._memory.get(path)
+            if self._fresh(entry):
+                self._count('memory', 'hits')
+                return entry[1]
+        with self._keys.hold(path):
+            # check again: a concurrent load may have filled the tiers meanwhile
+            return self._load(path, fresh)
+
+    def _load(self, path, fresh=False):
+        stale = []
+        for name, tier in (('memory', self._memory), ('disk', self._disk)):
+            if tier is None:
+                continue
+            entry = tier.get(path)
+            if not fresh and self._fresh(entry):
+                self._count(name, 'hits')
+                if tier is self._disk and self._memory is not None:
+                    self._memory.put(path, entry)
+                return entry[1]
+            self._count(name, 'misses')
+            if entry is not None:
+                stale.append(entry)
+        stale = max(stale, key=lambda entry: entry[2], default=None)
+        result = self._remote.get(path, stale[0] if stale else None)
+        if result is None:
+            self._count('remote', 'misses')
+            for tier in self._tiers():
+                tier.remove(path)
+            return None
+        etag, body = result
+        now = time.time()
+        if body is None:
+            # not modified: the stale entry is good for another revalidate_after
+            self._count('remote', 'revalidated')
+            for tier in self._tiers():
+                tier.touch(path, now)
+            if self._memory is not None and self._memory.get(path) is None:
+                self._memory.put(path, (etag, stale[1], now))
+            return stale[1]
+        self._count('remote', 'hits')
+        for tier in self._tiers():
+            tier.put(path, (etag, body, now))
+        return body
+
+    def save(self, path, body):
+        with self._keys.hold(path):
+            etag = self._remote.put(path, body)
+            now = time.time()
+            for tier in self._tiers():
+                tier.put(path, (etag, body, now))
+
+    def remove(self, path):
+        with self._keys.hold(path):
+            for tier in self._tiers():
+                tier.remove(path)
+            self._remote.delete(path)
+
+    @property
+    def stats(self):
+        """Counts and hit ratio per tier. A remote hit downloads the object; a
+        revalidation only confirms the local copy."""
+        with self._stats_lock:
+            result = {tier: dict(counts) for tier, counts in self._stats.items()}
+        for tier, counts in result.items():
+            lookups = sum(counts.values())
+            counts['hit_ratio'] = (lookups - counts['misses']) / lookups if lookups else 0.0
+        if self._disk is not None:
+            result['disk']['bytes'] = self._disk.size
+        return result
+
 if USE_LOCAL_FILESYSTEM:
 
     CACHE_DIR       = Path(__file__).resolve().parent.parent / '.cache'
@@ -39,36 +353,54 @@ if USE_LOCAL_FILESYSTEM:
         if pos >= 0:
             os.makedirs(path[:pos], exist_ok=True)
 
-    def save_cached_object(obj, object_path):
-        """Store JSON serialized version of object at object_path location relative to CACHE_DIR"""
+    def save_cached_bytes(data, object_path):
+        """Store bytes at object_path location relative to CACHE_DIR"""
         path = _cache_path(object_path)
         _make_path_if_needed(path)
-        with _cache_lock:
-            with open(path, 'w', encoding="utf8") as file:
-                file.write(json.dumps(obj))
+        _write_atomically(path, data)
 
-    def load_cached_object(object_path):
-        """Return object previously saved at object_path relative to CACHE_DIR.
-        Raises CacheMissError if cache entry is missing.
+    def load_cached_bytes(object_path, fresh=False):
+        """Return bytes previously saved at object_path relative to CACHE_DIR.
+        Raises CacheMissError if cache entry is missing. Reads are always fresh.
         """
         path = _cache_path(object_path)
-        with _cache_lock:
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            raise CacheMissError(object_path)
+
+    def load_cached_bytes_many(object_paths, fresh=False):
+        """Return a dict of the bytes saved at each of object_paths. Paths with no
+        cache entry are left out rather than raising CacheMissError.
+        """
+        result = {}
+        for object_path in object_paths:
             try:
-                with open(path, encoding="utf8") as file:
-                    buffer = file.read()
-            except FileNotFoundError:
-                raise CacheMissError(object_path)
-        return json.loads(buffer)
+                result[object_path] = load_cached_bytes(object_path)
+            except CacheMissError:
+                pass
+        return result
+
+    def save_cached_bytes_many(items):
+        """Store each bytes value of the dict items at its object_path key"""
+        for object_path, data in items.items():
+            save_cached_bytes(data, object_path)
 
     def remove_cached_object(object_path):
         path = _cache_path(object_path)
         if os.path.isfile(path):
             os.remove(path)
 
+    def cache_stats():
+        """The local folder has no tiers in front of it."""
+        return {}
+
 else:
 
     # AWS S3 interface
     import boto3
+    from botocore.exceptions import ClientError
 
     CACHE_NAME = 'birddog-data'
     s3 = boto3.client('s3')
@@ -97,39 +429,93 @@ else:
                 pass
             bucket_created = True
 
-    def _put_item(path, json_object):
-        _logger.info(f"{f'saving {path}: {len(json_object)}'}")
-        s3.put_object(
-            Bucket=CACHE_NAME,
-            Key=path,
-            Body=json_object
-        )
+    class _S3Store:
+        """The bucket as the remote store of a TieredCache (boto3 clients are thread-safe,
+        so requests need no lock)."""
+        def get(self, path, etag=None):
+            _create_bucket()
+            conditions = {'IfNoneMatch': etag} if etag else {}
+            try:
+                response = s3.get_object(Bucket=CACHE_NAME, Key=path, **conditions)
+            except s3.exceptions.NoSuchKey:
+                return None
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('304', 'NotModified'):
+                    return etag, None
+                raise
+            return response['ETag'], response['Body'].read()
 
-    def _get_item(path):
-        try:
-            response = s3.get_object(Bucket=CACHE_NAME, Key=path)
-        except s3.exceptions.NoSuchKey:
-            return None
-        body = response['Body'].read().decode("utf-8")
-        return body
+        def put(self, path, body):
+            _create_bucket()
+            _logger.info(f"{f'saving {path}: {len(body)}'}")
+            response = s3.put_object(
+                Bucket=CACHE_NAME,
+                Key=path,
+                Body=body
+            )
+            return response['ETag']
+
+        def delete(self, path):
+            _create_bucket()
+            s3.delete_object(Bucket=CACHE_NAME, Key=path)
+
+    _store = TieredCache(_S3Store(), MemoryTier(), DiskTier())
+
+    def save_cached_bytes(data, object_path):
+        """Store bytes keyed on object_path"""
+        _store.save(object_path, data)
 
-    def save_cached_object(obj, object_path):
-        """Store JSON serialized version of object keyed on object_path"""
-        _create_bucket()
-        with _cache_lock:
-            _put_item(object_path, json.dumps(obj))
+    def load_cached_bytes(object_path, fresh=False):
+        """Return bytes previously saved at object_path.
+        Raises CacheMissError if cache entry is missing. If fresh, a local copy is
+        revalidated against S3 however recently it was verified.
+        """
+        data = _store.load(object_path, fresh)
+        if not data:
+            raise CacheMissError(object_path)
+        return data
 
-    def load_cached_object(object_path):
-        """Return object previously saved at object_path.
-        Raises CacheMissError if cache entry is missing.
+    def load_cached_bytes_many(object_paths, fresh=False):
+        """Return a dict of the bytes saved at each of object_paths, loaded
+        concurrently. Paths with no cache entry are left out rather than raising
+        CacheMissError. fresh as for load_cached_bytes.
         """
-        _create_bucket()
-        with _cache_lock:
-            item = _get_item(object_path)
-            if not item:
-                raise CacheMissError(object_path)
-        return json.loads(item)
+        object_paths = list(dict.fromkeys(object_paths))
+        results = _in_parallel(_store.load, ((object_path, fresh) for object_path in object_paths))
+        return {object_path: data for object_path, data in zip(object_paths, results) if data}
+
+    def save_cached_bytes_many(items):
+        """Store each bytes value of the dict items at its object_path key, concurrently"""
+        _in_parallel(_store.save, items.items())
 
     def remove_cached_object(object_path):
-        _create_bucket()
-        s3.delete_object(Bucket=CACHE_NAME, Key=object_path)
+        _store.remove(object_path)
+
+    def cache_stats():
+        """Hit counts and ratios of the memory, disk and S3 tiers."""
+        return _store.stats
+
+def save_cached_object(obj, object_path):
+    """Store JSON serialized version of object keyed on object_path"""
+    save_cached_bytes(json.dumps(obj).encode("utf8"), object_path)
+
+def load_cached_object(object_path, fresh=False):
+    """Return object previously saved at object_path.
+    Raises CacheMissError if cache entry is missing. Pass fresh=True to read the
+    latest version before modifying and saving it back.
+    """
+    return json.loads(load_cached_bytes(object_path, fresh))
+
+def save_cached_objects(items):
+    """Store JSON serialized versions of the objects in the dict items, each keyed
+    on its object_path key, in one batch"""
+    save_cached_bytes_many({
+        object_path: json.dumps(obj).encode("utf8") for object_path, obj in items.items()})
+
+def load_cached_objects(object_paths, fresh=False):
+    """Return a dict of the objects previously saved at object_paths, loaded in one
+    batch. Paths with no cache entry are left out (a miss per key) rather than
+    raising CacheMissError. fresh as for load_cached_object.
+    """
+    return {object_path: json.loads(data)
+            for object_path, data in load_cached_bytes_many(object_paths, fresh).items()}
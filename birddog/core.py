@@ -6,6 +6,9 @@ Ukraine records archive monitor and scraper.
 """
 
 import time
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
 from urllib.parse import quote, unquote
 from cachetools import LRUCache
 import regex
@@ -14,18 +17,44 @@ from birddog.utility import (
     get_text,
     match_text,
     translate_page,
-    is_linked
+    is_linked,
+    convert_utc_time,
+    SingleFlight,
+    CallCounter,
     )
-from birddog.cache import load_cached_object, save_cached_object, CacheMissError
+from birddog.cache import (
+    load_cached_object,
+    save_cached_object,
+    load_cached_objects,
+    save_cached_objects,
+    load_cached_bytes,
+    save_cached_bytes,
+    load_cached_bytes_many,
+    save_cached_bytes_many,
+    CacheMissError,
+    )
+from birddog.pageformat import pack_page, unpack_page, PageFormatError
 from birddog.wiki import (
     ARCHIVE_BASE,
+    ARCHIVES,
+    WIKI_NAMESPACE,
     SUBARCHIVES,
     find_archive,
     HistoryLRU,
-    read_page,
+    mw_read_page,
     do_search,
     batch_fetch_document_links,
-    check_page_updates
+    check_page_updates,
+    compare_page_data,
+    compare_revisions,
+    page_annotations,
+    apply_page_annotations,
+    recent_page_updates,
+    refresh_existence_index,
+    crawl_batch,
+    revision_page,
+    known_latest_revid,
+    RC_MAX_AGE_DAYS,
     )
 from birddog.ai import classify_table_columns
 
@@ -62,6 +91,293 @@ def _entry_hit(entry, entry_id):
 
 _history_lru = HistoryLRU()
 
+# HTTP calls made by page loads from the wiki (cache misses)
+_page_load_stats = {'loads': 0, 'http_calls': 0}
+_page_load_stats_lock = threading.Lock()
+
+def _record_page_load(calls):
+    with _page_load_stats_lock:
+        _page_load_stats['loads'] += 1
+        _page_load_stats['http_calls'] += calls
+
+def page_load_stats():
+    """Number of page loads from the wiki and of the HTTP calls they made."""
+    with _page_load_stats_lock:
+        result = dict(_page_load_stats)
+    result['calls_per_load'] = result['http_calls'] / result['loads'] if result['loads'] else 0.0
+    return result
+
+# Title index: ids of the pages listed by each page's children, so that Page.lookup can
+# find an entry that is not listed on the page itself without loading every child
+
+TITLE_INDEX_SAVE_INTERVAL = 5 * 60 # seconds between saves of updates from page loads
+
+def _normalize_id(entry_id):
+    """Canonical form of an entry id: no spaces, one kind of dash and no leading zeros."""
+    entry_id = regex.sub(fr"[{_DASH_CHARS}]", "-", regex.sub(r"\s+", "", entry_id))
+    number, prefix, suffix = _parse_string(entry_id)
+    if number == float('inf'):
+        return entry_id
+    return f'{prefix}{number}{suffix}'
+
+def _entry_keys(entry):
+    """Normalized ids an entry (first cell of a row) can be looked up by: its text in
+    each language and the last part of its link."""
+    keys = {_normalize_id(text) for text in entry['text'].values() if text}
+    keys.add(_normalize_id(unquote(entry['link'].split('/')[-1])))
+    keys.discard('')
+    return keys
+
+class TitleIndex:
+    """Where to find the pages listed one level down from a page, kept per archive
+    (e.g. "DAZHO-D") as page name -> {normalized id: [entry id, link]} and persisted
+    in the cache.
+
+    Every page load records the rows of the page under the name of its parent, so the
+    parent's lookup of an id that it does not list itself is a single probe. Once all
+    children of a page have been searched, the page's version is recorded as complete,
+    and misses are final until the page or one of its children changes.
+    """
+    def __init__(self, persistent=True):
+        self._persistent = persistent
+        # archive name -> {'complete': {name: [lastmod, time]}, 'pages': {...},
+        #                  'lastmods': {parent name: {name: [lastmod, time it changed]}}}
+        self._indexes = {}
+        self._unsaved = {}  # archive name -> time of the oldest unsaved update
+        self._lock = threading.Lock()
+
+    def _cache_path(self, archive_name):
+        return f'title_index/{archive_name}.json'
+
+    @staticmethod
+    def _empty():
+        return {'version': 'v2', 'complete': {}, 'pages': {}, 'lastmods': {}}
+
+    @staticmethod
+    def _upgrade(index):
+        if index.get('version') == 'v1':
+            # completeness from before child versions were tracked
+            index = {'version': 'v2', 'complete': {name: [lastmod, 0] for name, lastmod in index['complete'].items()},
+                     'pages': index['pages'], 'lastmods': {}}
+        return index
+
+    def _index(self, archive_name):
+        # called with the lock held, after _load
+        return self._indexes.setdefault(archive_name, self._empty())
+
+    def _load(self, archive_names):
+        # bring the indexes of archive_names into memory; the cache is read outside the lock
+        with self._lock:
+            missing = {name for name in archive_names if name not in self._indexes}
+        if not missing:
+            return
+        loaded = {}
+        if self._persistent:
+            paths = {self._cache_path(name): name for name in missing}
+            loaded = {paths[path]: self._upgrade(index) for path, index in load_cached_objects(paths).items()}
+        with self._lock:
+            for name in missing:
+                self._indexes.setdefault(name, loaded.get(name, self._empty()))
+
+    @staticmethod
+    def _merge(index, other):
+        # fold in what another worker saved: every id, the latest of each version
+        for name, entry in other['complete'].items():
+            if name not in index['complete'] or entry[1] > index['complete'][name][1]:
+                index['complete'][name] = entry
+        for name, ids in other['pages'].items():
+            index['pages'][name] = {**ids, **index['pages'].get(name, {})}
+        for parent_name, lastmods in other['lastmods'].items():
+            mine = index['lastmods'].setdefault(parent_name, {})
+            for name, entry in lastmods.items():
+                if name not in mine or entry[1] > mine[name][1]:
+                    mine[name] = entry
+
+    def _save(self, archive_names):
+        if not self._persistent or not archive_names:
+            return
+        paths = {self._cache_path(name): name for name in archive_names}
+        # merge in what other workers saved meanwhile rather than overwrite it
+        stored = load_cached_objects(paths, fresh=True)
+        with self._lock:
+            snapshots = {}
+            for path, name in paths.items():
+                index = self._index(name)
+                if path in stored:
+                    self._merge(index, self._upgrade(stored[path]))
+                snapshots[path] = {**index, 'complete': dict(index['complete']),
+                                   'pages': {k: dict(v) for k, v in index['pages'].items()},
+                                   'lastmods': {k: dict(v) for k, v in index['lastmods'].items()}}
+        save_cached_objects(snapshots)
+
+    def record(self, name, page):
+        """Record the linked rows of page data under the name of its parent (name is the
+        name of the page)."""
+        if '/' not in name:
+            return # archive pages have no parent
+        parent_name = name.rsplit('/', 1)[0]
+        archive_name = name.split('/', 1)[0]
+        self._load([archive_name])
+        now = time.time()
+        with self._lock:
+            index = self._index(archive_name)
+            ids = index['pages'].setdefault(parent_name, {})
+            changed = False
+            for row in page.get('children') or []:
+                entry = row[0]
+                if not is_linked(entry.get('link')) or f'/wiki/{WIKI_NAMESPACE}:' not in unquote(entry['link']):
+                    continue # not a page of the archive
+                spec = [get_text(entry['text']), entry['link']]
+                for key in _entry_keys(entry):
+                    if key not in ids:
+                        ids[key] = spec
+                        changed = True
+            lastmods = index['lastmods'].setdefault(parent_name, {})
+            lastmod = page.get('lastmod', '')
+            if name not in lastmods or lastmods[name][0] != lastmod:
+                # a new version of a child may list entries the parent's search missed
+                lastmods[name] = [lastmod, now if name in lastmods else 0]
+                changed = True
+            if changed:
+                self._unsaved.setdefault(archive_name, now)
+            due = [archive for archive, since in self._unsaved.items() if now - since >= TITLE_INDEX_SAVE_INTERVAL]
+            for archive in due:
+                del self._unsaved[archive]
+        self._save(due)
+
+    def lookup(self, name, entry_id):
+        """(entry id, link) of the entry_id listed by a child of the page name, or None."""
+        archive_name = name.split('/', 1)[0]
+        self._load([archive_name])
+        with self._lock:
+            ids = self._index(archive_name)['pages'].get(name, {})
+            spec = ids.get(_normalize_id(entry_id))
+        return tuple(spec) if spec else None
+
+    def is_complete(self, name, lastmod):
+        """Whether all children of version lastmod of the page name have been recorded,
+        and none of them has changed since."""
+        archive_name = name.split('/', 1)[0]
+        self._load([archive_name])
+        with self._lock:
+            index = self._index(archive_name)
+            entry = index['complete'].get(name)
+            if not entry or entry[0] != lastmod:
+                return False
+            return all(changed <= entry[1] for _, changed in index['lastmods'].get(name, {}).values())
+
+    def set_complete(self, name, lastmod):
+        archive_name = name.split('/', 1)[0]
+        self._load([archive_name])
+        with self._lock:
+            self._index(archive_name)['complete'][name] = [lastmod, time.time()]
+            self._unsaved.pop(archive_name, None)
+        self._save([archive_name])
+
+    def flush(self):
+        """Save all unsaved updates."""
+        with self._lock:
+            archive_names = list(self._unsaved)
+            self._unsaved.clear()
+        self._save(archive_names)
+
+_title_index = TitleIndex()
+
+def _page_cache_path(name):
+    return f'page_cache/{name}'
+
+def _read_cached_page(data, path):
+    """Page data from the bytes stored at path, in the compact or the legacy format."""
+    try:
+        return unpack_page(data)
+    except PageFormatError as e:
+        _logger.error(f'Unreadable page in cache: {path}: {e}')
+        raise CacheMissError(path)
+
+def _load_cached_page(path):
+    """Page data stored at path, in the compact or the legacy format."""
+    return _read_cached_page(load_cached_bytes(path), path)
+
+def _save_cached_page(page, path):
+    """Store page data at path. Returns its size in bytes."""
+    data = pack_page(page)
+    save_cached_bytes(data, path)
+    return len(data)
+
+def _load_cached_pages(paths):
+    """Page data stored at each of paths and its size in bytes, as path -> (page,
+    size), loaded together. Paths with no readable page are left out."""
+    pages = {}
+    for path, data in load_cached_bytes_many(paths).items():
+        try:
+            pages[path] = (_read_cached_page(data, path), len(data))
+        except CacheMissError:
+            pass
+    return pages
+
+def _save_cached_pages(pages):
+    """Store the page data of the dict pages, each at its path key, together. Returns
+    the size of each in bytes."""
+    data = {path: pack_page(page) for path, page in pages.items()}
+    save_cached_bytes_many(data)
+    return {path: len(value) for path, value in data.items()}
+
+# Manifest of the revisions of a page in the page cache, newest first, stored next to
+# them as {'version': 'v1', 'revisions': [{'revid': ..., 'modified': ..., 'size': ...}]}.
+# With the revid of the latest revision known from the change feed, the manifest finds
+# the stored version without asking the wiki for the page history.
+
+def _manifest_path(name):
+    return f'{_page_cache_path(name)}/manifest.json'
+
+def _load_manifest(name):
+    """Stored revisions of the page name, newest first."""
+    try:
+        return load_cached_object(_manifest_path(name))['revisions']
+    except CacheMissError:
+        return []
+
+def _record_stored_revisions(revisions):
+    """Add stored revisions, given as (page name, revid, modified, size), to the
+    manifests of their pages. The manifests are loaded and saved in one batch each."""
+    paths = {_manifest_path(name) for name, *_ in revisions}
+    # fresh: other workers may have added revisions since this one last read them
+    manifests = {path: data['revisions'] for path, data in load_cached_objects(paths, fresh=True).items()}
+    changed = {}
+    for name, revid, modified, size in revisions:
+        path = _manifest_path(name)
+        entry = {'revid': revid, 'modified': modified, 'size': size}
+        stored = manifests.setdefault(path, [])
+        if entry not in stored:
+            stored[:] = sorted([item for item in stored if item['revid'] != revid] + [entry],
+                               key=lambda item: item['revid'], reverse=True)
+            changed[path] = {'version': 'v1', 'revisions': stored}
+    if changed:
+        save_cached_objects(changed)
+
+def _record_stored_revision(name, revid, modified, size):
+    _record_stored_revisions([(name, revid, modified, size)])
+
+def _load_child_document_links(title, children):
+    """Link the second cell of each case row of an opus page (title) to the case's
+    document. Returns True if any link was added."""
+    items = []
+    titles = []
+    for i, child in enumerate(children):
+        if is_linked(child[0].get('link')) and not is_linked(child[1].get('link')):
+            items.append(i)
+            titles.append(f"{title}/{get_text(child[0]['text'])}")
+    changed = False
+    if items:
+        doc_links = batch_fetch_document_links(titles)
+        for i, child_title in zip(items, titles):
+            links = doc_links.get(child_title)
+            if links:
+                # FIXME: what about multiple links? Ignoring them for now.
+                children[i][1]['link'] = links[0]
+                changed = True
+    return changed
+
 class Page:
     """Abstract base clase for all page types on the archive."""
     def __init__(self, spec, parent):
@@ -69,22 +385,29 @@ class Page:
         self._spec = spec
         self._page = {}
         self._column_header_map = None
-        if not self._cache_load():
+        self._child_histories_fetched = False
+        if self._cache_load():
+            _title_index.record(self.name, self._page)
+        else:
             # not in the cache - get it
             if self.default_url is not None:
                 _logger.info(f"{f'Loading page: {self.name} from {self.default_url}'}")
-                try:
-                    self._page = read_page(self.default_url)
-                    # ensure lastmod == history[0]
-                    history = self.history(limit=1)
-                    if history:
-                        self._page["lastmod"] = history[0]["modified"]
-                    # proactively get document links
-                    self.load_child_document_links(update_cache=False)
-                    self._cache_save()
-                except:
-                    # FIXME: bad page
-                    pass
+                with CallCounter() as calls:
+                    try:
+                        self._set_page(mw_read_page(self.default_url))
+                        # ensure lastmod == history[0]
+                        history = self.history(limit=1)
+                        if history:
+                            self._page["lastmod"] = history[0]["modified"]
+                        # proactively get document links
+                        self.load_child_document_links(update_cache=False)
+                        self._cache_save(revid=history[0]['revid'] if history else None)
+                        _title_index.record(self.name, self._page)
+                    except:
+                        # FIXME: bad page
+                        pass
+                _record_page_load(calls.count)
+                _logger.info(f'Loaded page: {self.name} ({calls.count} HTTP calls)')
 
     class LookupError(Exception):
         def __init__(self, page_name, key):
@@ -95,12 +418,26 @@ class Page:
 
     @property
     def _cache_path(self):
-        return f'page_cache/{self.name}'
+        return _page_cache_path(self.name)
+
+    def _set_page(self, data):
+        """Replace the page data (children prefetched for the old data may differ)."""
+        self._page = data
+        self._child_histories_fetched = False
 
     def _cache_load(self, version=None):
-        """Try to retrieve page contents from cache. Returns True if successful."""
+        """Try to retrieve page contents from cache. Returns True if successful.
+        Without a version, the latest version is found through the manifest when the
+        change feed knows its revid, and otherwise from the page history."""
         if not is_linked(self.default_url):
             return False
+        manifest = None
+        revid = None
+        if not version:
+            revid = known_latest_revid(self.title)
+            if revid is not None:
+                manifest = _load_manifest(self.name)
+                version = next((item['modified'] for item in manifest if item['revid'] == revid), None)
         if not version:
             # determine latest version
             history = self.history(limit=1)
@@ -108,29 +445,39 @@ class Page:
                 _logger.info(f"{self.name}: no history")
                 return False # bad page?
             version = history[0]["modified"]
+            revid = history[0]["revid"]
         path = f'{self._cache_path}/{version}.json'
         try:
             _logger.info(f"Fetching from cache: {self.name}[{version}]: {path}")
-            self._page = load_cached_object(path)
+            data = load_cached_bytes(path)
+            self._set_page(_read_cached_page(data, path))
             _logger.info(f"Retrieved from cache: {self.name}[{version}]: {path}")
-            return True
         except CacheMissError:
-            pass
-        return False
+            return False
+        if manifest is not None and all(item['revid'] != revid for item in manifest):
+            # stored before the page had a manifest: add it, so the next load needs no history
+            _record_stored_revision(self.name, revid, version, len(data))
+        return True
 
-    def _cache_save(self):
+    def _cache_save(self, revid=None):
         """Store the page contents in the cache, later retrievable under modification date.
+        Given the revid of the version, it is also added to the page's manifest.
         """
         if self.refmod:
             raise ValueError(f"Cannot save page when in comparison state: {self.name}") 
         if self.lastmod:
             path = f'{self._cache_path}/{self.lastmod}.json'
             _logger.info(f"Saving page to cache: {self.name}[{self.lastmod}]")
-            save_cached_object(self._page, path)
+            size = _save_cached_page(self._page, path)
+            if revid is not None:
+                _record_stored_revision(self.name, revid, self.lastmod, size)
 
-    def history(self, limit=None, cutoff_date=None):
+    def history(self, limit=None, cutoff_date=None, refresh=False):
         # needs to work if self._page is None
+        # refresh=True probes the wiki for the latest revision instead of trusting the cache
         if limit:
+            if refresh:
+                return _history_lru.revalidate(self.title)[:limit]
             return _history_lru.lookup(self.title, limit)
         if cutoff_date:
             return _history_lru.lookup_by_cutoff(self.title, cutoff_date=cutoff_date)
@@ -141,21 +488,58 @@ class Page:
         self._cache_load()
         return self
 
-    def revert_to(self, date):
-        """Revert page state to particular version date."""
+    def _version_data(self, date):
+        """Page data for the version current on the given date, or None if there is
+        none. Does not change the state of this page."""
         history = self.history(cutoff_date=date)
         if not history:
             _logger.info(f'No version exists on or before {date}')
             return None
         version = history[-1]
-        if self._cache_load(version=version['modified']):
-            return self
-
+        path = f'{self._cache_path}/{version["modified"]}.json'
+        try:
+            return _load_cached_page(path)
+        except CacheMissError:
+            pass
         _logger.info(f'Loading page: {self.name}, modified: {version["modified"]}')
-        self._page = read_page(version['link'])
-        self._cache_save()
+        data = mw_read_page(self.default_url, oldid=version['revid'])
+        size = _save_cached_page(data, path)
+        _record_stored_revision(self.name, version['revid'], version['modified'], size)
+        return data
+
+    def revert_to(self, date):
+        """Revert page state to particular version date."""
+        data = self._version_data(date)
+        if data is None:
+            return None
+        self._set_page(data)
         return self
 
+    def compared_to(self, date):
+        """Read-only view of this page annotated with the changes since the given date.
+        Comparisons are memoized on the revids of both versions. The wiki's diff between
+        the revisions is used when it maps onto the table rows, otherwise the reference
+        version is loaded in full."""
+        history = self.history(cutoff_date=date)
+        key = None
+        if history:
+            current = next((h['revid'] for h in history if h['modified'] == self.lastmod), None)
+            if current:
+                key = (self.name, current, history[-1]['revid'])
+        annotations = _compare_memo.lookup(key) if key else None
+        if annotations is not None:
+            return ComparedPage(self, apply_page_annotations(self._page, annotations))
+        compared = None
+        if key:
+            compared = compare_revisions(
+                self._page, self.title, history[-1]['revid'], current, history[-1]['modified'])
+        if compared is None:
+            reference = self._version_data(date)
+            compared = compare_page_data(self._page, reference or self._page)
+        if key:
+            _compare_memo.store(key, page_annotations(compared))
+        return ComparedPage(self, compared)
+
     @property
     def page(self):
         """Page data"""
@@ -252,6 +636,24 @@ class Page:
     def child_ids(self):
         return [item[0]['text']['uk'] for item in self.children]
 
+    @property
+    def child_titles(self):
+        """Titles of linked child pages (same form as Page.title)"""
+        return [unquote(row[0]['link'].split(':')[1]) for row in self.children
+                if is_linked(row[0].get('link')) and ':' in row[0]['link']]
+
+    def prefetch_child_histories(self):
+        """Fetch the latest revision of all children in bulk, so that loading
+        each child (which needs history(limit=1)) does not cost a request apiece.
+        Worth it only before loading many children: a single lookup is cheaper without.
+        """
+        if not self._child_histories_fetched and self.children:
+            # children whose latest revid is known find their cached version without it
+            titles = [title for title in self.child_titles if known_latest_revid(title) is None]
+            if titles:
+                _history_lru.lookup_many(titles, limit=1)
+            self._child_histories_fetched = True
+
     def _find_child_row(self, entry_id):
         return next((x for x in self.children if _entry_hit(x[0], entry_id)), None)
 
@@ -277,12 +679,19 @@ class Page:
                 return result
         except:
             pass
-        # last ditch: search children lists
-        for child_id in self.child_ids:
-            child = self.lookup(child_id)
-            row = child._find_child_row(entry_id)
-            if row:
-                return self.child_class((get_text(row[0]['text']), row[0]['link']), self)
+        # listed by one of the children: the title index knows where
+        spec = _title_index.lookup(self.name, entry_id)
+        if spec:
+            return self.child_class(spec, self)
+        if not _title_index.is_complete(self.name, self.lastmod):
+            # last ditch: search children lists (loading them records them in the index)
+            self.prefetch_child_histories()
+            for child_id in self.child_ids:
+                child = self.lookup(child_id)
+                row = child._find_child_row(entry_id)
+                if row:
+                    return self.child_class((get_text(row[0]['text']), row[0]['link']), self)
+            _title_index.set_complete(self.name, self.lastmod)
         # unable to find matching id
         raise LookupError(self.name, entry_id)
 
@@ -393,8 +802,13 @@ class Archive(Page):
     def default_url(self):
         return self._base + '/wiki/' + str(quote(self._archive_name))
 
+    @property
+    def title_prefix(self):
+        """Wiki title shared by all pages of the archive (e.g. "Архів:ДАЖО")"""
+        return self._archive_name.split('/')[0]
+
     def latest_changes(self, limit=100, offset=0):
-        return do_search(self._archive_name.split('/')[0], limit=limit, offset=offset)
+        return do_search(self.title_prefix, limit=limit, offset=offset)
 
 class Fond(Page):
     """Represents fond page."""
@@ -421,24 +835,9 @@ class Opus(Page):
         return f'{self.parent.parent.id} {self.parent.id}-{self.id}'
 
     def load_child_document_links(self, update_cache=True):
-        items = []
-        titles = []
-        for i, child in enumerate(self.children):
-            if is_linked(child[0].get('link')) and not is_linked(child[1].get('link')):
-                items.append(i)
-                titles.append(f"{self.title}/{get_text(child[0]['text'])}")
-        if items:
-            need_save = False
-            doc_links = batch_fetch_document_links(titles)
-            for i, title in zip(items, titles):
-                links = doc_links.get(title)
-                if links:
-                    # FIXME: what about multiple links? Ignoring them for now.
-                    self.children[i][1]['link'] = links[0]
-                    need_save = True
-            if update_cache and need_save:
-                _logger.info(f'load_child_document_links({self.name}) updating cache')
-                self._cache_save()
+        if _load_child_document_links(self.title, self.children) and update_cache:
+            _logger.info(f'load_child_document_links({self.name}) updating cache')
+            self._cache_save()
 
 class Case(Page):
     """Represents case page."""
@@ -446,10 +845,102 @@ class Case(Page):
     def kind(self):
         return 'case'
 
+class ComparedPage:
+    """A page seen through the annotations of a comparison with a prior version.
+
+    The annotated page data shares everything it does not annotate with the page, so
+    the page (which may be in the LRU) is neither copied nor modified. All other
+    attributes are those of the page itself.
+    """
+    def __init__(self, page, compared):
+        self._base_page = page
+        self._compared = compared
+
+    def __getattr__(self, name):
+        return getattr(self._base_page, name)
+
+    @property
+    def page(self):
+        return self._compared
+
+    @property
+    def children(self):
+        return self._compared.get('children')
+
+    @property
+    def refmod(self):
+        return self._compared.get('refmod', '')
+
+class CompareMemo:
+    """Page comparison annotations keyed on (page name, revid, reference revid).
+
+    Both revisions are immutable, so entries never go stale. They are held in an LRU
+    and persisted in the cache in the compact form of page_annotations().
+    """
+    def __init__(self, maxsize=200):
+        self._lru = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def _cache_path(self, key):
+        name, revid, ref_revid = key
+        return f'compare_cache/{name}/{revid}-{ref_revid}.json'
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def lookup(self, key):
+        with self._lock:
+            annotations = self._lru.get(key)
+        if annotations is None:
+            try:
+                annotations = load_cached_object(self._cache_path(key))
+                with self._lock:
+                    self._lru[key] = annotations
+            except CacheMissError:
+                pass
+        with self._lock:
+            self._stats['hits' if annotations is not None else 'misses'] += 1
+        _logger.info(f"CompareMemo.lookup({key}): {'hit' if annotations is not None else 'miss'}")
+        return annotations
+
+    def store(self, key, annotations):
+        with self._lock:
+            self._lru[key] = annotations
+        save_cached_object(annotations, self._cache_path(key))
+
+_compare_memo = CompareMemo()
+
+def compare_stats():
+    """Hit/miss counts of the page comparison memo."""
+    return _compare_memo.stats
+
 # ----------------------------------------------------------------------------
 # Page LRU memory cache
 
+# seconds before a cached page is revalidated, by page kind
+PAGE_TTL = {
+    'archive': 30 * 60,
+    'fond': 60 * 60,
+    'opus': 60 * 60,
+    'case': 2 * 60 * 60,
+}
+
 class PageLRU:
+    """LRU of loaded pages keyed on page address.
+
+    Each entry expires independently after the TTL for its kind of page. An expired
+    entry is still served (stale-while-revalidate) while a background thread checks
+    it against history(limit=1) and reloads it only if the page has changed.
+
+    If the refresh fails, the entry is evicted, so the next lookup loads the page
+    again rather than serving it stale indefinitely.
+
+    Safe for concurrent use: the lock only guards the LRU itself, page loads run
+    outside it (and are coalesced per key).
+    """
     class NotFoundError(Exception):
         def __init__(self, address):
             self._address = address
@@ -459,10 +950,17 @@ class PageLRU:
         def address(self):
             return self._address
 
-    def __init__(self, maxsize=500, reset_limit=60 * 60):
-        self._reset_limit = reset_limit # seconds
-        self._timer_start = time.time()
-        self._lru = LRUCache(maxsize=maxsize)
+    def __init__(self, maxsize=500, ttl=None):
+        self._ttl = {**PAGE_TTL, **(ttl or {})}
+        self._lru = LRUCache(maxsize=maxsize) # key -> (page, time loaded or revalidated)
+        self._lock = threading.Lock()
+        self._loads = SingleFlight('pages')
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'refreshes': 0, 'reloads': 0, 'failures': 0}
+        self._stats_lock = threading.Lock()
+        self._refresh_queue = queue.Queue()
+        self._refresh_pending = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
 
     def _key(self, archive, subarchive, fond=None, opus=None, case=None):
         return (archive or '', subarchive or '', fond or '', opus or '', case or '')
@@ -472,43 +970,292 @@ class PageLRU:
         parts = rest.split('/')
         return (a, *parts)
 
+    def _get(self, key):
+        with self._lock:
+            return self._lru.get(key)
+
+    def _put(self, key, item):
+        with self._lock:
+            self._lru[key] = (item, time.time())
+
+    def _evict(self, key):
+        with self._lock:
+            self._lru.pop(key, None)
+
+    def _count(self, counter):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            return {**self._stats, 'coalesced': self._loads.coalesced}
+
     def lookup_child(self, page, child_id):
         return self.lookup(*(*self._page_key(page), child_id))
 
     def lookup(self, archive, subarchive, fond=None, opus=None, case=None):
-        # periodically flush the lru to ensure the pages don't become stale
-        if time.time() - self._timer_start >= self._reset_limit:
-            _logger.info(f"PageLRU: flushing all entries")
-            self._lru.clear()
-            self._timer_start = time.time()
-
+        key = self._key(archive, subarchive, fond, opus, case)
+        entry = self._get(key)
+        if entry is not None:
+            item, validated = entry
+            if time.time() - validated < self._ttl.get(item.kind, PAGE_TTL['case']):
+                self._count('hits')
+                _logger.info(f"{f'PageLRU.lookup({key}): hit'}")
+            else:
+                self._count('stale')
+                _logger.info(f"{f'PageLRU.lookup({key}): stale'}")
+                self._schedule_refresh(key)
+            return item
+        self._count('misses')
+        _logger.info(f"{f'PageLRU.lookup({key}): miss'}")
+        # concurrent misses on the same key wait for the first caller's load
+        return self._loads.do(key, self._load_entry, key)
+
+    def _load_entry(self, key):
+        entry = self._get(key)
+        if entry is not None:
+            return entry[0] # loaded while this caller was getting here
+        item = self._load(*key)
+        self._put(key, item)
+        return item
+
+    def _load(self, archive, subarchive, fond=None, opus=None, case=None):
         key = self._key(archive, subarchive, fond, opus, case)
         try:
-            item = self._lru[key]
-            _logger.info(f"{f'PageLRU.lookup({key}): hit'}")
+            if not fond:
+                # the key holds '' for a missing subarchive, Archive takes None for the default
+                item = Archive(archive, subarchive=subarchive or None)
+            elif not opus:
+                parent = self.lookup(archive, subarchive)
+                item = parent.lookup(fond)
+            elif not case:
+                parent = self.lookup(archive, subarchive, fond)
+                item = parent.lookup(opus)
+            else:
+                parent = self.lookup(archive, subarchive, fond, opus)
+                item = parent.lookup(case)
+            if not item:
+                raise PageLRU.NotFoundError(key)
             return item
-        except KeyError:
-            _logger.info(f"{f'PageLRU.lookup({key}): miss'}")
+        except Page.LookupError:
+            _logger.error(f'PageLRU: exception during page lookup')
+            _logger.info(f'... failed to find child page: parent={parent.name}, key={key}')
+            raise PageLRU.NotFoundError(key)
+
+    def _schedule_refresh(self, key):
+        with self._refresh_lock:
+            if key in self._refresh_pending:
+                return
+            self._refresh_pending.add(key)
+            if not self._refresh_thread:
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_worker, name='page-lru-refresh', daemon=True)
+                self._refresh_thread.start()
+        self._refresh_queue.put(key)
+
+    def _refresh_worker(self):
+        while True:
+            key = self._refresh_queue.get()
             try:
-                if not fond:
-                    item = Archive(archive, subarchive=subarchive)
-                elif not opus:
-                    parent = self.lookup(archive, subarchive)
-                    item = parent.lookup(fond)
-                elif not case:
-                    parent = self.lookup(archive, subarchive, fond)
-                    item = parent.lookup(opus)
-                else:
-                    parent = self.lookup(archive, subarchive, fond, opus)
-                    item = parent.lookup(case)
-                if not item:
-                    raise PageLRU.NotFoundError(key)
-                self._lru[key] = item
-                return item
-            except Page.LookupError:
-                _logger.error(f'PageLRU: exception during page lookup')
-                _logger.info(f'... failed to find child page: parent={parent.name}, key={key}')
-                raise PageLRU.NotFoundError(key)
+                self._refresh(key)
+            except Exception:
+                _logger.exception(f'PageLRU: failed to refresh {key}')
+                self._evict(key)
+                self._count('failures')
+            finally:
+                with self._refresh_lock:
+                    self._refresh_pending.discard(key)
+
+    def _refresh(self, key):
+        entry = self._get(key)
+        if entry is None:
+            return
+        item = entry[0]
+        history = item.history(limit=1, refresh=True)
+        if not history or history[0]['modified'] != item.lastmod:
+            _logger.info(f"PageLRU.refresh({key}): page changed, reloading")
+            item = self._load(*key)
+            self._count('reloads')
+        self._put(key, item)
+        self._count('refreshes')
+
+# ----------------------------------------------------------------------------
+# Archive crawler
+
+def _crawl_key(title):
+    # page title without namespace, in the form the API returns it
+    return title.replace('_', ' ')
+
+def _child_names(name, page):
+    """Names of the pages linked from the rows of a page (name), keyed on title,
+    as Page.lookup gives them."""
+    names = {}
+    directory = page.get('link', '').replace(ARCHIVE_BASE, '').rsplit('/', 1)[0]
+    for row in page.get('children') or []:
+        link = row[0].get('link')
+        if not is_linked(link) or not link.startswith('/wiki/') or ':' not in link:
+            continue
+        parent_name = name
+        if link.rsplit('/', 1)[0] == directory and '/' in name:
+            parent_name = name.rsplit('/', 1)[0] # child at peer level
+        names[_crawl_key(unquote(link.split(':', 1)[1]))] = f'{parent_name}/{get_text(row[0]["text"])}'
+    return names
+
+class ArchiveCrawler:
+    """Pre-warms the page cache with every page of an archive (all its subarchives).
+
+    The pages under the archive's title prefix are enumerated in title order with
+    generator=allpages and read with the wikitext of their latest revision, one batch
+    per request. Each page is saved to the page cache under the name Page gives it,
+    which comes from the row linking to it in its parent. A parent's title sorts
+    before those of its children, so the names of the pages still to be crawled are
+    carried along with the continuation, and the crawl state is saved in the cache
+    after every batch: an interrupted crawl resumes where it stopped.
+
+    Pages not linked from a parent (or linked before it was crawled) are counted as
+    unmapped and left to be loaded on demand.
+    """
+    def __init__(self, tag):
+        self._tag = tag
+        self._prefix = find_archive(tag)['title']['uk'].split('/')[0]
+
+    @property
+    def _cache_path(self):
+        return f'crawls/{self._tag}.json'
+
+    def _load(self):
+        try:
+            return load_cached_object(self._cache_path)
+        except CacheMissError:
+            return None
+
+    def _save(self, state):
+        save_cached_object(state, self._cache_path)
+
+    def _new_state(self):
+        # the archive pages themselves are loaded up front, since the titles of their
+        # fonds may sort before theirs
+        names = {}
+        for sub in ARCHIVES[self._tag].values():
+            archive = Archive(self._tag, sub['subarchive']['en'])
+            names[_crawl_key(archive.title)] = archive.name
+            names.update(_child_names(archive.name, archive.page))
+        return {
+            'version': 'v1',
+            'prefix': self._prefix,
+            'started': time.time(),
+            'updated': time.time(),
+            'continue': {},
+            'done': False,
+            'last': None,
+            'pages': 0,     # pages crawled
+            'saved': 0,     # pages read and saved to the page cache
+            'cached': 0,    # pages whose latest version was already in the cache
+            'unmapped': 0,  # pages with no known name
+            'failed': 0,    # pages that could not be read
+            'names': names, # title -> name of pages still to be crawled
+        }
+
+    @staticmethod
+    def _revision_path(name, revision):
+        return f"{_page_cache_path(name)}/{convert_utc_time(revision['timestamp'])}.json"
+
+    def _prefetch(self, state, revisions):
+        """Look up the pages of a batch that are already named in the cache together:
+        a dict of path -> (page, size), or None if it is not cached. Pages named by a
+        parent in the same batch are looked up as they come."""
+        paths = []
+        for revision in revisions:
+            name = state['names'].get(_crawl_key(revision['title'].split(':', 1)[1]))
+            if name is not None:
+                paths.append(self._revision_path(name, revision))
+        pages = _load_cached_pages(paths)
+        return {path: pages.get(path) for path in paths}
+
+    def _crawl_page(self, state, revision, cached, stored, unsaved):
+        """Crawl one page of a batch, given the result of _prefetch. The page is added
+        to stored as path -> (name, revid, modified, size), with no size yet if it is
+        added to unsaved (path -> page data) to be saved."""
+        title = _crawl_key(revision['title'].split(':', 1)[1])
+        state['pages'] += 1
+        state['last'] = title
+        name = state['names'].pop(title, None)
+        if name is None:
+            state['unmapped'] += 1
+            return
+        path = self._revision_path(name, revision)
+        found = cached[path] if path in cached else _load_cached_pages([path]).get(path)
+        if found is not None:
+            page, size = found
+            state['cached'] += 1
+        else:
+            try:
+                page = revision_page(revision)
+                if name.count('/') == 2: # opus: link cases to their documents, as Opus does
+                    _load_child_document_links(title, page['children'])
+            except Exception as e:
+                _logger.error(f'ArchiveCrawler({self._tag}): failed to read {title}: {e}')
+                state['failed'] += 1
+                return
+            unsaved[path] = page
+            size = None
+            state['saved'] += 1
+        stored[path] = (name, revision['revid'], convert_utc_time(revision['timestamp']), size)
+        _title_index.record(name, page)
+        if '/' in name: # the children of archive pages were named up front
+            root = f'{self._prefix.split(":", 1)[1]}/'
+            state['names'].update(
+                (t, n) for t, n in _child_names(name, page).items() if t.startswith(root))
+
+    @staticmethod
+    def _progress(state):
+        progress = {key: state[key] for key in (
+            'prefix', 'done', 'last', 'pages', 'saved', 'cached', 'unmapped', 'failed')}
+        progress['pending'] = len(state['names'])
+        progress['elapsed'] = state['updated'] - state['started']
+        return progress
+
+    def progress(self):
+        """Progress of the current (or last) crawl, or None if there has been none."""
+        state = self._load()
+        return self._progress(state) if state else None
+
+    def crawl(self, restart=False, max_batches=None, progress_callback=None):
+        """Crawl the archive, resuming an unfinished crawl unless restart. Stops after
+        max_batches batches if given. progress_callback is called with the progress
+        after each batch. Returns the progress."""
+        refresh_existence_index(self._prefix)
+        state = None if restart else self._load()
+        if state is None or state['done']:
+            state = self._new_state()
+            self._save(state)
+        batches = 0
+        while not state['done'] and (max_batches is None or batches < max_batches):
+            revisions, cont = crawl_batch(self._prefix, state['continue'])
+            cached = self._prefetch(state, revisions)
+            stored = {}
+            unsaved = {}
+            for revision in revisions:
+                self._crawl_page(state, revision, cached, stored, unsaved)
+            sizes = _save_cached_pages(unsaved)
+            _record_stored_revisions(
+                [(name, revid, modified, sizes.get(path, size))
+                 for path, (name, revid, modified, size) in stored.items()])
+            state['continue'] = cont
+            state['done'] = cont is None
+            state['updated'] = time.time()
+            self._save(state)
+            _title_index.flush()
+            batches += 1
+            progress = self._progress(state)
+            _logger.info(f"ArchiveCrawler({self._tag}): {progress['pages']} pages, "
+                         f"{progress['saved']} saved, {progress['cached']} cached, "
+                         f"{progress['unmapped']} unmapped, {progress['failed']} failed, "
+                         f"at {progress['last']}")
+            if progress_callback:
+                progress_callback(progress)
+        return self._progress(state)
 
 # ----------------------------------------------------------------------------
 # Update watcher
@@ -564,6 +1311,112 @@ def _make_tree(unresolved):
         pos['unresolved'] = value
     return root
 
+CHANGE_FEED_MAX_AGE = 5 * 60 # seconds before a change feed is polled again
+
+class ChangeFeed:
+    """Change summary for one archive/subarchive, kept up to date incrementally from the
+    wiki's RecentChanges list and persisted in the cache.
+
+    Each poll only downloads the edits made since the previous poll's high-water mark,
+    and one feed serves every watcher of the same archive.
+    """
+    _feeds = {}
+    _feeds_lock = threading.Lock()
+
+    def __init__(self, archive):
+        self._archive = archive
+        self._since = None      # earliest date (standard form) the feed covers
+        self._high_water = None # API timestamp of the newest change seen
+        self._polled = 0        # time of the last poll
+        self._changes = {}      # watcher key -> latest modification date
+        self._lock = threading.Lock()
+
+    @classmethod
+    def lookup(cls, archive):
+        """Return the shared feed for an archive page."""
+        with cls._feeds_lock:
+            feed = cls._feeds.get(archive.name)
+        if feed:
+            return feed
+        # load outside the lock: lookups of other archives need not wait on the cache
+        feed = cls(archive)
+        feed._load()
+        with cls._feeds_lock:
+            return cls._feeds.setdefault(archive.name, feed)
+
+    @property
+    def _cache_path(self):
+        return f'change_feeds/{self._archive.name}.json'
+
+    def _load(self, fresh=False):
+        try:
+            data = load_cached_object(self._cache_path, fresh)
+        except CacheMissError:
+            return False
+        self._since = data['since']
+        self._high_water = data['high_water']
+        self._polled = data['polled']
+        self._changes = data['changes']
+        return True
+
+    def save(self):
+        save_cached_object({
+            'version': 'v1',
+            'since': self._since,
+            'high_water': self._high_water,
+            'polled': self._polled,
+            'changes': self._changes,
+        }, self._cache_path)
+
+    @property
+    def since(self):
+        return self._since
+
+    @property
+    def changes(self):
+        return self._changes
+
+    @property
+    def is_fresh(self):
+        return time.time() - self._polled < CHANGE_FEED_MAX_AGE
+
+    def poll(self, force=False):
+        """Fetch the edits made since the last poll and merge them into the summary."""
+        with self._lock:
+            if not force and not self.is_fresh:
+                self._load(fresh=True) # another worker may have polled already
+            if not force and self.is_fresh:
+                return
+            # the feed reaches back no further than the wiki keeps recent changes
+            oldest = datetime.now(timezone.utc) - timedelta(days=RC_MAX_AGE_DAYS)
+            oldest = oldest.strftime('%Y-%m-%dT%H:%M:%SZ')
+            start = self._high_water
+            if not start:
+                # first poll: start as far back as possible
+                start = oldest
+                self._since = convert_utc_time(start)
+            updates, high_water = recent_page_updates(self._archive, start=start)
+            for key, mod_date in updates.items():
+                if key not in self._changes or mod_date > self._changes[key]:
+                    self._changes[key] = mod_date
+            self._prune(convert_utc_time(oldest))
+            self._high_water = high_water or start
+            self._polled = time.time()
+            self.save()
+
+    def _prune(self, oldest):
+        # drop changes older than the feed reaches back, so it does not grow without bound
+        if self._since and self._since >= oldest:
+            return
+        self._changes = {key: value for key, value in self._changes.items() if value >= oldest}
+        self._since = oldest
+
+    def changes_since(self, date):
+        """Changes made on or after date, or None if the feed does not reach back that far."""
+        if not self._since or date < self._since:
+            return None
+        return {key: value for key, value in self._changes.items() if value >= date}
+
 class ArchiveWatcher:
     def __init__(self, archive, subarchive, cutoff_date, lru=None):
         self._lru = lru if lru else PageLRU()
@@ -672,7 +1525,12 @@ class ArchiveWatcher:
                     _add_result(kwargs)
             return _merge_result(result, changes)
 
-        updates = check_page_updates(self._archive, self._last_checked_date)
+        feed = ChangeFeed.lookup(self._archive)
+        feed.poll()
+        updates = feed.changes_since(self._last_checked_date)
+        if updates is None:
+            # checking back further than the change feed reaches: search instead
+            updates = check_page_updates(self._archive, self._last_checked_date)
         if updates:
             updates = _check_ancestors(updates)
             for item, mod_date in updates.items():
@@ -0,0 +1,145 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+# Row-keyed diff of page tables
+#
+# Each row is keyed on the normalised Ukrainian text of its first cell (the entry id)
+# plus an occurrence count, so duplicate ids are matched in order rather than all
+# colliding on the last one. Each row's content is hashed once, and rows are matched
+# through the key index in a single pass:
+#
+#   added    key is not in the reference
+#   removed  reference key is not in the current table
+#   changed  key is in both but some cell text or link differs
+#   moved    key is in both but out of order relative to the other matched rows
+#
+# Columns are matched by header text, so reordered columns are not reported as edits.
+
+from bisect import bisect_left
+
+from birddog.utility import is_linked
+
+def _normalize(text_item):
+    return ' '.join(text_item.get('uk', '').split()) if isinstance(text_item, dict) else ''
+
+def _cell_text(item):
+    return _normalize(item.get('text'))
+
+def _cell_link(item):
+    link = item.get('link')
+    return link if is_linked(link) else None
+
+def _keys(texts):
+    """(text, occurrence) key for each of a list of normalised texts."""
+    seen = {}
+    keys = []
+    for text in texts:
+        count = seen.get(text, 0)
+        seen[text] = count + 1
+        keys.append((text, count))
+    return keys
+
+def row_keys(rows):
+    """Key of each table row, distinguishing rows that share an entry id."""
+    return _keys([_cell_text(row[0]) if row else '' for row in rows])
+
+def column_map(header, ref_header):
+    """Reference column index for each current column (None for a new column).
+    Columns are matched by header text, falling back to position for columns
+    whose header is not found (e.g. a renamed header).
+    """
+    if not header or not ref_header:
+        return None # match by position
+    ref_index = dict((key, j) for j, key in enumerate(_keys(map(_normalize, ref_header))))
+    mapping = [ref_index.get(key) for key in _keys(map(_normalize, header))]
+    claimed = set(mapping)
+    for j, ref_col in enumerate(mapping):
+        if ref_col is None and j < len(ref_header) and j not in claimed:
+            mapping[j] = j
+            claimed.add(j)
+    return mapping
+
+def _project(row, mapping, width):
+    """Reference row cells in the current column order (None where missing)."""
+    if mapping is None:
+        return [row[j] if j < len(row) else None for j in range(width)]
+    return [row[j] if j is not None and j < len(row) else None for j in mapping[:width]]
+
+def _signature(cells):
+    return hash(tuple((_cell_text(c), _cell_link(c)) if c is not None else None for c in cells))
+
+def _in_order(positions):
+    """Indices into positions that form a longest increasing subsequence; the
+    rest are the smallest set of rows that must have moved."""
+    tails, tail_index, previous = [], [], [None] * len(positions)
+    for i, position in enumerate(positions):
+        k = bisect_left(tails, position)
+        if k == len(tails):
+            tails.append(position)
+            tail_index.append(i)
+        else:
+            tails[k] = position
+            tail_index[k] = i
+        previous[i] = tail_index[k - 1] if k > 0 else None
+    result = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        result.add(i)
+        i = previous[i]
+    return result
+
+def _annotate(row, ref_cells, moved):
+    result = []
+    for j, item in enumerate(row):
+        ref_item = ref_cells[j] if j < len(ref_cells) else None
+        if ref_item is None:
+            edit = 'added'
+        elif _cell_text(item) != _cell_text(ref_item):
+            edit = 'changed'
+        else:
+            edit = 'moved' if moved and j == 0 else None
+        item = {**item, 'edit': edit}
+        link = _cell_link(item)
+        if link:
+            ref_link = _cell_link(ref_item) if ref_item is not None else None
+            if ref_link:
+                item['link_edit'] = 'changed' if link != ref_link else None
+            else:
+                item['link_edit'] = 'added'
+        result.append(item)
+    return result
+
+def diff_rows(rows, ref_rows, header=None, ref_header=None):
+    """
+    Compare table rows to those of a prior version of the table.
+    Returns (annotated rows, removed reference rows). Unchanged rows are returned
+    as they are (not copied); every cell of the other rows has an 'edit' of None,
+    'added', 'changed' or 'moved' (on the key cell of a moved row), and linked cells
+    of matched rows also a 'link_edit'. Neither argument is modified.
+    """
+    mapping = column_map(header, ref_header)
+    ref_index = dict((key, i) for i, key in enumerate(row_keys(ref_rows)))
+    matches = []   # (row index, reference row index) in current order
+    for i, key in enumerate(row_keys(rows)):
+        ref_i = ref_index.pop(key, None)
+        if ref_i is not None:
+            matches.append((i, ref_i))
+    in_order = _in_order([ref_i for _, ref_i in matches])
+
+    result = [None] * len(rows)
+    for n, (i, ref_i) in enumerate(matches):
+        row = rows[i]
+        ref_cells = _project(ref_rows[ref_i], mapping, len(row))
+        moved = n not in in_order
+        # identical cells (compared in C) are the common case; otherwise compare
+        # just the normalised texts and links
+        if not moved and (row == ref_cells or _signature(row) == _signature(ref_cells)):
+            result[i] = row
+        else:
+            result[i] = _annotate(row, ref_cells, moved)
+    for i, row in enumerate(rows):
+        if result[i] is None:
+            result[i] = [{**item, 'edit': 'added'} for item in row]
+
+    removed = [ref_rows[ref_i] for ref_i in sorted(ref_index.values())]
+    return result, removed
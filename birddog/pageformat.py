@@ -0,0 +1,142 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+# Compact serialization of page data for the page cache
+#
+# Page data repeats a {'text': {'uk': ..., 'en': ...}, 'link': ...} dict for every
+# cell of tables of thousands of rows, and most links of a column share everything
+# but their last part. The packed form stores the table by column instead: the uk
+# and en texts and the links of each column as lists, with the links split into an
+# interned prefix (an index into a table of prefixes) and the rest. Rows with cells
+# of any other shape are stored as they are. The result is JSON (orjson when it is
+# installed), compressed with zstd (when zstandard is installed) or gzip.
+#
+# unpack_page() also reads pages stored in the legacy form, plain JSON text.
+
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PAGE_FORMAT_VERSION = 'v2'
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+class PageFormatError(Exception):
+    """Raised for packed page data that cannot be read here (e.g. zstd without zstandard)."""
+
+def _dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode("utf8")
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _compress(data):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=6).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def _decompress(data):
+    if data.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise PageFormatError('page is zstd compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def _is_plain_cell(cell):
+    return (isinstance(cell, dict) and cell.keys() == {'text', 'link'}
+            and isinstance(cell['text'], dict) and cell['text'].keys() <= {'uk', 'en'}
+            and all(isinstance(text, str) for text in cell['text'].values())
+            and (cell['link'] is None or isinstance(cell['link'], str)))
+
+def _pack_link(link, prefixes, prefix_ids):
+    if link is None or '/' not in link:
+        return link
+    prefix, rest = link.rsplit('/', 1)
+    if prefix not in prefix_ids:
+        prefix_ids[prefix] = len(prefixes)
+        prefixes.append(prefix)
+    return [prefix_ids[prefix], rest]
+
+def _unpack_link(link, prefixes):
+    if link is None or isinstance(link, str):
+        return link
+    prefix_id, rest = link
+    return f'{prefixes[prefix_id]}/{rest}'
+
+def _pack_rows(rows):
+    widths = []
+    columns = []
+    raw_rows = {}
+    prefixes = []
+    prefix_ids = {}
+    for i, row in enumerate(rows):
+        if not isinstance(row, list) or not all(_is_plain_cell(cell) for cell in row):
+            widths.append(-1)
+            raw_rows[str(i)] = row
+            continue
+        widths.append(len(row))
+        while len(columns) < len(row):
+            columns.append({'uk': [], 'en': [], 'link': []})
+        for column, cell in zip(columns, row):
+            column['uk'].append(cell['text'].get('uk'))
+            column['en'].append(cell['text'].get('en'))
+            column['link'].append(_pack_link(cell['link'], prefixes, prefix_ids))
+    for column in columns:
+        if not any(text is not None for text in column['en']):
+            column['en'] = None # not translated
+    return {'widths': widths, 'columns': columns, 'raw_rows': raw_rows, 'prefixes': prefixes}
+
+def _unpack_text(uk, en):
+    if en is None:
+        return {} if uk is None else {'uk': uk}
+    return {'en': en} if uk is None else {'uk': uk, 'en': en}
+
+def _unpack_column(column, prefixes):
+    # the cells of a column, built in one pass
+    en = column['en'] or [None] * len(column['uk'])
+    return iter([{'text': _unpack_text(uk, en), 'link': _unpack_link(link, prefixes)}
+                 for uk, en, link in zip(column['uk'], en, column['link'])])
+
+def _unpack_rows(packed):
+    cells = [_unpack_column(column, packed['prefixes']) for column in packed['columns']]
+    rows = []
+    for i, width in enumerate(packed['widths']):
+        if width < 0:
+            rows.append(packed['raw_rows'][str(i)])
+        else:
+            rows.append([next(column) for column in cells[:width]])
+    return rows
+
+def pack_page(page):
+    """Page data in the compact, compressed form."""
+    packed = {key: value for key, value in page.items() if key != 'children'}
+    packed = {'version': PAGE_FORMAT_VERSION, 'page': packed}
+    if 'children' in page:
+        packed['children'] = None if page['children'] is None else _pack_rows(page['children'])
+    return _compress(_dumps(packed))
+
+def unpack_page(data):
+    """Page data from either the compact form or legacy JSON text."""
+    if not data.startswith((_GZIP_MAGIC, _ZSTD_MAGIC)):
+        return _loads(data) # legacy
+    packed = _loads(_decompress(data))
+    if packed.get('version') != PAGE_FORMAT_VERSION:
+        raise PageFormatError(f"unknown page format version {packed.get('version')}")
+    page = dict(packed['page'])
+    if 'children' in packed:
+        page['children'] = None if packed['children'] is None else _unpack_rows(packed['children'])
+    return page
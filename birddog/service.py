@@ -1,16 +1,22 @@
 # system packages
 import os
+import time
 import threading
+import tempfile
 import re
 import unicodedata
 from io import BytesIO
-from copy import copy, deepcopy
+from copy import copy
 from datetime import datetime
 from cachetools import LRUCache
 from collections import defaultdict
 from itsdangerous import URLSafeTimedSerializer
 import smtplib
 from email.message import EmailMessage
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # not on Windows
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import (
     Flask,
@@ -25,14 +31,21 @@ from flask import (
 # Birddog packages
 from birddog.core import (
     PageLRU,
-    ArchiveWatcher)
+    ArchiveWatcher,
+    ChangeFeed,
+    CHANGE_FEED_MAX_AGE,
+    compare_stats,
+    page_load_stats)
 from birddog.excel import export_page
 from birddog.cache import (
     load_cached_object,
     save_cached_object,
+    save_cached_objects,
     remove_cached_object,
+    cache_stats,
     CacheMissError)
-from birddog.wiki import check_page_changes, all_archives
+from birddog.wiki import all_archives, refresh_existence_index
+from birddog.utility import fetch_stats, single_flight_stats
 
 from birddog.logging import get_logger, get_log_buffer
 _logger = get_logger()
@@ -57,6 +70,9 @@ SMTP_PASSWORD = os.getenv('BIRDDOG_SMTP_PASSWORD', '')  # For password reset
 def _hide(text):
     return f'{text[:3]}...'
 
+def _user_cache_path(email):
+    return f'users/{email}.json'
+
 def _watcher_cache_path(email, archive, subarchive):
     return f'watchers/{email}/{archive}-{subarchive}.json'
 
@@ -92,6 +108,7 @@ class User:
                 'cutoff_date': cutoff_date
             }
             self.save()
+        change_feed_poller.watch(archive, subarchive, self.email)
 
     def remove_from_watchlist(self, archive, subarchive):
         key = _watchlist_key(archive, subarchive)
@@ -100,6 +117,7 @@ class User:
                 return False
             del self.watchlist[key]
             self.save()
+        change_feed_poller.unwatch(archive, subarchive, self.email)
 
         # Remove associated watcher file (outside lock)
         watcher_path = _watcher_cache_path(self.email, archive, subarchive)
@@ -114,6 +132,7 @@ class User:
         with self._lock:
             if key not in self.watchlist:
                 raise KeyError(f"Watchlist item not found: {key}")
+            change_feed_poller.watch(archive, subarchive, self.email)
 
             path = _watcher_cache_path(self.email, archive, subarchive)
             try:
@@ -126,10 +145,9 @@ class User:
                 )
 
             watcher.check()
-            save_cached_object(watcher.save(), path)
-
             self.watchlist[key]['last_checked_date'] = datetime.now().strftime('%Y,%m,%d,%H:%M')
-            self.save()
+            # the watcher and the user record in one batch
+            save_cached_objects({path: watcher.save(), _user_cache_path(self.email): self.to_dict()})
 
             # Return just the result, not the watcher itself
             if tree:
@@ -165,7 +183,7 @@ class User:
 
     def save(self):
         with self._lock:
-            save_cached_object(self.to_dict(), f'users/{self.email}.json')
+            save_cached_object(self.to_dict(), _user_cache_path(self.email))
 
     def to_dict(self):
         return {
@@ -199,9 +217,11 @@ class Users:
             if email in self._cache:
                 return self._cache[email]
             try:
-                data = load_cached_object(f'{self._path}/{email}.json')
+                data = load_cached_object(_user_cache_path(email))
                 user = User.from_dict(email, data)
                 self._cache[email] = user
+                for key in user.watchlist:
+                    change_feed_poller.watch(*key.split('-', 1), email)
                 return user
             except CacheMissError:
                 return None
@@ -390,6 +410,111 @@ def _compress_history(history, max_entries=30):
 
 page_lru = PageLRU(maxsize=500)
 
+# ---- CHANGE FEED POLLING ----------------------------------------------------
+
+# poll often enough that feeds are refreshed before they expire
+CHANGE_FEED_POLL_INTERVAL = int(os.getenv('BIRDDOG_CHANGE_FEED_POLL_INTERVAL', CHANGE_FEED_MAX_AGE // 2))
+# held by the one process of the host that polls
+CHANGE_FEED_POLL_LOCK = os.path.join(tempfile.gettempdir(), 'birddog-change-feed-poller.lock')
+
+class ChangeFeedPoller:
+    """Background thread that polls the change feed of every archive/subarchive on
+    any user's watchlist once per interval. The feeds are kept in the cache, so a
+    watchlist check merges from the shared feed instead of scanning the wiki itself.
+    The page existence index of each watched archive is refreshed when it expires.
+
+    Every worker process starts the thread, but only the one holding the lock file
+    polls; the others take over when it exits.
+    """
+    def __init__(self, lru, interval=CHANGE_FEED_POLL_INTERVAL, lock_path=CHANGE_FEED_POLL_LOCK):
+        self._lru = lru
+        self._interval = interval
+        self._path = 'change_feeds/registry.json'
+        self._watched = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._lock_path = lock_path
+        self._lock_file = None
+
+    def _load_registry(self):
+        # users watching each (archive, subarchive), shared by all workers in the cache
+        try:
+            items = load_cached_object(self._path, fresh=True) # as other workers left it
+        except CacheMissError:
+            items = []
+        # registries without watchers are rebuilt as users check their watchlists
+        self._watched = {(archive, subarchive): set(emails)
+                         for archive, subarchive, *rest in items for emails in rest if emails}
+        return self._watched
+
+    def _save_registry(self):
+        items = [[archive, subarchive, sorted(emails)]
+                 for (archive, subarchive), emails in sorted(self._watched.items())]
+        save_cached_object(items, self._path)
+
+    def watch(self, archive, subarchive, email):
+        with self._lock:
+            key = (archive, subarchive)
+            if self._watched is None or email not in self._watched.get(key, ()):
+                # reload first: other workers register their users too
+                watched = self._load_registry()
+                if email not in watched.get(key, ()):
+                    if key not in watched:
+                        _logger.info(f'ChangeFeedPoller: watching {archive}-{subarchive}')
+                    watched.setdefault(key, set()).add(email)
+                    self._save_registry()
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='change-feed-poller', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, archive, subarchive, email):
+        with self._lock:
+            key = (archive, subarchive)
+            watched = self._load_registry()
+            if email not in watched.get(key, ()):
+                return
+            watched[key].discard(email)
+            if not watched[key]:
+                _logger.info(f'ChangeFeedPoller: no longer watching {archive}-{subarchive}')
+                del watched[key]
+            self._save_registry()
+
+    def _lead(self):
+        # true for the one process of the host holding the lock file
+        if self._lock_file is not None:
+            return True
+        if fcntl is None:
+            return True # no file locks here: every process polls
+        lock_file = open(self._lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        _logger.info(f'ChangeFeedPoller: polling from process {os.getpid()}')
+        self._lock_file = lock_file
+        return True
+
+    def poll_once(self):
+        with self._lock:
+            watched = sorted(self._load_registry())
+        for archive, subarchive in watched:
+            try:
+                archive_page = self._lru.lookup(archive, subarchive)
+                ChangeFeed.lookup(archive_page).poll()
+                # keep the links of watched archives' pages from needing existence checks
+                refresh_existence_index(archive_page.title_prefix)
+            except Exception:
+                _logger.exception(f'ChangeFeedPoller: failed to poll {archive}-{subarchive}')
+
+    def _run(self):
+        while True:
+            if self._lead():
+                self.poll_once()
+            time.sleep(self._interval)
+
+change_feed_poller = ChangeFeedPoller(page_lru)
+
 def _get_current_user():
     user_session = session.get('user')
     if not user_session:
@@ -402,14 +527,6 @@ def _get_current_user():
 
     return user, None, None
 
-def _compare_page(page, ref_date):
-    # avoid making changes to cached page - work on copy instead
-    result = deepcopy(page)
-    reference = deepcopy(result)
-    reference.revert_to(ref_date)
-    check_page_changes(result, reference)
-    return result
-
 # ---- SERVICE API ------------------------------------------------------------
 
 archive_master_list = all_archives()
@@ -436,14 +553,14 @@ def page_data(archive, subarchive=None, fond=None, opus=None, case=None):
                 subarchive = page.subarchive["en"]
             compare = request.args.get('compare')
             if compare:
-                page = _compare_page(page, compare)
+                page = page.compared_to(compare)
 
             # recheck page address (which could be different)
             address = page.name.split('/') + 3 * [None]
             true_fond, true_opus, true_case = address[1:4]
 
-            # prevent mutation of page data in LRU/cache
-            page_dict = deepcopy(page.page)
+            # shallow copy: the page data in the LRU/cache is only read, never modified
+            page_dict = dict(page.page)
             page_dict['archive'] = archive
             page_dict['subarchive'] = subarchive
             page_dict['fond'] = true_fond
@@ -483,7 +600,7 @@ def download_file(archive, subarchive=None, fond=None, opus=None, case=None):
             # put the page into a comparison state if requested
             compare = request.args.get('compare')
             if compare:
-                page = _compare_page(page, compare)
+                page = page.compared_to(compare)
 
             _logger.info(f'exporting spreadsheet to memory buffer')
             clean_name = ascii_filename(page.name if page.name else "unnamed")
@@ -703,6 +820,20 @@ def get_log():
     limit = request.args.get('limit', type=int)
     return jsonify(get_log_buffer().get_logs(limit)), 200
 
+@app.route('/stats')
+def get_stats():
+    user, error_response, status = _get_current_user()
+    if error_response:
+        return error_response, status
+    return jsonify({
+        'fetch': fetch_stats(),
+        'pages': page_lru.stats,
+        'page_loads': page_load_stats(),
+        'compare': compare_stats(),
+        'coalesced': single_flight_stats(),
+        'cache': cache_stats(),
+        }), 200
+
 # ---- MAIN -------------------------------------------------------------------
 
 if __name__ == "__main__":
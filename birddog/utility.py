@@ -8,11 +8,17 @@ Utility functions for Bird Dog
 import re
 import time
 import json
+import asyncio
+import weakref
 import requests
+import httpx
 import random
-from threading import Lock, Semaphore
+from requests.adapters import HTTPAdapter
+from threading import Event, Lock, Semaphore, Thread
 from datetime import datetime, timezone
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 
 from birddog.translate import (
     translation,
@@ -51,9 +57,36 @@ MAX_CONCURRENT_FETCHES = 5
 
 _fetch_semaphore = Semaphore(MAX_CONCURRENT_FETCHES)
 _url_headers = {
-        'User-Agent': 'BirddogBot/1.0 (non-commercial research, contact: birddogpound@gmail.com)'
+        'User-Agent': 'BirddogBot/1.0 (non-commercial research, contact: birddogpound@gmail.com)',
+        'Accept-Encoding': 'gzip, deflate',
     }
 
+# shared keep-alive connection pool
+MAX_POOLED_HOSTS = 10 # number of distinct hosts with a retained pool
+
+_session = None
+_session_lock = Lock()
+
+def _http_session():
+    """Return the process-wide requests session.
+    Connections are kept alive and reused across threads. Each host gets a pool
+    sized to MAX_CONCURRENT_FETCHES, which is the most that can be in flight.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=MAX_POOLED_HOSTS,
+                    pool_maxsize=MAX_CONCURRENT_FETCHES,
+                    max_retries=0) # retries are handled in fetch_url
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update(_url_headers)
+                _session = session
+    return _session
+
 # fetch rate instrumentation
 _fetch_timestamps = deque()
 _fetch_timestamps_lock = Lock()
@@ -75,31 +108,258 @@ def _record_fetch_event():
                 _logger.info(f"fetch_url: {len(_fetch_timestamps)} requests in last {RATE_WINDOW}s → {rate:.2f} req/s")
             _last_log_time = now
 
+# connection reuse instrumentation
+_fetch_stats = {'requests': 0, 'gzip_responses': 0, 'content_bytes': 0}
+_async_pool_stats = {'requests': 0, 'connections': 0} # of the httpx clients of async_fetch_url
+_fetch_stats_lock = Lock()
+
+# per-operation request counting
+_call_counter = ContextVar('call_counter', default=None)
+
+class CallCounter:
+    """Counts the HTTP requests made within a with block, including those made by
+    coroutines it runs (through run_sync or otherwise), e.g. the API calls of one
+    page load. Counters may be nested; each request counts toward all of them.
+    """
+    def __init__(self):
+        self.count = 0
+        self._parent = None
+        self._token = None
+
+    def __enter__(self):
+        self._parent = _call_counter.get()
+        self._token = _call_counter.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _call_counter.reset(self._token)
+
+def _count_call():
+    counter = _call_counter.get()
+    while counter is not None:
+        counter.count += 1
+        counter = counter._parent
+
+def _record_response(response):
+    _count_call()
+    with _fetch_stats_lock:
+        _fetch_stats['requests'] += 1
+        if response.headers.get('Content-Encoding') == 'gzip':
+            _fetch_stats['gzip_responses'] += 1
+        _fetch_stats['content_bytes'] += len(response.content)
+
+async def _trace_connections(event, info):
+    # httpx request trace: count the connections opened for async_fetch_url
+    if event == 'connection.connect_tcp.complete':
+        with _fetch_stats_lock:
+            _async_pool_stats['connections'] += 1
+
+def fetch_stats():
+    """Return counters for fetch_url and async_fetch_url traffic and connection reuse.
+    "connections" counts new connections opened by the pools of both, so every
+    request beyond that was served over a kept-alive connection.
+    """
+    connections = 0
+    pool_requests = 0
+    if _session is not None:
+        pools = _session.get_adapter('https://').poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+    with _fetch_stats_lock:
+        result = dict(_fetch_stats)
+        connections += _async_pool_stats['connections']
+        pool_requests += _async_pool_stats['requests']
+    result['connections'] = connections
+    result['reused'] = max(0, pool_requests - connections)
+    result['reuse_ratio'] = result['reused'] / pool_requests if pool_requests else 0.0
+    return result
+
+def _backoff_wait(attempt):
+    """Seconds to wait before retry number attempt: exponential backoff plus jitter."""
+    wait = min(MAX_BACKOFF, BASE_BACKOFF * (2 ** attempt))  # exponential backoff
+    return wait + random.uniform(0, 1)  # add jitter
+
+def _check_status(status_code):
+    """Raise the appropriate error for a failed response status (shared by sync and async fetch)."""
+    if status_code == 429:
+        raise TooManyRequestsError("429 Too Many Requests")
+    if status_code == 404:
+        raise RuntimeError("Failed to fetch page (404)")
+    raise UnexpectedStatusError(f"Unexpected status: {status_code}")
+
 def fetch_url(url, params=None, json=False):
     with _fetch_semaphore:
         attempt = 0
         while attempt < MAX_RETRIES:
             try:
-                response = requests.get(url, params=params, timeout=REQUEST_TIMEOUT, headers=_url_headers)
-                if response.status_code == 429:
-                    raise TooManyRequestsError("429 Too Many Requests")
+                response = _http_session().get(url, params=params, timeout=REQUEST_TIMEOUT)
+                _record_response(response)
                 if not response.ok:
-                    if response.status_code == 404:
-                        raise RuntimeError("Failed to fetch page (404)")
-                    raise requests.RequestException(f"Unexpected status: {response.status_code}")
+                    _check_status(response.status_code)
                 _record_fetch_event()
                 return response.json() if json else response.text
-            except (requests.RequestException, TooManyRequestsError) as e:
-                wait = min(MAX_BACKOFF, BASE_BACKOFF * (2 ** attempt))  # exponential backoff
-                wait += random.uniform(0, 1)  # add jitter
+            except (requests.RequestException, TooManyRequestsError, UnexpectedStatusError) as e:
+                wait = _backoff_wait(attempt)
                 _logger.info(f"[{attempt+1}/{MAX_RETRIES}] Error: {e}. Retrying in {wait:.2f} seconds...")
                 time.sleep(wait)
                 attempt += 1
         raise RuntimeError("Failed to fetch page after several retries")
 
+#
+# asynchronous page loading
+
+# one client (connection pool) per event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+# threads that wait for a slot of _fetch_semaphore on behalf of coroutines
+_fetch_slot_waiters = ThreadPoolExecutor(thread_name_prefix='birddog-fetch-slot')
+
+def _async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            headers=_url_headers,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_FETCHES,
+                max_keepalive_connections=MAX_CONCURRENT_FETCHES))
+        _async_clients[loop] = client
+    return client
+
+async def _acquire_fetch_slot():
+    """Take a slot of _fetch_semaphore, the limit shared with fetch_url, without
+    blocking the event loop."""
+    if _fetch_semaphore.acquire(blocking=False):
+        return
+    waiter = asyncio.get_running_loop().run_in_executor(_fetch_slot_waiters, _fetch_semaphore.acquire)
+    try:
+        await asyncio.shield(waiter)
+    except asyncio.CancelledError:
+        # give back the slot once the waiting thread gets it
+        waiter.add_done_callback(lambda _: _fetch_semaphore.release())
+        raise
+
+async def async_fetch_url(url, params=None, json=False):
+    """Asyncio counterpart of fetch_url, with the same retry, backoff and 429 handling.
+    At most MAX_CONCURRENT_FETCHES requests are in flight, counting those of fetch_url.
+    """
+    client = _async_client()
+    await _acquire_fetch_slot()
+    try:
+        attempt = 0
+        while attempt < MAX_RETRIES:
+            try:
+                response = await client.get(url, params=params, extensions={'trace': _trace_connections})
+                with _fetch_stats_lock:
+                    _async_pool_stats['requests'] += 1
+                _record_response(response)
+                if not response.is_success:
+                    _check_status(response.status_code)
+                _record_fetch_event()
+                return response.json() if json else response.text
+            except (httpx.HTTPError, TooManyRequestsError, UnexpectedStatusError) as e:
+                wait = _backoff_wait(attempt)
+                _logger.info(f"[{attempt+1}/{MAX_RETRIES}] Error: {e}. Retrying in {wait:.2f} seconds...")
+                await asyncio.sleep(wait)
+                attempt += 1
+        raise RuntimeError("Failed to fetch page after several retries")
+    finally:
+        _fetch_semaphore.release()
+
+# background event loop serving synchronous callers
+_loop = None
+_loop_lock = Lock()
+
+def _background_loop():
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                Thread(target=loop.run_forever, name='birddog-fetch', daemon=True).start()
+                _loop = loop
+    return _loop
+
+def run_sync(coro):
+    """Run a coroutine on the shared background event loop and return its result.
+    Lets synchronous code (Flask threads, Page, PageLRU) use the async fetch engine
+    while sharing one connection pool and concurrency limit.
+    """
+    loop = _background_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_sync() called from the fetch loop: await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+#
+# request coalescing
+
+_single_flights = weakref.WeakValueDictionary()
+
+class SingleFlight:
+    """Coalesces concurrent loads of the same key: the first caller runs the load
+    and callers arriving while it is in flight wait for its result (or exception).
+    """
+    class _Call:
+        def __init__(self):
+            self.done = Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self, name):
+        self._name = name
+        self._lock = Lock()
+        self._calls = {}
+        self._coalesced = 0
+        _single_flights[name] = self
+
+    @property
+    def coalesced(self):
+        """Number of calls that were served by another caller's load."""
+        return self._coalesced
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+            else:
+                self._coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+def single_flight_stats():
+    """Number of coalesced loads for each SingleFlight, keyed on its name."""
+    return {name: flight.coalesced for name, flight in list(_single_flights.items())}
+
 class TooManyRequestsError(Exception):
     pass
 
+class UnexpectedStatusError(Exception):
+    pass
+
 #
 # date handling
 
@@ -133,6 +393,17 @@ def convert_utc_time(utc_str):
     dt = datetime.strptime(utc_str, '%Y-%m-%dT%H:%M:%SZ')
     return dt.strftime('%Y,%m,%d,%H:%M')
 
+def to_utc_time(date):
+    """Inverse of convert_utc_time: standard form "YYYY,MM,DD,HH:mm" to an API timestamp.
+    Partial dates such as "2024" or "2024,03,01" mean the start of that period.
+    Raises ValueError for an empty date.
+    """
+    if not date:
+        raise ValueError(f'to_utc_time: no date given ({date!r})')
+    parts = date.split(',') + ['01', '01', '00:00'][len(date.split(',')) - 1:]
+    year, month, day, hour_minute = parts[:4]
+    return f'{year}-{month}-{day}T{hour_minute}:00Z'
+
 #
 # multilingual support
 
@@ -7,9 +7,11 @@ Wiki API access functions
 
 import time
 import json
+import asyncio
 import requests
 import re
-from datetime import datetime
+from threading import Lock
+from datetime import datetime, timezone
 from urllib.parse import quote, unquote
 
 import mwparserfromhell
@@ -18,6 +20,7 @@ from cachetools import LRUCache
 from bs4 import BeautifulSoup
 
 from birddog.utility import (
+    async_fetch_url,
     convert_utc_time,
     equal_text,
     fetch_url,
@@ -28,8 +31,20 @@ from birddog.utility import (
     match_text,
     translate_page,
     is_linked,
+    run_sync,
+    to_utc_time,
+    SingleFlight,
     )
 
+from birddog.diff import diff_rows
+from birddog.wikitable import parse_cell, split_table
+from birddog.cache import (
+    load_cached_object,
+    save_cached_object,
+    load_cached_objects,
+    save_cached_objects,
+    CacheMissError)
+
 from birddog.logging import get_logger
 _logger = get_logger()
 
@@ -149,28 +164,217 @@ def get_title(url):
 def _is_table(tag):
     return tag.tag == "table" and [entry for entry in tag.attributes if "wikitable" in entry] != []
  
-def _check_page_existence_chunked(page_links, chunk_size=50):
+def _existence_params(titles):
+    return {
+        'action': 'query',
+        'prop': 'info',
+        'titles': "|".join(titles),
+        'format': 'json'
+    }
+
+async def _async_check_page_existence_chunked(page_links, chunk_size=50):
     exists_map = {}
     #print("check_page_existence_chunked:", page_links)
     title_map = {get_title(link): link for link in page_links}
     titles = list(title_map.keys())
-    
-    for i in range(0, len(titles), chunk_size):
-        params = {
-            'action': 'query',
-            'prop': 'info',
-            'titles': "|".join(titles[i:i+chunk_size]),
-            'format': 'json'
-        }
-        data = fetch_url(API_URL, params=params, json=True)
+
+    results = await asyncio.gather(*(
+        async_fetch_url(API_URL, params=_existence_params(chunk), json=True)
+        for chunk in _chunked(titles, chunk_size)))
+    for data in results:
+        # titles come back normalized (e.g. spaces for underscores)
+        normalized = {n['to']: n['from'] for n in data['query'].get('normalized', [])}
         for page_id, page_data in data['query']['pages'].items():
-            title = page_data['title']
-            #print('\n', title, page_data)
+            title = normalized.get(page_data['title'], page_data['title'])
             # If invalid or missing, mark as False
             exists = not ('missing' in page_data or 'invalid' in page_data)
-            exists_map[title_map[title]] = exists
+            if title in title_map:
+                exists_map[title_map[title]] = exists
     return exists_map
 
+def _check_page_existence_chunked(page_links, chunk_size=50):
+    return run_sync(_async_check_page_existence_chunked(page_links, chunk_size))
+
+# persistent page existence index
+
+EXISTENCE_MAX_AGE = 24 * 60 * 60 # seconds before a page's existence is checked again
+EXISTENCE_SAVE_INTERVAL = 5 * 60 # seconds between saves of updates from page loads
+
+class ExistenceIndex:
+    """Which pages of the archive namespace exist, kept per archive (e.g. "Архів:ДАЖО")
+    as title -> [exists, time verified] and persisted in the cache.
+
+    Page loads only ask the wiki about the titles that are missing from the index or
+    older than max_age, and record the answers. The index of an archive is refreshed
+    in bulk from list=allpages, and new pages seen in the change feed are added.
+    Titles outside the archive namespace are not indexed.
+    """
+    def __init__(self, max_age=EXISTENCE_MAX_AGE, persistent=True):
+        self._max_age = max_age
+        self._persistent = persistent
+        self._indexes = {}  # prefix -> {'refreshed': time of bulk refresh, 'pages': {...}}
+        self._unsaved = {}  # prefix -> time of the oldest unsaved update
+        self._lock = Lock()
+
+    @staticmethod
+    def _prefix(title):
+        if not title.startswith(f'{WIKI_NAMESPACE}:'):
+            return None
+        return title.split('/', 1)[0]
+
+    def _cache_path(self, prefix):
+        return f'existence_index/{prefix}.json'
+
+    def _index(self, prefix):
+        # called with the lock held, after _load
+        return self._indexes.setdefault(prefix, {'refreshed': 0, 'pages': {}})
+
+    def _load(self, prefixes):
+        # bring the indexes of prefixes into memory; the cache is read outside the lock
+        with self._lock:
+            missing = {prefix for prefix in prefixes if prefix and prefix not in self._indexes}
+        if not missing:
+            return
+        loaded = {}
+        if self._persistent:
+            paths = {self._cache_path(prefix): prefix for prefix in missing}
+            loaded = {paths[path]: index for path, index in load_cached_objects(paths).items()}
+        with self._lock:
+            for prefix in missing:
+                self._indexes.setdefault(prefix, loaded.get(prefix, {'refreshed': 0, 'pages': {}}))
+
+    def _save(self, prefixes):
+        if not self._persistent or not prefixes:
+            return
+        paths = {self._cache_path(prefix): prefix for prefix in prefixes}
+        # merge in what other workers saved meanwhile rather than overwrite it
+        stored = load_cached_objects(paths, fresh=True)
+        with self._lock:
+            snapshots = {}
+            for path, prefix in paths.items():
+                index = self._index(prefix)
+                other = stored.get(path)
+                if other:
+                    index['refreshed'] = max(index['refreshed'], other['refreshed'])
+                    for title, entry in other['pages'].items():
+                        mine = index['pages'].get(title)
+                        if mine is None or entry[1] > mine[1]:
+                            index['pages'][title] = entry # verified more recently
+                snapshots[path] = dict(index, pages=dict(index['pages']))
+        save_cached_objects(snapshots)
+
+    def lookup(self, titles):
+        """Existence of those of titles with an up to date entry, keyed on title."""
+        titles = list(titles)
+        self._load({self._prefix(title) for title in titles})
+        now = time.time()
+        result = {}
+        with self._lock:
+            for title in titles:
+                prefix = self._prefix(title)
+                entry = self._index(prefix)['pages'].get(title) if prefix else None
+                if entry and now - entry[1] < self._max_age:
+                    result[title] = entry[0]
+        return result
+
+    def update(self, existence):
+        """Record the existence of pages (title -> exists) as verified now."""
+        self._load({self._prefix(title) for title in existence})
+        now = time.time()
+        with self._lock:
+            for title, exists in existence.items():
+                prefix = self._prefix(title)
+                if prefix:
+                    self._index(prefix)['pages'][title] = [exists, now]
+                    self._unsaved.setdefault(prefix, now)
+            due = [prefix for prefix, since in self._unsaved.items() if now - since >= EXISTENCE_SAVE_INTERVAL]
+            for prefix in due:
+                del self._unsaved[prefix]
+        self._save(due)
+
+    async def async_lookup(self, titles):
+        """lookup() for the fetch loop: cache reads run in a worker thread."""
+        return await asyncio.to_thread(self.lookup, titles)
+
+    async def async_update(self, existence):
+        """update() for the fetch loop: cache loads and saves run in a worker thread."""
+        await asyncio.to_thread(self.update, existence)
+
+    def is_fresh(self, prefix):
+        """Whether the index of an archive was refreshed in bulk within max_age."""
+        self._load([prefix])
+        with self._lock:
+            return time.time() - self._index(prefix)['refreshed'] < self._max_age
+
+    async def async_refresh(self, prefix):
+        """Rebuild the index of an archive from the list of all its pages."""
+        started = time.time()
+        params = {
+            'action': 'query',
+            'list': 'allpages',
+            'apnamespace': await _async_namespace_id(),
+            'apprefix': prefix.split(':', 1)[1],
+            'aplimit': 'max',
+            'format': 'json'
+        }
+        titles = set()
+        await asyncio.to_thread(self._load, [prefix])
+        while True:
+            data = await async_fetch_url(API_URL, params=params, json=True)
+            for item in data.get('query', {}).get('allpages', []):
+                if item['title'] == prefix or item['title'].startswith(f'{prefix}/'):
+                    titles.add(item['title'])
+            if 'continue' not in data:
+                break
+            params = {**params, **data['continue']}
+
+        with self._lock:
+            index = self._index(prefix)
+            pages = {title: [True, started] for title in titles}
+            for title, entry in index['pages'].items():
+                if title not in pages:
+                    # not listed, so missing unless it was seen while the listing ran
+                    pages[title] = entry if entry[1] > started else [False, started]
+            self._indexes[prefix] = {'refreshed': started, 'pages': pages}
+            self._unsaved.pop(prefix, None)
+        _logger.info(f'ExistenceIndex({prefix}): {len(titles)} pages')
+        await asyncio.to_thread(self._save, [prefix])
+
+    def refresh(self, prefix, force=False):
+        if force or not self.is_fresh(prefix):
+            run_sync(self.async_refresh(prefix))
+
+    def flush(self):
+        """Save all unsaved updates."""
+        with self._lock:
+            prefixes = list(self._unsaved)
+            self._unsaved.clear()
+        self._save(prefixes)
+
+_existence_index = ExistenceIndex()
+
+def refresh_existence_index(title_prefix, force=False):
+    """Refresh the existence index of an archive (e.g. "Архів:ДАЖО") from list=allpages
+    if it is older than EXISTENCE_MAX_AGE (or if force)."""
+    _existence_index.refresh(title_prefix, force)
+
+async def _async_link_existence(page_title, links):
+    """Existence of the pages at links (absolute /wiki/ URLs), from the existence index
+    where it is up to date and otherwise from the wiki."""
+    titles = {link: get_title(link).replace('_', ' ') for link in links}
+    known = await _existence_index.async_lookup(titles.values())
+    unchecked = [link for link, title in titles.items() if title not in known]
+    fetched = {}
+    if len(unchecked) > MAX_TITLES_PER_QUERY:
+        # e.g. a page seen for the first time: all the pages it links to, 500 per request
+        fetched = await _async_linked_page_existence(page_title)
+        unchecked = [link for link in unchecked if titles[link] not in fetched]
+    if unchecked:
+        by_link = await _async_check_page_existence_chunked(unchecked)
+        fetched.update((titles[link], exists) for link, exists in by_link.items())
+    await _existence_index.async_update(fetched)
+    return {link: known.get(title, fetched.get(title, True)) for link, title in titles.items()}
+
 def _is_category_link(title):
     return title.startswith("Категорія:")
     
@@ -218,19 +422,18 @@ def _subtract_links(links, delta):
             for delta_link in link_list:
                 _safe_remove(links[key], delta_link)
 
-def _extract_links(wikitext):
+def _link_targets(wikitext):
+    """Targets of the internal links and URLs of the external links in wikitext"""
     # parse if necessary
     if not isinstance(wikitext, mwparserfromhell.wikicode.Wikicode):
         wikitext = mwparserfromhell.parse(str(wikitext))
-
-    # Internal wiki link targets
     links = [str(link.title).strip() for link in wikitext.filter_wikilinks()]    
-    commons_links, category_links, int_links = _split_list(links, _is_commons_url, _is_category_link)
-    commons_links = [_map_commons_url(title) for title in commons_links]
-    
-    # External link URLs
     ext_links = [str(link.url).strip() for link in wikitext.filter_external_links()]
+    return links, ext_links
 
+def _organize_links(links, ext_links):
+    commons_links, category_links, int_links = _split_list(links, _is_commons_url, _is_category_link)
+    commons_links = [_map_commons_url(title) for title in commons_links]
     return { 
         "commons_links": commons_links,
         "category_links": category_links,
@@ -238,50 +441,190 @@ def _extract_links(wikitext):
         "external_links": ext_links,
     }
 
-def _read_wiki_text(page_title, oldid=None):
+def _extract_links(wikitext):
+    return _organize_links(*_link_targets(wikitext))
+
+def _wiki_text_params(page_title, oldid=None):
+    # the revision id and timestamp come with the wikitext
     params = {
-        'action': 'parse',
-        'page': page_title,
-        'prop': 'wikitext|revid',
+        'action': 'query',
+        'prop': 'revisions',
+        'rvprop': 'ids|timestamp|content',
+        'rvslots': 'main',
         'format': 'json'
     }
     if oldid:
-        params['oldid'] = oldid
+        params['revids'] = oldid
+    else:
+        params['titles'] = page_title
+    return params
 
-    data = fetch_url(API_URL, params=params, json=True)
+async def _async_read_wiki_text(page_title, oldid=None):
+    data = await async_fetch_url(API_URL, params=_wiki_text_params(page_title, oldid), json=True)
 
     if 'error' in data:
         raise RuntimeError(f"API error: {data['error']}")
+    if 'badrevids' in data['query']:
+        raise RuntimeError(f"API error: no revision {oldid}")
+    page = next(iter(data['query']['pages'].values()))
+    if 'revisions' not in page:
+        raise RuntimeError(f"API error: no page {page_title}")
 
+    revision = page['revisions'][0]
     return (
-        data['parse']['wikitext']['*'], 
-        data['parse']['revid'], 
-        data['parse']['title'].replace(f'{WIKI_NAMESPACE}:', ''),
+        revision['slots']['main']['*'],
+        revision['revid'],
+        page['title'].replace(f'{WIKI_NAMESPACE}:', ''),
+        revision['timestamp'],
     )
 
-def mw_read_page(page_title, oldid=None):
-    # extract title from url if necessary
-    page_title = get_title(page_title)
+def _linked_pages_params(page_title, **kwargs):
+    return {
+        'action': 'query',
+        'generator': 'links',
+        'titles': page_title,
+        'gpllimit': 'max',
+        'format': 'json',
+        **kwargs
+    }
+
+async def _async_linked_page_existence(page_title):
+    """Existence of each page linked from the latest revision of a page, keyed on title"""
+    existence = {}
+    params = _linked_pages_params(page_title)
+    while True:
+        data = await async_fetch_url(API_URL, params=params, json=True)
+        for page_data in data.get('query', {}).get('pages', {}).values():
+            existence[page_data['title']] = not ('missing' in page_data or 'invalid' in page_data)
+        if 'continue' not in data:
+            return existence
+        params = _linked_pages_params(page_title, **data['continue'])
+
+# characters MediaWiki leaves unescaped in page URLs
+_TITLE_SAFE = "/:;@$!*(),~"
+
+THUMB_WIDTH = 220 # pixels, as rendered on case pages
+
+_FILE_NAMESPACES = ("file:", "файл:", "image:", "зображення:")
+
+def _quote_title(title):
+    return quote(title.replace(' ', '_'), safe=_TITLE_SAFE)
+
+def _page_link(url, exists=True):
+    """Link to a page on this wiki in the form found in rendered page HTML: a relative
+    /wiki/ link, or an edit (redlink) link if the page does not exist. Other links
+    are left as they are."""
+    prefix = f"{ARCHIVE_BASE}/wiki/"
+    if not url.startswith(prefix):
+        return url
+    title = _quote_title(url[len(prefix):])
+    if exists:
+        return f"/wiki/{title}"
+    return f"/w/index.php?title={title}&action=edit&redlink=1"
+
+def _document_file(link_targets):
+    """File name of the first file among wikilink targets, if any"""
+    for target in link_targets:
+        if target.lower().startswith(_FILE_NAMESPACES):
+            return target.split(':', 1)[1].strip()
+    return None
+
+def _parse_cell(cell_text):
+    """(text, link targets, first external link) of a table cell, tokenized directly
+    where possible and otherwise parsed in full."""
+    result = parse_cell(cell_text)
+    if result is not None:
+        return result
+    cell_wikicode = mwparserfromhell.parse(cell_text)
+    link_targets = [str(link.title).strip() for link in cell_wikicode.filter_wikilinks()]
+    ext_links = cell_wikicode.filter_external_links()
+    ext_link = str(ext_links[0].url).strip() if ext_links else None
+    return cell_wikicode.strip_code(), link_targets, ext_link
+
+def _parse_table_row(row, page_title):
+    """Cells of one wikitable data row line. Returns the row data, the targets of
+    the internal links used as cell links, and the targets of all internal links
+    in the row.
+    """
+    row_data = []
+    link_targets = []
+    all_targets = []
+    for cell_text in [c.strip(" |") for c in row.split("||")]:
+        text, targets, ext_link = _parse_cell(cell_text)
+        all_targets += targets
+        link = None
+        if targets:
+            # the first internal link, or an external link as fallback
+            link_targets.append(targets[0])
+            link = _expand_link_target(targets[0], page_title)
+        elif ext_link:
+            link = ext_link
+
+        # Clean text (strip wikitext markup)
+        row_data.append({'text': form_text_item(text.strip('/ ')), 'link': link})
+    return row_data, link_targets, all_targets
+
+def _page_sections(wikitext):
+    """
+    Wikicode of a page and the lines of its first wikitable. The table is located
+    and tokenized directly when possible, and the rest of the page is parsed as
+    (before table, after table) sections; otherwise the whole page is parsed and
+    its only section contains the table. Returns (sections, table lines).
+    """
+    table = split_table(wikitext)
+    if table is not None:
+        before, lines, after = table
+        return [mwparserfromhell.parse(before), mwparserfromhell.parse(after)], lines
 
-    # get the wikitext and parse
-    wikitext, revid, title = _read_wiki_text(page_title, oldid)
     wikicode = mwparserfromhell.parse(wikitext)
+    tables = [t for t in wikicode.filter_tags() if _is_table(t)]
+    lines = None
+    if tables:
+        table_code = tables[0].contents
+        lines = [r.strip() for r in table_code.split("\n") if r.strip() and r.strip() != "|-"]
+    return [wikicode], lines
+
+def _parse_mw_page(page_title, wikitext, title):
+    """Build page data from wikitext. Returns the page and the set of linked child pages
+    whose existence still needs to be checked.
+    """
+    sections, rows = _page_sections(wikitext)
+
+    # Table data
+    header = []
+    children = []
+    table_links = [] # all internal link targets in the table
+    cell_links = []  # those used as cell links
+    for row in rows or []:
+        # Identify header row (starts with '!')
+        if row.startswith("!"):
+            cells = row.lstrip("!").split("||")
+            header = [form_text_item(c.strip()) for c in cells]
+            if "[[" in row:
+                table_links += _link_targets(row)[0]
+            continue  # skip to next row
+    
+        # Process data rows
+        row_data, link_targets, all_targets = _parse_table_row(row, page_title)
+        table_links += all_targets
+        cell_links += link_targets
+        children.append(row_data)
 
     # get and organize all the links on the page
-    page_links = _extract_links(wikicode)
+    if len(sections) == 1:
+        page_links = _extract_links(sections[0])
+    else:
+        # external links in the table are not needed, so are not collected
+        (before, before_ext), (after, after_ext) = map(_link_targets, sections)
+        page_links = _organize_links(before + table_links + after, before_ext + after_ext)
 
     # Title and description
     desc = None
-    dates = None
     notes = None
-    template_name = None
-    for template in wikicode.filter_templates():
+    for template in (t for section in sections for t in section.filter_templates()):
         if template.name.startswith("Архіви"):
-            template_name = template.name.strip(' \n')
             if template.has("назва"):
                 desc = template.get("назва").value.strip_code().strip()
-            if template.has("рік"):
-                dates = template.get("рік").value.strip_code().strip()
             if template.has("примітки"):
                 notes = _extract_links(template.get("примітки"))
                 # take the links found in the header section out of the master list
@@ -291,55 +634,13 @@ def mw_read_page(page_title, oldid=None):
 
     page = {
         "title": form_text_item(title),
-        "template": form_text_item(template_name),
-        "revid": revid,
         "description": form_text_item(desc),
-        "dates": form_text_item(dates),
-        "notes": notes,
-        "other_links": page_links
     }
 
-    # Table data
-    tables = [t for t in wikicode.filter_tags() if _is_table(t)]
-    header = []
-    children = []
     all_page_links = set()
-
-    if tables:
-        table_code = tables[0].contents
-        rows = [r.strip() for r in table_code.split("\n") if r.strip() and r.strip() != "|-"]
-        for row in rows:
-            # Identify header row (starts with '!')
-            if row.startswith("!"):
-                cells = row.lstrip("!").split("||")
-                header = [form_text_item(c.strip()) for c in cells]
-                continue  # skip to next row
-        
-            # Process data rows
-            cells = row.split("||")
-            cells = [c.strip(" |") for c in cells]
-            row_data = []
-            for cell_text in cells:
-                cell_wikicode = mwparserfromhell.parse(cell_text)
-                # Extract internal links
-                links = cell_wikicode.filter_wikilinks()
-                link = None
-                if links:
-                    #print(links)
-                    link_target = str(links[0].title).strip()
-                    _safe_remove(page_links["internal_links"], link_target)
-                    link = _expand_link_target(link_target, page_title)
-                    all_page_links.add(link)
-                else:
-                    # External links as fallback
-                    ext_links = cell_wikicode.filter_external_links()
-                    if ext_links:
-                        link = str(ext_links[0].url).strip()
-        
-                # Clean text (strip wikitext markup)
-                text = form_text_item(cell_wikicode.strip_code().strip('/ '))
-                row_data.append({'text': text, 'link': link})
-            children.append(row_data)
+    for link_target in cell_links:
+        _safe_remove(page_links["internal_links"], link_target)
+        all_page_links.add(_expand_link_target(link_target, page_title))
 
     if not header and not children:
         # try to populate a "table" if there is either a list of subpages or commons links
@@ -364,43 +665,49 @@ def mw_read_page(page_title, oldid=None):
                     text = text.replace("File:", "")
                     text = text.replace("_", " ")
                     text = form_text_item(text)
-                    children.append([{'text': text, 'link': link, 'exists': True}])
-            
-    # Collect unique linked page titles (relative titles like '/1/' etc.)
-    link_existence = _check_page_existence_chunked(all_page_links)
-    for row in children:
-        for cell in row:
-            if cell['link']:
-                cell['exists'] = link_existence.get(cell["link"], True)  # True by default
+                    children.append([{'text': text, 'link': link}])
+
+    # the case document, shown as a thumbnail on the page
+    doc_file = _document_file(page_links["internal_links"] + (notes or {}).get("internal_links", []))
 
     page["header"] = header
     page["children"] = children
+    page["link"] = f"{ARCHIVE_BASE}/wiki/{_quote_title(page_title)}"
+    page["doc_link"] = f"/wiki/File:{_quote_title(doc_file)}" if doc_file else None
+    page["thumb_link"] = (f"{ARCHIVE_BASE}/wiki/Special:FilePath/{_quote_title(doc_file)}?width={THUMB_WIDTH}"
+                          if doc_file else None)
+    return page, all_page_links
+
+async def _async_revision_page(page_title, wikitext, title, timestamp):
+    """Page data from the wikitext of a revision, with links to missing pages as redlinks."""
+    # parsing is CPU bound: keep it off the event loop, which serves every thread's fetches
+    page, all_page_links = await asyncio.to_thread(_parse_mw_page, page_title, wikitext, title)
+    link_existence = await _async_link_existence(page_title, all_page_links)
+
+    for row in page["children"]:
+        for cell in row:
+            if cell['link']:
+                cell['link'] = _page_link(cell['link'], link_existence.get(cell['link'], True))
 
-    # Last modified date via API `revisions` (for this oldid)
-    params_rev = {
-        'action': 'query',
-        'prop': 'revisions',
-        'revids': revid,
-        'rvprop': 'timestamp',
-        'format': 'json'
-    }
-    rev_data = fetch_url(API_URL, params=params_rev, json=True)
-
-    pages = rev_data['query']['pages']
-    page_id = next(iter(pages))
-    page["lastmod"] = convert_utc_time(pages[page_id]['revisions'][0]['timestamp'])
-    page["link"] = f"{ARCHIVE_BASE}/wiki/{page_title}"
+    page["lastmod"] = convert_utc_time(timestamp)
 
     return page
 
-def mw_page_doc_url(page):
-    internal_links = page["other_links"].get("internal_links")
-    if internal_links:
-        return _expand_link_target(internal_links[0], page["title"]["uk"])
-    commons_links = page["notes"].get("commons_links")
-    if commons_links:
-        return commons_links[0]
-    return None
+async def async_mw_read_page(page_title, oldid=None):
+    """
+    Read a page (the latest revision, or revision oldid) from its wikitext.
+    Returns the same page struct as read_page, with links in the form found in
+    the rendered page: relative /wiki/ links, and redlinks for missing pages.
+    """
+    # extract title from url if necessary
+    page_title = get_title(page_title)
+
+    # get the wikitext (with its revision id and timestamp) and parse
+    wikitext, revid, title, timestamp = await _async_read_wiki_text(page_title, oldid)
+    return await _async_revision_page(page_title, wikitext, title, timestamp)
+
+def mw_read_page(page_title, oldid=None):
+    return run_sync(async_mw_read_page(page_title, oldid))
 
 # -------------------------------------------------------------------------------
 # WikiSource HTML archive scraping
@@ -414,7 +721,9 @@ def form_element_text(element):
 
 def read_page(url):
     """
-    Extract archive information for given page using HTTP get.
+    Extract archive information for given page from its rendered HTML.
+    Page loading uses mw_read_page (same struct, from the much smaller wikitext);
+    this is kept for comparison with the rendered page.
     Return struct with page:
         title,
         description,
@@ -467,6 +776,130 @@ def read_page(url):
         'thumb_link': thumb_url,
     }
 
+# -------------------------------------------------------------------------------
+# Revision to revision comparison (MediaWiki compare API)
+
+def _compare_params(from_revid, to_revid):
+    return {
+        'action': 'compare',
+        'fromrev': from_revid,
+        'torev': to_revid,
+        'prop': 'diff',
+        'format': 'json'
+    }
+
+def _parse_revision_diff(diff_html):
+    """Deleted and added wikitext lines of a compare API diff table."""
+    soup = BeautifulSoup(diff_html, 'lxml')
+    deleted = [td.get_text() for td in soup.find_all('td', class_='diff-deletedline')]
+    added = [td.get_text() for td in soup.find_all('td', class_='diff-addedline')]
+    return deleted, added
+
+async def async_get_revision_diff(from_revid, to_revid):
+    """(deleted lines, added lines) of the wikitext between two revisions."""
+    data = await async_fetch_url(API_URL, params=_compare_params(from_revid, to_revid), json=True)
+    if 'error' in data:
+        raise RuntimeError(f"API error: {data['error']}")
+    # parse off the fetch loop, which serves every other request meanwhile
+    return await asyncio.to_thread(_parse_revision_diff, data['compare'].get('*', ''))
+
+def get_revision_diff(from_revid, to_revid):
+    return run_sync(async_get_revision_diff(from_revid, to_revid))
+
+def _row_key(row):
+    return ' '.join((row[0]['text'].get('uk') or '').split()) if row else ''
+
+def _diff_rows(lines, page_title, width):
+    """Table rows of changed wikitext lines keyed on entry id, or None if a line is
+    not a table data row (or the same id changes twice)."""
+    rows = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line == '|-':
+            continue
+        if not line.startswith('|') or line.startswith(('|}', '|+')):
+            return None # not a data row: header, table markup or page text
+        row = _parse_table_row(line, page_title)[0]
+        key = _row_key(row)
+        if key in rows or (width and len(row) != width):
+            return None
+        rows[key] = row
+    return rows
+
+def map_revision_diff(page, page_title, deleted, added, refmod):
+    """
+    Annotate page data (the newer revision) from the changed wikitext lines of a
+    revision diff, in the form made by compare_page_data(). Returns None when the
+    changes cannot be mapped onto table rows, e.g. the page text or header changed.
+    """
+    width = len(page.get('header') or [])
+    deleted = _diff_rows(deleted, page_title, width)
+    added = _diff_rows(added, page_title, width)
+    if deleted is None or added is None:
+        return None
+    keys = [_row_key(row) for row in page['children']]
+    if len(set(keys)) != len(keys):
+        return None # rows are not identified by their ids alone
+    if not set(added) <= set(keys) or (set(deleted) - set(added)) & set(keys):
+        return None # diff does not fit the page data (e.g. stale cache)
+
+    children = []
+    for key, row in zip(keys, page['children']):
+        if key not in added:
+            children.append(row)
+        elif key not in deleted:
+            children.append([{**item, 'edit': 'added'} for item in row])
+        else:
+            new_row, old_row = added[key], deleted[key]
+            moved = new_row == old_row # same line, different place
+            annotated = []
+            for j, item in enumerate(row):
+                new_cell = new_row[j] if j < len(new_row) else None
+                old_cell = old_row[j] if j < len(old_row) else None
+                if old_cell is None:
+                    edit = 'added'
+                elif new_cell is None or new_cell['text'] != old_cell['text']:
+                    edit = 'changed'
+                else:
+                    edit = 'moved' if moved and j == 0 else None
+                item = {**item, 'edit': edit}
+                if is_linked(item.get('link')):
+                    old_link = old_cell['link'] if old_cell else None
+                    if not old_link:
+                        item['link_edit'] = 'added'
+                    else:
+                        new_link = new_cell['link'] if new_cell else None
+                        item['link_edit'] = 'changed' if new_link != old_link else None
+                annotated.append(item)
+            children.append(annotated)
+
+    result = dict(page)
+    result['refmod'] = refmod
+    for key in ['title', 'description']:
+        result[key] = {**page[key], 'edit': None} # any change there is not a row change
+    result['children'] = children
+    result['removed'] = [[{**item, 'link': item['link'] and _page_link(item['link']), 'edit': 'removed'}
+                          for item in row]
+                         for key, row in deleted.items() if key not in added]
+    return result
+
+def compare_revisions(page, page_title, from_revid, to_revid, refmod):
+    """
+    Compare page data (revision to_revid of page_title, without namespace) to an
+    earlier revision using the compact compare API diff instead of loading it.
+    Returns None if the diff cannot be mapped onto the page rows, so the caller can
+    fall back to compare_page_data() with the full earlier revision.
+    """
+    try:
+        deleted, added = get_revision_diff(from_revid, to_revid)
+    except Exception as e:
+        _logger.info(f'compare_revisions({page_title}, {from_revid}, {to_revid}): {e}')
+        return None
+    result = map_revision_diff(page, wiki_title(page_title), deleted, added, refmod)
+    if result is None:
+        _logger.info(f'compare_revisions({page_title}, {from_revid}, {to_revid}): diff not mappable')
+    return result
+
 # -------------------------------------------------------------------------------
 # WikiSource change detection
 
@@ -515,6 +948,84 @@ def report_page_changes(page):
         for i, item in enumerate(child):
             if 'edit' in item and item['edit'] is not None:
                 _logger.info(f'{index}[{i}] ({item["edit"]}): {get_text(item["text"])}')
+    for child in page.get('removed', []):
+        _logger.info(f'{get_text(child[0]["text"])} (removed)')
+
+def compare_page_data(page, reference):
+    """
+    Annotate page data with the changes since a prior version of the same page.
+    Returns a new page dict that shares all unannotated data with page; neither
+    argument is modified. Rows are matched on their ids (see birddog.diff); rows
+    no longer present are listed under 'removed'.
+    """
+    result = dict(page)
+    result['refmod'] = reference['lastmod']
+    for key in ['title', 'description']:
+        changed = not equal_text(page[key], reference[key])
+        result[key] = {**page[key], 'edit': 'changed' if changed else None}
+    result['children'], removed = diff_rows(
+        page['children'], reference['children'], page.get('header'), reference.get('header'))
+    result['removed'] = [[{**item, 'edit': 'removed'} for item in row] for row in removed]
+    return result
+
+def page_annotations(compared):
+    """
+    Compact form of the annotations made by compare_page_data(), for storage.
+    Only what cannot be recomputed from the current page data is kept.
+    """
+    added, changes = [], []
+    for i, row in enumerate(compared['children']):
+        # linked cells of matched rows always carry a link_edit, so this is unambiguous
+        if row and all(item.get('edit') == 'added' and 'link_edit' not in item for item in row):
+            added.append(i)
+            continue
+        for j, item in enumerate(row):
+            for key in ['edit', 'link_edit']:
+                if item.get(key):
+                    changes.append([i, j, key, item[key]])
+    return {
+        'refmod': compared['refmod'],
+        'title': compared['title']['edit'],
+        'description': compared['description']['edit'],
+        'added': added,
+        'changes': changes,
+        'removed': [[{k: v for k, v in item.items() if k != 'edit'} for item in row]
+                    for row in compared['removed']],
+    }
+
+def apply_page_annotations(page, annotations):
+    """
+    Rebuild the result of compare_page_data() from page data and the output of
+    page_annotations(), without the reference version.
+    """
+    result = dict(page)
+    result['refmod'] = annotations['refmod']
+    for key in ['title', 'description']:
+        result[key] = {**page[key], 'edit': annotations[key]}
+    added = set(annotations['added'])
+    changes = {}
+    for i, j, key, value in annotations['changes']:
+        changes.setdefault((i, j), {})[key] = value
+    changed = set(i for i, j in changes)
+    children = []
+    for i, child in enumerate(page['children']):
+        if i in added:
+            children.append([{**item, 'edit': 'added'} for item in child])
+            continue
+        if i not in changed:
+            children.append(child)
+            continue
+        row = []
+        for j, item in enumerate(child):
+            item = {**item, 'edit': None}
+            if is_linked(item.get('link')):
+                item['link_edit'] = None
+            item.update(changes.get((i, j), {}))
+            row.append(item)
+        children.append(row)
+    result['children'] = children
+    result['removed'] = [[{**item, 'edit': 'removed'} for item in row] for row in annotations['removed']]
+    return result
 
 def check_page_changes(page, reference, report=False):
     """
@@ -524,26 +1035,7 @@ def check_page_changes(page, reference, report=False):
         page = page.page
     if not isinstance(reference, dict):
         reference = reference.page
-    page['refmod'] = reference['lastmod']
-    for key in ['title', 'description']:
-        changed = not equal_text(page[key], reference[key])
-        page[key]['edit'] = 'changed' if changed else None
-    ref_children = dict((get_text(c[0]['text']), c) for c in reference['children'])
-    for child in page['children']:
-        index = get_text(child[0]['text'])
-        if index in ref_children:
-            ref_child = ref_children[index]
-            for item, ref_item in zip(child, ref_child):
-                changed = not equal_text(item['text'], ref_item['text'])
-                item['edit'] = 'changed' if changed else None
-                if 'link' in item and is_linked(item['link']):
-                    if 'link' in ref_item and is_linked(ref_item['link']):
-                        item['link_edit'] = 'changed' if item['link'] != ref_item['link'] else None
-                    else:
-                        item['link_edit'] = 'added'
-        else:
-            for item in child:
-                item['edit'] = 'added'
+    page.update(compare_page_data(page, reference))
     if report:
         report_page_changes(page)
 
@@ -566,11 +1058,18 @@ def _page_update_summary(archive, change_list):
         # Confirm that the item belongs to the selected archive
         if fond in fond_list and item["link"].startswith(archive_prefix):
             if address in result:
-                result[address] = max(mod_date, result["address"])
+                result[address] = max(mod_date, result[address])
             else:
                 result[address] = mod_date
     return result
 
+def recent_page_updates(archive, start=None):
+    """Like check_page_updates, but from the RecentChanges feed: returns the update
+    summary for edits since start (API timestamp) and the feed's new high-water mark.
+    """
+    change_list, high_water = get_recent_changes(archive.title_prefix, start=start)
+    return _page_update_summary(archive, change_list), high_water
+
 def check_page_updates(archive, cutoff_date):
     #assert isinstance(archive, Archive)
     change_list = []
@@ -588,6 +1087,211 @@ def check_page_updates(archive, cutoff_date):
     _logger.info(f"check_page_updates, {len(change_list)}, changes found")
     return _page_update_summary(archive, change_list)
 
+# -------------------------------------------------------------------------------
+# WikiSource change feed (RecentChanges API)
+
+RC_MAX_AGE_DAYS = 30 # how far back the wiki retains recent changes
+RC_PAGE_SIZE = 500
+
+_namespace_ids = {}
+
+async def _async_namespace_id(name=WIKI_NAMESPACE):
+    if name not in _namespace_ids:
+        params = {
+            'action': 'query',
+            'meta': 'siteinfo',
+            'siprop': 'namespaces',
+            'format': 'json'
+        }
+        data = await async_fetch_url(API_URL, params=params, json=True)
+        for namespace in data['query']['namespaces'].values():
+            for key in ('*', 'canonical'):
+                if namespace.get(key):
+                    _namespace_ids[namespace[key]] = namespace['id']
+    return _namespace_ids[name]
+
+def _change_link(title):
+    return f"/wiki/{quote(title.replace(' ', '_'), safe='/:')}"
+
+async def async_get_recent_changes(title_prefix, start=None):
+    """
+    Edits to pages at or below title_prefix (e.g. "Архів:ДАЖО"), oldest first, from start
+    (API timestamp, inclusive) up to now, paged with rccontinue.
+    Returns the list of changes (dicts with title, link, lastmod, revid) and the
+    timestamp of the newest change seen, which is the high-water mark for the next call.
+    """
+    params = {
+        'action': 'query',
+        'list': 'recentchanges',
+        'rcnamespace': await _async_namespace_id(),
+        'rcprop': 'title|timestamp|ids',
+        'rctype': 'edit|new',
+        'rcdir': 'newer',
+        'rclimit': RC_PAGE_SIZE,
+        'format': 'json'
+    }
+    if start:
+        params['rcstart'] = start
+    changes = []
+    seen = set() # titles edited or created, so the pages exist
+    high_water = None
+    polled = time.time() # edits made from here on may be missing from this poll
+    while True:
+        data = await async_fetch_url(API_URL, params=params, json=True)
+        for item in data.get('query', {}).get('recentchanges', []):
+            high_water = max(high_water or item['timestamp'], item['timestamp'])
+            title = item['title']
+            if title == title_prefix or title.startswith(f'{title_prefix}/'):
+                seen.add(title)
+                changes.append({
+                    'title': title,
+                    'link': _change_link(title),
+                    'lastmod': convert_utc_time(item['timestamp']),
+                    'revid': item['revid'],
+                })
+        if 'continue' not in data:
+            break
+        params = {**params, **data['continue']}
+    await _existence_index.async_update(dict.fromkeys(seen, True))
+    # shares the coverage through the cache: off the fetch loop
+    await asyncio.to_thread(
+        _latest_revisions.feed_polled, title_prefix, changes, _api_time(start) if start else None, polled)
+    _logger.info(f'get_recent_changes({title_prefix}, start={start}): {len(changes)} changes')
+    return changes, high_water
+
+def get_recent_changes(title_prefix, start=None):
+    return run_sync(async_get_recent_changes(title_prefix, start))
+
+def _api_time(timestamp):
+    """Seconds since the epoch of an API timestamp (e.g. "2024-03-01T10:00:00Z")."""
+    return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+# latest revision index
+
+LATEST_REVISION_MAX_AGE = 10 * 60 # seconds the change feed of an archive may go unpolled
+LATEST_REVISION_RELOAD = 60 # seconds between loads of an archive's shared index
+
+class LatestRevisionIndex:
+    """The latest known revision of each page (title -> (revid, time verified)), kept up
+    to date by the change feed.
+
+    A revision is recorded as the head of its page whenever one is seen: in a history
+    fetched from the wiki, a crawl or the change feed. The feed of an archive reports
+    every edit made since it started covering the archive, so as long as it keeps being
+    polled, a revision recorded since then is still the latest unless the feed has
+    reported a newer one. Otherwise (or once the feed has not been polled for max_age)
+    the index has no answer and callers ask the wiki.
+
+    Only one process polls the feeds, so after each poll it saves the coverage and the
+    revisions of the archive in the cache. The other processes (and a restarted one)
+    load them when they have no up to date coverage of their own.
+    """
+    def __init__(self, maxsize=200000, max_age=LATEST_REVISION_MAX_AGE, persistent=True):
+        self._max_age = max_age
+        self._persistent = persistent
+        self._revisions = LRUCache(maxsize=maxsize) # title -> (revid, time verified)
+        self._coverage = {} # archive (e.g. "ДАЖО") -> [start, end] of continuous feed coverage
+        self._loaded = {}   # archive -> time its shared index was last loaded
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(page_title):
+        # page title without namespace, in the form the API returns it
+        return page_title.removeprefix(f'{WIKI_NAMESPACE}:').replace('_', ' ')
+
+    def _cache_path(self, archive):
+        return f'latest_revisions/{archive}.json'
+
+    def _record(self, key, revid, verified):
+        # called with the lock held
+        entry = self._revisions.get(key)
+        if entry is None or revid > entry[0] or (revid == entry[0] and verified > entry[1]):
+            self._revisions[key] = (revid, verified)
+
+    def _cover(self, archive, start, end):
+        # called with the lock held
+        coverage = self._coverage.get(archive)
+        if coverage and start <= coverage[1] and coverage[0] <= end:
+            coverage[0], coverage[1] = min(coverage[0], start), max(coverage[1], end)
+        elif not coverage or end > coverage[1]:
+            self._coverage[archive] = [start, end] # a gap: nothing before is covered
+
+    def _covered(self, archive):
+        with self._lock:
+            coverage = self._coverage.get(archive)
+        return coverage is not None and time.time() - coverage[1] < self._max_age
+
+    def _load_shared(self, archive):
+        # the coverage and revisions saved by the process polling the archive's feed
+        now = time.time()
+        with self._lock:
+            if not self._persistent or now - self._loaded.get(archive, 0) < LATEST_REVISION_RELOAD:
+                return
+            self._loaded[archive] = now
+        try:
+            data = load_cached_object(self._cache_path(archive))
+        except CacheMissError:
+            return
+        with self._lock:
+            self._cover(archive, *data['coverage'])
+            for key, (revid, verified) in data['revisions'].items():
+                self._record(key, revid, verified)
+
+    def _save_shared(self, archive):
+        if not self._persistent:
+            return
+        with self._lock:
+            data = {
+                'version': 'v1',
+                'coverage': self._coverage[archive],
+                'revisions': {key: entry for key, entry in self._revisions.items()
+                              if key.split('/', 1)[0] == archive},
+            }
+        save_cached_object(data, self._cache_path(archive))
+
+    def record(self, page_title, revid, verified=None):
+        """Record revid as the latest revision of a page as of verified (default now)."""
+        verified = time.time() if verified is None else verified
+        with self._lock:
+            self._record(self._key(page_title), revid, verified)
+
+    def feed_polled(self, title_prefix, changes, start, polled):
+        """Record a poll of the change feed of an archive (e.g. "Архів:ДАЖО") that
+        covered the edits from start to polled (seconds since the epoch; start None for
+        as far back as the feed goes), with its changes (dicts with title and revid)."""
+        if start is None:
+            start = polled - RC_MAX_AGE_DAYS * 24 * 60 * 60
+        archive = self._key(title_prefix)
+        self._load_shared(archive) # e.g. saved before a restart, to continue from
+        with self._lock:
+            self._cover(archive, start, polled)
+            for change in changes:
+                self._record(self._key(change['title']), change['revid'], polled)
+        self._save_shared(archive)
+
+    def latest(self, page_title):
+        """The latest revid of a page, or None if the index is not up to date for it."""
+        key = self._key(page_title)
+        archive = key.split('/', 1)[0]
+        if not self._covered(archive):
+            self._load_shared(archive) # polled by another process
+        with self._lock:
+            entry = self._revisions.get(key)
+            coverage = self._coverage.get(archive)
+        if entry is None or coverage is None:
+            return None
+        start, end = coverage
+        if entry[1] < start or time.time() - end >= self._max_age:
+            return None
+        return entry[0]
+
+_latest_revisions = LatestRevisionIndex()
+
+def known_latest_revid(page_title):
+    """Latest revid of a page (e.g. "ДАЖО/1/74") if it is known without asking the
+    wiki, otherwise None."""
+    return _latest_revisions.latest(page_title)
+
 # -------------------------------------------------------------------------------
 # Page revision history handling (using wiki API)
 
@@ -603,8 +1307,14 @@ def page_revision_url(page_title, revid):
     return ('https://uk.wikisource.org/w/index.php?'
             f'title={quote(wiki_title(page_title))}&oldid={revid}')
 
-def get_page_history(page_title, limit=10):
-    result = fetch_url(history_url(page_title, limit=limit), json=True)
+def _history_entry(page_title, rev):
+    return {
+        'revid': rev['revid'],
+        'modified': convert_utc_time(rev['timestamp']),
+        'link': page_revision_url(page_title, rev['revid'])
+    }
+
+def _parse_page_history(page_title, limit, result):
     query = result.get('query')
     #_logger.info(f'get_page_history({page_title}, limit={limit}): result={query}')
 
@@ -618,94 +1328,398 @@ def get_page_history(page_title, limit=10):
     if '-1' in pages:
         _logger.error(f'get_page_history({page_title}, limit={limit}): unrecognized page name')
         return []
-    # assume only one page is returned (in future, pass multiple to reduce api calls)
+    # only one page is requested (see get_page_histories for multiple)
     for page in pages.values():
-        history = [ {
-            'revid': rev['revid'],
-            'modified': convert_utc_time(rev['timestamp']),
-            'link': page_revision_url(page_title, rev['revid'])
-        } for rev in page.get('revisions') ]
+        history = [_history_entry(page_title, rev) for rev in page.get('revisions')]
         return history
     _logger.error(f'get_page_history({page_title}, limit={limit}): unexpected result returned')
     return []
 
-def get_page_history_from_cutoff(page_title, cutoff_date):
-    # search increasingly for cutoff date  because
-    # api does not allow for paging through search results
-    last_result_length = 0
-    attempt = 50
+async def async_get_page_history(page_title, limit=10):
+    result = await async_fetch_url(history_url(page_title, limit=limit), json=True)
+    return _parse_page_history(page_title, limit, result)
+
+def get_page_history(page_title, limit=10):
+    return run_sync(async_get_page_history(page_title, limit))
+
+MAX_TITLES_PER_QUERY = 50 # MediaWiki limit on titles per query (non-bot clients)
+
+def _histories_params(titles):
+    return {
+        'action': 'query',
+        'format': 'json',
+        'prop': 'revisions',
+        'rvprop': 'ids|timestamp',
+        'titles': '|'.join(wiki_title(title) for title in titles)
+    }
+
+async def _async_get_latest_revisions(titles):
+    """Latest revision of each of up to MAX_TITLES_PER_QUERY titles in one request
+    (plus continuations if the API splits the result).
+    """
+    params = _histories_params(titles)
+    title_map = {wiki_title(title): title for title in titles}
+    result = {title: [] for title in titles}
+    while True:
+        data = await async_fetch_url(API_URL, params=params, json=True)
+        query = data.get('query')
+        if not query:
+            _logger.error(f'get_page_histories({len(titles)} titles): no result returned')
+            break
+        # map titles normalized by the API back to the requested form
+        for item in query.get('normalized', []):
+            if item['from'] in title_map:
+                title_map[item['to']] = title_map[item['from']]
+        for page in query.get('pages', {}).values():
+            title = title_map.get(page.get('title'))
+            if title is not None:
+                result[title] += [_history_entry(title, rev) for rev in page.get('revisions', [])]
+        if 'continue' not in data:
+            break
+        params = {**params, **data['continue']}
+    return result
+
+async def async_get_page_histories(titles, limit=10):
+    titles = _deduplicate_links(titles)
+    if limit == 1:
+        result = {}
+        batches = await asyncio.gather(*(
+            _async_get_latest_revisions(chunk)
+            for chunk in _chunked(titles, MAX_TITLES_PER_QUERY)))
+        for batch in batches:
+            result.update(batch)
+        return result
+    # the API only returns more than the latest revision for a single title
+    histories = await asyncio.gather(*(async_get_page_history(title, limit) for title in titles))
+    return dict(zip(titles, histories))
+
+def get_page_histories(titles, limit=10):
+    """Revision histories for many pages, keyed on page title.
+    Latest-revision lookups (limit=1) are batched MAX_TITLES_PER_QUERY titles per request.
+    Pages that do not exist get an empty history.
+    """
+    return run_sync(async_get_page_histories(titles, limit))
+
+HISTORY_PAGE_SIZE = 50 # revisions per request when paging back through history
+
+def _history_page_params(page_title, **kwargs):
+    params = {
+        'action': 'query',
+        'format': 'json',
+        'prop': 'revisions',
+        'rvprop': 'ids|timestamp',
+        'titles': wiki_title(page_title),
+    }
+    params.update(kwargs)
+    return params
+
+def _history_page_revisions(data):
+    """Revisions from a single-title query, or None if the page does not exist."""
+    pages = data.get('query', {}).get('pages')
+    if not pages or '-1' in pages:
+        return None
+    return next(iter(pages.values())).get('revisions', [])
+
+async def async_get_page_history_from_cutoff(page_title, cutoff_date, start_revid=None):
+    # page back from the newest revision (or start_revid) with rvcontinue, bounded by
+    # rvend so every revision newer than the cutoff is fetched exactly once
+    cutoff = to_utc_time(cutoff_date)
+    params = _history_page_params(page_title, rvlimit=HISTORY_PAGE_SIZE, rvend=cutoff)
+    if start_revid:
+        params['rvstartid'] = start_revid
+    revisions = []
     while True:
-        result = get_page_history(page_title, limit=attempt)
-        if not result:
+        data = await async_fetch_url(API_URL, params=params, json=True)
+        page_revisions = _history_page_revisions(data)
+        if page_revisions is None:
             _logger.error(f'get_page_history({page_title}, cutoff_date={cutoff_date}): empty history')
             return []
-        if len(result) == last_result_length:
-            result[-1]['created'] = True
-            return result # no more history to be had
-        if result[-1]['modified'] <= cutoff_date:
-            for index, item in enumerate(result):
-                if item['modified'] <= cutoff_date:
-                    return result[:(index+1)]
-            return result
-        # increase limit length and try again
-        last_result_length = len(result)
-        attempt *= 2
+        revisions += page_revisions
+        if 'continue' not in data:
+            break
+        params = {**params, **data['continue']}
+
+    # finish with the revision in effect at the cutoff (if the page existed then)
+    data = await async_fetch_url(
+        API_URL, params=_history_page_params(page_title, rvlimit=1, rvstart=cutoff), json=True)
+    prior = _history_page_revisions(data) or []
+    if prior and (not revisions or prior[0]['revid'] != revisions[-1]['revid']):
+        revisions += prior
+    result = [_history_entry(page_title, rev) for rev in revisions]
+    if not result:
+        _logger.error(f'get_page_history({page_title}, cutoff_date={cutoff_date}): empty history')
+    elif not prior:
+        result[-1]['created'] = True # no more history to be had
+    return result
 
+def get_page_history_from_cutoff(page_title, cutoff_date, start_revid=None):
+    """History from the newest revision (or from start_revid, inclusive) back to the
+    latest revision on or before cutoff_date.
+    """
+    return run_sync(async_get_page_history_from_cutoff(page_title, cutoff_date, start_revid))
+
+
+async def async_get_page_history_since(page_title, revid):
+    params = _history_page_params(page_title, rvlimit=HISTORY_PAGE_SIZE, rvendid=revid)
+    revisions = []
+    while True:
+        data = await async_fetch_url(API_URL, params=params, json=True)
+        revisions += _history_page_revisions(data) or []
+        if 'continue' not in data:
+            break
+        params = {**params, **data['continue']}
+    return [_history_entry(page_title, rev) for rev in revisions if rev['revid'] != revid]
+
+def get_page_history_since(page_title, revid):
+    """Revisions newer than revid (exclusive), newest first."""
+    return run_sync(async_get_page_history_since(page_title, revid))
 
 # -------------------------------------------------------------------------------
 # History LRU
 
 class HistoryLRU:
-    def __init__(self, maxsize=500, reset_limit=60 * 60):
-        self._reset_limit = reset_limit  # seconds
-        self._timer_start = time.time()
-        self._lru = LRUCache(maxsize=maxsize)
+    """In-memory LRU of page revision histories with a persistent tier in the cache.
 
-    def _flush_if_needed(self):
-        if time.time() - self._timer_start >= self._reset_limit:
-            _logger.info("HistoryLRU: flushing all entries")
-            self._lru.clear()
-            self._timer_start = time.time()
+    Histories only grow at the head, so an entry that has expired (or was just loaded
+    from the cache) is revalidated with a cheap rvlimit=1 probe, and only the
+    revisions newer than the stored head are fetched when it has changed.
+
+    Safe for concurrent use: the lock only guards the LRU itself and is never held
+    across a wiki request.
+    """
+    def __init__(self, maxsize=500, reset_limit=60 * 60, persistent=True):
+        self._reset_limit = reset_limit  # seconds before an entry is revalidated
+        self._persistent = persistent
+        self._lru = LRUCache(maxsize=maxsize) # title -> (history, time last validated)
+        self._lock = Lock()
+        self._flights = SingleFlight('history')
+
+    def _get(self, page_title):
+        with self._lock:
+            return self._lru.get(page_title)
+
+    def _cache_path(self, page_title):
+        return f'history_cache/{page_title}.json'
+
+    def _load(self, page_title):
+        if not self._persistent:
+            return None
+        try:
+            return load_cached_object(self._cache_path(page_title))['history']
+        except CacheMissError:
+            return None
+
+    def _load_many(self, page_titles):
+        """Persisted histories of those of page_titles that have one, loaded together."""
+        if not self._persistent or not page_titles:
+            return {}
+        paths = {self._cache_path(page_title): page_title for page_title in page_titles}
+        return {paths[path]: data['history'] for path, data in load_cached_objects(paths).items()}
+
+    def _store(self, page_title, history, validated, probed=True, persist=True):
+        """Store a history whose head the wiki reported as the latest revision at time
+        validated; probed if it was fetched just now rather than kept from before."""
+        with self._lock:
+            entry = self._lru.get(page_title)
+            if entry is not None and entry[0] and history and entry[0][0]['revid'] > history[0]['revid']:
+                return # a concurrent caller already stored a newer head
+            self._lru[page_title] = (history, validated)
+        if history and probed:
+            _latest_revisions.record(page_title, history[0]['revid'], validated)
+        if persist and self._persistent and history:
+            save_cached_object({
+                'version': 'v1',
+                'head': history[0]['revid'],
+                'history': history,
+            }, self._cache_path(page_title))
+
+    def _revalidate(self, page_title, history, latest=None, probed=None):
+        """Bring a stored history up to date, given the result of an rvlimit=1 probe
+        (made at time probed) if it is already known."""
+        if latest is None:
+            probed = time.time()
+            latest = get_page_history(page_title, limit=1)
+        if latest and history and latest[0]['revid'] == history[0]['revid']:
+            _logger.info(f"HistoryLRU({page_title}): unchanged")
+            self._store(page_title, history, probed, persist=False)
+            return history
+        if latest and history:
+            _logger.info(f"HistoryLRU({page_title}): fetching new revisions")
+            history = get_page_history_since(page_title, history[0]['revid']) + history
+        else:
+            history = latest
+        self._store(page_title, history, probed)
+        return history
+
+    def _history(self, page_title):
+        """Up to date history from memory or the persistent tier and the time it was
+        validated, or (None, None) if unknown."""
+        entry = self._get(page_title)
+        if entry is not None:
+            history, validated = entry
+            if time.time() - validated < self._reset_limit:
+                return history, validated
+        else:
+            history = self._load(page_title)
+            if history is None:
+                return None, None
+        _logger.info(f"HistoryLRU({page_title}): revalidating")
+        probed = time.time()
+        return self._revalidate(page_title, history), probed
+
+    def revalidate(self, page_title):
+        """Probe the wiki now (regardless of expiry) and return the up to date history."""
+        entry = self._get(page_title)
+        history = entry[0] if entry is not None else self._load(page_title)
+        return self._revalidate(page_title, history)
 
     def _filter_with_fallback(self, history, cutoff_date):
         split = next((i for i, h in enumerate(history) if h['modified'] <= cutoff_date), len(history))
         return history[:split + 1]
 
     def lookup(self, page_title, limit=10):
-        self._flush_if_needed()
-        try:
-            history = self._lru[page_title]
+        return self._flights.do(('lookup', page_title, limit), self._lookup, page_title, limit)
+
+    def _lookup(self, page_title, limit):
+        history, _ = self._history(page_title)
+        if history is not None:
             _logger.info(f"HistoryLRU.lookup({page_title}): cache hit")
-            if len(history) >= limit:
+            if len(history) >= limit or (history and history[-1].get('created')):
                 return history[:limit]
             _logger.info(f"HistoryLRU.lookup({page_title}): cache too short, refreshing")
-        except KeyError:
+        else:
             _logger.info(f"HistoryLRU.lookup({page_title}): cache miss")
         # Refresh
+        probed = time.time()
         history = get_page_history(page_title, limit=limit)
-        self._lru[page_title] = history
+        if history and len(history) < limit:
+            history[-1]['created'] = True # that is the whole history
+        self._store(page_title, history, probed)
         return history[:limit]
 
+    def lookup_many(self, page_titles, limit=1):
+        """Bulk lookup returning a dict keyed on page title.
+        All misses are filled together, one request per batch of titles. For limit=1
+        that batch also serves as the revalidation probe for persisted histories.
+        """
+        result = {}
+        misses = []
+        for page_title in page_titles:
+            entry = self._get(page_title)
+            if entry is not None and time.time() - entry[1] < self._reset_limit and len(entry[0]) >= limit:
+                result[page_title] = entry[0][:limit]
+            else:
+                misses.append(page_title)
+        _logger.info(f"HistoryLRU.lookup_many({len(page_titles)} titles): {len(misses)} misses")
+        if misses:
+            probed = time.time()
+            histories = get_page_histories(misses, limit=limit)
+            # persisted histories to revalidate, loaded together rather than one at a time
+            persisted = self._load_many(
+                [t for t in histories if self._get(t) is None]) if limit == 1 else {}
+            for page_title, history in histories.items():
+                if limit == 1:
+                    entry = self._get(page_title)
+                    stored = entry[0] if entry is not None else persisted.get(page_title)
+                    history = self._revalidate(page_title, stored, latest=history, probed=probed)
+                else:
+                    self._store(page_title, history, probed)
+                result[page_title] = history[:limit]
+        return result
+
     def lookup_by_cutoff(self, page_title, cutoff_date):
-        self._flush_if_needed()
-        try:
-            history = self._lru[page_title]
-            _logger.info(f"HistoryLRU.lookup_by_cutoff({page_title}): cache hit")
+        return self._flights.do(
+            ('cutoff', page_title, cutoff_date), self._lookup_by_cutoff, page_title, cutoff_date)
 
-            if history:
-                oldest = history[-1]
-                if oldest.get('created') or oldest['modified'] < cutoff_date:
-                    # We have enough
-                    return self._filter_with_fallback(history, cutoff_date)
-                _logger.info(f"HistoryLRU.lookup_by_cutoff({page_title}): cache incomplete, refreshing")
-        except KeyError:
+    def _lookup_by_cutoff(self, page_title, cutoff_date):
+        history, validated = self._history(page_title)
+        if history is None:
             _logger.info(f"HistoryLRU.lookup_by_cutoff({page_title}): cache miss")
+        else:
+            _logger.info(f"HistoryLRU.lookup_by_cutoff({page_title}): cache hit")
 
-        # Refresh and filter
-        history = get_page_history_from_cutoff(page_title, cutoff_date=cutoff_date)
-        self._lru[page_title] = history
+        if history:
+            oldest = history[-1]
+            if oldest.get('created') or oldest['modified'] < cutoff_date:
+                # We have enough
+                return self._filter_with_fallback(history, cutoff_date)
+            # history only grows at the head: fetch just the older tail that is missing
+            _logger.info(f"HistoryLRU.lookup_by_cutoff({page_title}): cache incomplete, extending")
+            tail = get_page_history_from_cutoff(
+                page_title, cutoff_date=cutoff_date, start_revid=oldest['revid'])
+            history = history + [item for item in tail if item['revid'] != oldest['revid']]
+            if tail and tail[-1].get('created') and not history[-1].get('created'):
+                # created after the cutoff: the flag was on the tail's copy of oldest
+                history[-1] = {**history[-1], 'created': True}
+            # the head is as old as before: only the tail was fetched
+            self._store(page_title, history, validated, probed=False)
+        else:
+            # Refresh
+            validated = time.time()
+            history = get_page_history_from_cutoff(page_title, cutoff_date=cutoff_date)
+            self._store(page_title, history, validated)
         return self._filter_with_fallback(history, cutoff_date)
 
+# -------------------------------------------------------------------------------
+# Prefix-wide crawl (using wiki API)
+
+CRAWL_BATCH_SIZE = MAX_TITLES_PER_QUERY # pages per request (the API limit when content is included)
+
+def _crawl_params(title_prefix, namespace, **kwargs):
+    return {
+        'action': 'query',
+        'generator': 'allpages',
+        'gapnamespace': namespace,
+        'gapprefix': title_prefix.split(':', 1)[1],
+        'gaplimit': CRAWL_BATCH_SIZE,
+        'prop': 'revisions',
+        'rvprop': 'ids|timestamp|content',
+        'rvslots': 'main',
+        'format': 'json',
+        **kwargs
+    }
+
+async def async_crawl_batch(title_prefix, cont=None):
+    """
+    Next batch of the pages at or below title_prefix (e.g. "Архів:ДАЖО") in title order,
+    with the wikitext of their latest revision, starting from continuation cont.
+    Returns the list of revisions (dicts with title, revid, timestamp, wikitext) and the
+    continuation for the next batch, or None after the last.
+    """
+    params = _crawl_params(title_prefix, await _async_namespace_id(), **(cont or {}))
+    revisions = {}
+    while True:
+        data = await async_fetch_url(API_URL, params=params, json=True)
+        if 'error' in data:
+            raise RuntimeError(f"API error: {data['error']}")
+        for page in data.get('query', {}).get('pages', {}).values():
+            title = page['title']
+            if page.get('revisions') and (title == title_prefix or title.startswith(f'{title_prefix}/')):
+                revision = page['revisions'][0]
+                revisions[title] = {
+                    'title': title,
+                    'revid': revision['revid'],
+                    'timestamp': revision['timestamp'],
+                    'wikitext': revision['slots']['main']['*'],
+                }
+        cont = data.get('continue')
+        if not cont or 'rvcontinue' not in cont:
+            break
+        # the content of this batch did not fit in one response
+        params = {**params, **cont}
+    for revision in revisions.values():
+        _latest_revisions.record(revision['title'], revision['revid'])
+    return [revisions[title] for title in sorted(revisions)], cont
+
+def crawl_batch(title_prefix, cont=None):
+    return run_sync(async_crawl_batch(title_prefix, cont))
+
+def revision_page(revision):
+    """Page data (as from mw_read_page) for a revision returned by crawl_batch."""
+    title = revision['title'].replace(f'{WIKI_NAMESPACE}:', '')
+    return run_sync(_async_revision_page(
+        revision['title'], revision['wikitext'], title, revision['timestamp']))
+
 # -------------------------------------------------------------------------------
 # Document link extraction from wikitext
 
@@ -774,25 +1788,40 @@ def _chunked(iterable, size):
             break
         yield chunk
 
-def batch_fetch_document_links(titles, map_to_url=True, chunk_size=20):
+def _parse_document_links(data, map_to_url, result):
+    if not 'query' in data:
+        _logger.error(f'batch_fetch_document_links returned:\n    {data}')
+    for page in data['query']['pages'].values():
+        title = page['title'].split(':', 1)[-1]  # strip 'Архів:' prefix
+        try:
+            wikitext = page['revisions'][0]['slots']['main']['*']
+            links = _extract_file_links(wikitext)
+            if map_to_url:
+                links = [_file_link_to_url(link) for link in links]
+            result[title] = _deduplicate_links(links)
+        except (KeyError, IndexError):
+            result[title] = []
+
+async def async_batch_fetch_document_links(titles, map_to_url=True, chunk_size=MAX_TITLES_PER_QUERY):
     if not isinstance(titles, (list, tuple)):
         titles = [titles]
 
     result = {}
 
-    for chunk in _chunked(titles, chunk_size):
-        data = fetch_url(_wiki_content_url(chunk), json=True)
-        if not 'query' in data:
-            _logger.error(f'batch_fetch_document_links returned:\n    {data}')
-        for page in data['query']['pages'].values():
-            title = page['title'].split(':', 1)[-1]  # strip 'Архів:' prefix
-            try:
-                wikitext = page['revisions'][0]['slots']['main']['*']
-                links = _extract_file_links(wikitext)
-                if map_to_url:
-                    links = [_file_link_to_url(link) for link in links]
-                result[title] = _deduplicate_links(links)
-            except (KeyError, IndexError):
-                result[title] = []
+    responses = await asyncio.gather(*(
+        async_fetch_url(_wiki_content_url(chunk), json=True)
+        for chunk in _chunked(titles, chunk_size)))
+    for data in responses:
+        # parse off the fetch loop, which serves every other request meanwhile
+        await asyncio.to_thread(_parse_document_links, data, map_to_url, result)
 
     return result
+
+_document_link_flights = SingleFlight('document_links')
+
+def batch_fetch_document_links(titles, map_to_url=True, chunk_size=MAX_TITLES_PER_QUERY):
+    if not isinstance(titles, (list, tuple)):
+        titles = [titles]
+    return _document_link_flights.do(
+        (tuple(titles), map_to_url, chunk_size),
+        lambda: run_sync(async_batch_fetch_document_links(titles, map_to_url, chunk_size)))
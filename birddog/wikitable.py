@@ -0,0 +1,149 @@
+# (c) 2025 Jonathan Brandt
+# Licensed under the MIT License. See LICENSE file in the project root.
+
+# Fast wikitable tokenizer
+#
+# Archive pages are mostly one large wikitable whose cells hold plain text, an entry
+# link such as [[/12/]] and now and then an external link or some bold or italic
+# markup. Parsing the whole page with mwparserfromhell builds a node tree for every
+# cell, which dominates page load time for tables of thousands of rows.
+#
+# This module handles that common case with a single pass over the lines of the
+# table and a few regular expressions per cell. Anything it does not understand
+# exactly (templates, tags, entities, bare URLs, nested or unbalanced markup) is
+# reported as such, and the caller falls back to mwparserfromhell for that cell
+# (or for the whole page if the table itself cannot be located safely). Results
+# are the same as those of mwparserfromhell's strip_code() and filter_*() methods.
+
+import re
+
+# [[title]] or [[title|label]]; titles cannot contain brackets, braces, angle
+# brackets or pipes
+_WIKILINK = re.compile(r"\[\[([^\[\]{}<>|\n]+)(?:\|([^\[\]{}\n]*))?\]\]")
+
+# [http://url] or [http://url label]
+_EXTLINK = re.compile(r"\[(https?://[^\s\[\]<>\"]+)(?: ([^\[\]\n]*))?\]")
+
+_LINK = re.compile(f"{_WIKILINK.pattern}|{_EXTLINK.pattern}")
+
+# runs of apostrophes: '' italic, ''' bold, ''''' both
+_QUOTES = re.compile(r"'{2,}")
+
+# markup this tokenizer leaves to the full parser, including bare URLs
+_COMPLEX = re.compile(r"[{}<>&]|://|\b(?:bitcoin|geo|magnet|mailto|news|sips?|sms|tel|urn|xmpp):", re.I)
+
+# line-start markup (lists, headings, rules) when a cell is parsed on its own
+_LINE_START = ('*', '#', ':', ';', '=', '----')
+
+# tags whose contents are not wikitext (or are hidden), which could hide a table
+_HIDING_TAGS = ('<!--', '<nowiki', '<pre', '<ref', '<source', '<syntaxhighlight', '<math',
+                '<gallery', '<includeonly', '<noinclude', '<onlyinclude')
+
+def _strip_quotes(text):
+    """Text with balanced bold and italic markup removed, or None if the quotes are
+    anything but simple, properly nested pairs."""
+    if "''" not in text:
+        return text
+    open_marks = []
+    for run in _QUOTES.findall(text):
+        mark = {2: 'i', 3: 'b', 5: 'bi'}.get(len(run))
+        if mark is None:
+            return None
+        if open_marks and open_marks[-1] == mark:
+            open_marks.pop()
+        elif mark in open_marks or (mark == 'bi' and open_marks) or 'bi' in open_marks:
+            return None # overlapping markup
+        else:
+            open_marks.append(mark)
+    if open_marks:
+        return None # unclosed markup is kept as text
+    return _QUOTES.sub('', text)
+
+def parse_cell(cell_text):
+    """
+    Tokenize the wikitext of one table cell.
+    Returns (text, link targets, external link): the text with markup stripped, the
+    targets of its wikilinks and the URL of its first external link (or None).
+    Returns None if the cell needs the full parser.
+    """
+    if cell_text.startswith(_LINE_START) or _COMPLEX.search(
+            _EXTLINK.sub(lambda m: m.group(2) or '', cell_text) if '[' in cell_text else cell_text):
+        return None
+    if '[' not in cell_text and ']' not in cell_text:
+        text = _strip_quotes(cell_text)
+        return (text, [], None) if text is not None else None
+
+    parts = []
+    link_targets = []
+    ext_link = None
+    position = 0
+    for match in _LINK.finditer(cell_text):
+        plain = cell_text[position:match.start()]
+        if '[' in plain or ']' in plain:
+            return None
+        text = _strip_quotes(plain)
+        if text is None:
+            return None
+        parts.append(text)
+        title, label, url, url_label = match.groups()
+        if title is not None:
+            if not title.strip() or "''" in title or title.startswith('//') or _COMPLEX.search(title) or (label and "''" in label):
+                return None
+            link_targets.append(title.strip())
+            parts.append(label if label is not None else title)
+        else:
+            if url_label and "''" in url_label:
+                return None
+            ext_link = ext_link or url
+            parts.append(url_label or '')
+        position = match.end()
+    plain = cell_text[position:]
+    if '[' in plain or ']' in plain:
+        return None
+    text = _strip_quotes(plain)
+    if text is None:
+        return None
+    parts.append(text)
+    return ''.join(parts), link_targets, ext_link
+
+def _is_wikitable(line):
+    return line.startswith('{|') and 'wikitable' in line
+
+def split_table(wikitext):
+    """
+    Locate the first wikitable of a page in a single pass over its lines.
+    Returns (text before the table, table row lines, text after the table), with
+    the row lines stripped and empty and row separator lines dropped, or None if
+    there is no such table or it may be nested in other markup.
+    """
+    before = []
+    rows = None
+    depth = 0
+    lines = iter(wikitext.split('\n'))
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('{|'):
+            if depth > 0:
+                return None # nested table
+            depth = 1
+            if _is_wikitable(stripped):
+                rows = []
+                break
+        elif depth and stripped.startswith('|}'):
+            depth = 0
+        before.append(line)
+    if rows is None:
+        return None
+    before = '\n'.join(before)
+    if before.count('{{') != before.count('}}') or any(tag in before for tag in _HIDING_TAGS):
+        return None # the table may be inside a template, comment or tag
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('|}'):
+            return before, rows, '\n'.join([line.split('|}', 1)[1], *lines])
+        if stripped.startswith('{|'):
+            return None # nested table
+        if stripped and stripped != '|-':
+            rows.append(stripped)
+    return None # not closed
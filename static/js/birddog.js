@@ -434,6 +434,10 @@ function render_page_data(data) {
                     cell_elem.classList.add('table-warning');
                     row_edited = true;
                     break;
+                case 'moved':
+                    cell_elem.classList.add('table-info');
+                    row_edited = true;
+                    break;
                 default:
                     break;
                 }
@@ -482,6 +486,23 @@ function render_page_data(data) {
         }
     });
 
+    // rows in the reference version that are no longer on the page
+    if (is_comparison) {
+        (data.removed ?? []).forEach(child => {
+            const row_elem = document.createElement('tr');
+            child.forEach(item => {
+                const cell_elem = document.createElement('td');
+                cell_elem.classList.add('table-danger', 'text-decoration-line-through');
+                cell_elem.textContent = get_text(item.text) || '';
+                row_elem.appendChild(cell_elem);
+            });
+            row_elem.style.pointerEvents = 'none';
+            body_elem.appendChild(row_elem);
+            row_added = true;
+            any_edit = true;
+        });
+    }
+
     // watch button is only visible for archive level pages
     //show_if('archive-watch-btn', data.kind == 'archive')
 
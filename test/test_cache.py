@@ -1,12 +1,43 @@
 import os
+import time
+import tempfile
+import threading
 import unittest
+from unittest.mock import patch
 from birddog.cache import (
     CacheMissError,
     save_cached_object,
     load_cached_object,
+    save_cached_objects,
+    load_cached_objects,
     remove_cached_object,
+    MemoryTier,
+    DiskTier,
+    TieredCache,
     )
 
+class _FakeRemote:
+    """Stands in for S3: bodies with ETags, and a log of the requests."""
+    def __init__(self):
+        self.objects = {}
+        self.requests = []
+
+    def get(self, path, etag=None):
+        self.requests.append(('get', path, etag))
+        if path not in self.objects:
+            return None
+        current, body = self.objects[path]
+        return (etag, None) if etag == current else (current, body)
+
+    def put(self, path, body):
+        self.requests.append(('put', path))
+        self.objects[path] = (f'"{len(self.requests)}"', body)
+        return self.objects[path][0]
+
+    def delete(self, path):
+        self.requests.append(('delete', path))
+        self.objects.pop(path, None)
+
 # ------------------ UTILITY UNIT TESTS ------------------ 
 class Test(unittest.TestCase):
     def test_cache(self):
@@ -19,5 +50,134 @@ class Test(unittest.TestCase):
         with self.assertRaises(CacheMissError):
             load_cached_object('unitttest_nonexistent.json')
 
+    def test_batch(self):
+        objects = {f'unittest_batch/{i}.json': {'i': i, 'text': 'відредаговано'} for i in range(5)}
+        save_cached_objects(objects)
+        paths = list(objects) + ['unittest_batch/nonexistent.json']
+        self.assertEqual(load_cached_objects(paths), objects) # the miss is left out
+        self.assertEqual(load_cached_objects([]), {})
+        for path in objects:
+            self.assertEqual(load_cached_object(path), objects[path])
+            remove_cached_object(path)
+        self.assertEqual(load_cached_objects(paths), {})
+
+    def test_tiered_cache(self):
+        remote = _FakeRemote()
+        with tempfile.TemporaryDirectory() as folder:
+            cache = TieredCache(remote, MemoryTier(100), DiskTier(folder, 60), revalidate_after=60)
+            cache.save('a.json', b'"a"')
+            self.assertEqual(cache.load('a.json'), b'"a"')
+            self.assertEqual(remote.requests, [('put', 'a.json')]) # served from memory
+
+            # a new worker finds it on disk, then in memory
+            cache = TieredCache(remote, MemoryTier(100), DiskTier(folder, 60), revalidate_after=60)
+            self.assertEqual(cache.load('a.json'), b'"a"')
+            self.assertEqual(cache.load('a.json'), b'"a"')
+            self.assertEqual(len(remote.requests), 1)
+            stats = cache.stats
+            self.assertEqual((stats['memory']['hits'], stats['disk']['hits']), (1, 1))
+            self.assertEqual(stats['memory']['hit_ratio'], 0.5)
+
+            # once expired, entries are revalidated on their ETag and only downloaded if changed
+            with patch('time.time', lambda: 1e12):
+                self.assertEqual(cache.load('a.json'), b'"a"')
+                self.assertEqual(remote.requests[-1], ('get', 'a.json', remote.objects['a.json'][0]))
+                remote.objects['a.json'] = ('"other"', b'"b"') # written by another worker
+                cache._memory.touch('a.json', 0)
+                cache._disk.touch('a.json', 0)
+                self.assertEqual(cache.load('a.json'), b'"b"')
+            stats = cache.stats
+            self.assertEqual((stats['remote']['revalidated'], stats['remote']['hits']), (1, 1))
+
+            cache.remove('a.json')
+            self.assertIsNone(cache.load('a.json'))
+            self.assertEqual(cache.stats['remote']['misses'], 1)
+            self.assertEqual(os.listdir(folder), [])
+
+    def test_tiered_cache_fresh(self):
+        # two workers over one remote: a fresh load sees the other's write at once
+        remote = _FakeRemote()
+        with tempfile.TemporaryDirectory() as folder_a, tempfile.TemporaryDirectory() as folder_b:
+            a = TieredCache(remote, MemoryTier(100), DiskTier(folder_a, 60), revalidate_after=60)
+            b = TieredCache(remote, MemoryTier(100), DiskTier(folder_b, 60), revalidate_after=60)
+            a.save('r.json', b'[1]')
+            self.assertEqual(b.load('r.json'), b'[1]')
+            a.save('r.json', b'[1,2]')
+            self.assertEqual(b.load('r.json'), b'[1]') # within revalidate_after
+            self.assertEqual(b.load('r.json', fresh=True), b'[1,2]')
+            # unchanged: revalidated with its ETag, not downloaded again
+            del remote.requests[:]
+            self.assertEqual(b.load('r.json', fresh=True), b'[1,2]')
+            self.assertEqual(remote.requests, [('get', 'r.json', remote.objects['r.json'][0])])
+            self.assertEqual(b.stats['remote']['revalidated'], 1)
+
+    def test_disk_tier_eviction(self):
+        with tempfile.TemporaryDirectory() as folder:
+            disk = DiskTier(folder, 60)
+            for name in ('b', 'c', 'd'):
+                disk.put(f'x/{name}.json', ('"1"', b'"' + name.encode() * 10 + b'"', 0)) # 16 bytes each
+            self.assertEqual(disk.get('x/b.json'), ('"1"', b'"bbbbbbbbbb"', 0))
+            disk.put('x/e.json', ('"1"', b'"eeeeeeeeee"', 0))
+            self.assertEqual(sorted(os.listdir(f'{folder}/x')), ['b.json', 'd.json', 'e.json'])
+            self.assertEqual(disk.size, 48)
+            # a new worker picks up the same order from the files' access times
+            disk = DiskTier(folder, 40)
+            self.assertEqual(sorted(os.listdir(f'{folder}/x')), ['b.json', 'e.json'])
+
+    def test_disk_tier_shared(self):
+        # two workers sharing a folder keep it within max_bytes together
+        with tempfile.TemporaryDirectory() as folder:
+            workers = [DiskTier(folder, 64), DiskTier(folder, 64)]
+            for i in range(8):
+                workers[i % 2].put(f'x/{i}.json', ('"1"', b'"' + str(i).encode() * 10 + b'"', 0)) # 16 bytes each
+            self.assertEqual(sorted(os.listdir(f'{folder}/x')), ['4.json', '5.json', '6.json', '7.json'])
+            self.assertEqual(workers[1].size, 64)
+
+    def test_tiered_cache_concurrency(self):
+        remote = _FakeRemote()
+        active = []
+        peak = []
+        lock = threading.Lock()
+        def slow_get(path, etag=None):
+            with lock:
+                active.append(path)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(path)
+            return _FakeRemote.get(remote, path, etag)
+        remote.get = slow_get
+        for i in range(4):
+            remote.put(f'{i}.json', f'{i}'.encode())
+        cache = TieredCache(remote, MemoryTier(1000))
+        threads = [threading.Thread(target=cache.load, args=(f'{i % 4}.json',)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gets = [r for r in remote.requests if r[0] == 'get']
+        self.assertEqual(sorted(r[1] for r in gets), ['0.json', '1.json', '2.json', '3.json']) # one per path
+        self.assertGreater(max(peak), 1) # different paths in parallel
+
+    def test_concurrent_writes(self):
+        path = 'unittest_concurrent.json'
+        objects = [list(range(i * 1000, i * 1000 + 1000)) for i in range(8)]
+        failures = []
+        def write(obj):
+            for _ in range(20):
+                save_cached_object(obj, path)
+                try:
+                    if load_cached_object(path) not in objects:
+                        failures.append('mixed') # never a partial or interleaved file
+                except Exception as e:
+                    failures.append(e)
+        threads = [threading.Thread(target=write, args=(obj,)) for obj in objects]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        remove_cached_object(path)
+
 if __name__ == "__main__":
     unittest.main()
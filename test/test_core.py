@@ -1,14 +1,28 @@
 import os
+import time
+import random
+import threading
+from collections import Counter
 from copy import copy
+from types import SimpleNamespace
 import unittest
-from birddog.wiki import ARCHIVE_BASE
+from unittest.mock import patch
+from urllib.parse import quote
+from birddog.utility import convert_utc_time
+from birddog.wiki import ARCHIVE_BASE, ExistenceIndex, LatestRevisionIndex, find_archive
+from birddog.cache import load_cached_bytes, load_cached_object, remove_cached_object
+from birddog.pageformat import unpack_page
 from birddog.core import (
     Archive,
     Fond,
     Opus,
     Case,
     PageLRU,
-    ArchiveWatcher
+    ComparedPage,
+    ArchiveWatcher,
+    ArchiveCrawler,
+    ChangeFeed,
+    TitleIndex,
     )
 
 archive_path = '%D0%90%D1%80%D1%85%D1%96%D0%B2:%D0%94%D0%90%D0%96%D0%9E'
@@ -16,8 +30,432 @@ fond_id = '1'
 opus_id = '74'
 case_id = '1'
 
+def _fake_archive():
+    return SimpleNamespace(
+        name='UNITTEST-D',
+        tag='UNITTEST',
+        subarchive={'uk': 'Д', 'en': 'D'},
+        title_prefix='Архів:ТЕСТ',
+        url=f'{ARCHIVE_BASE}/wiki/%D0%90%D1%80%D1%85%D1%96%D0%B2%3A%D0%A2%D0%95%D0%A1%D0%A2/%D0%94',
+        children=[[{'text': {'uk': '1', 'en': '1'}}], [{'text': {'uk': '2', 'en': '2'}}]])
+
+class _FakeRecentChangesApi:
+    def __init__(self):
+        self.changes = []
+        self.rcstarts = []
+
+    def add(self, title, timestamp):
+        self.changes.append({'title': title, 'timestamp': timestamp, 'revid': len(self.changes) + 1})
+
+    async def fetch(self, url, params=None, json=False):
+        if params.get('meta') == 'siteinfo':
+            return {'query': {'namespaces': {'0': {'id': 0, '*': ''}, '250': {'id': 250, '*': 'Архів'}}}}
+        self.rcstarts.append(params.get('rcstart'))
+        changes = [c for c in self.changes if c['timestamp'] >= params.get('rcstart', '')]
+        return {'query': {'recentchanges': changes}}
+
+class _FakeArchive:
+    """Stands in for Archive: each instance is one load of the page."""
+    loads = 0
+    modified = '2024,01,01,10:00'
+
+    def __init__(self, tag, subarchive=None):
+        _FakeArchive.loads += 1
+        self.kind = 'archive'
+        self.lastmod = _FakeArchive.modified
+
+    def history(self, limit=None, cutoff_date=None, refresh=False):
+        return [{'modified': _FakeArchive.modified}]
+
+class _FakeTreePage:
+    """Stands in for Archive and its descendants: loads are slow and counted per page."""
+    loads = Counter()
+    loads_lock = threading.Lock()
+
+    def __init__(self, tag, subarchive=None, path=()):
+        self.name = '/'.join((tag, subarchive or '', *path))
+        self.kind = ('archive', 'fond', 'opus', 'case')[len(path)]
+        self.lastmod = '2024,01,01,10:00'
+        with _FakeTreePage.loads_lock:
+            _FakeTreePage.loads[self.name] += 1
+        time.sleep(0.002) # long enough for threads to interleave
+        self._spec = (tag, subarchive, path)
+
+    def lookup(self, child_id):
+        tag, subarchive, path = self._spec
+        return _FakeTreePage(tag, subarchive, (*path, child_id))
+
+    def history(self, limit=None, cutoff_date=None, refresh=False):
+        return [{'modified': self.lastmod}]
+
+def _row_link(title):
+    return '/wiki/' + quote(title, safe='/:')
+
+class _FakeCrawlArchive:
+    """Stands in for Archive when seeding a crawl of DAZHO: only Д lists a fond."""
+    def __init__(self, tag, subarchive=None):
+        self.title = find_archive(tag, subarchive)['title']['uk'].split(':')[1]
+        self.name = f'UNITTEST-{subarchive}'
+        self.page = {'link': ARCHIVE_BASE + _row_link(f'Архів:{self.title}'), 'children': []}
+        if subarchive == 'D':
+            self.page['children'] = [[{'text': {'uk': '1'}, 'link': _row_link('Архів:ДАЖО/1')}]]
+
+class _FakeAllPagesApi:
+    """Serves generator=allpages with content, batch_size pages per request."""
+    pages = {
+        'Архів:ДАЖО/1': '{| class="wikitable"\n! Опис\n|-\n| [[/74/]]\n|}',
+        'Архів:ДАЖО/1/74': '{| class="wikitable"\n! Справа || Назва\n|-\n| [[/1/]] || Перша\n|}',
+        'Архів:ДАЖО/1/74/1': '{| class="wikitable"\n! Аркуші\n|-\n| 1-20\n|}',
+        'Архів:ДАЖО/1/99': 'Не вказана у фонді',
+        'Архів:ДАЖО/Д': '{| class="wikitable"\n! Фонд\n|-\n| [[ДАЖО/1|1]]\n|}',
+        'Архів:ДАЖО/Р': 'Фонди періоду після 1917 року',
+        'Архів:ДАЖОХ': 'Інший архів',
+    }
+    timestamp = '2024-03-01T10:00:00Z'
+
+    def __init__(self, batch_size=2):
+        self.batch_size = batch_size
+        self.batches = 0
+
+    async def fetch(self, url, params=None, json=False):
+        if params.get('meta') == 'siteinfo':
+            return {'query': {'namespaces': {'250': {'id': 250, '*': 'Архів'}}}}
+        if params.get('generator') == 'allpages':
+            self.batches += 1
+            titles = sorted(t for t in self.pages if t >= params.get('gapcontinue', ''))
+            data = {'query': {'pages': {str(i): {'title': t, 'revisions': [{
+                'revid': i + 1, 'timestamp': self.timestamp, 'slots': {'main': {'*': self.pages[t]}}}]}
+                for i, t in enumerate(titles[:self.batch_size])}}}
+            if len(titles) > self.batch_size:
+                data['continue'] = {'gapcontinue': titles[self.batch_size], 'continue': 'gapcontinue||'}
+            return data
+        titles = params.get('titles', '').split('|')
+        return {'query': {'pages': {str(-i): {'title': t} for i, t in enumerate(titles)}}}
+
+def _hammer(lookup, keys, threads=16, lookups=200):
+    """Run random lookups from many threads, returning any (key, result or error) mismatches."""
+    failures = []
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(lookups):
+            key = rng.choice(keys)
+            try:
+                page = lookup(*key)
+                if page.name != '/'.join(key):
+                    failures.append((key, page.name))
+            except Exception as e:
+                failures.append((key, e))
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return failures
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
 # ------------------ UTILITY UNIT TESTS ------------------ 
 class Test(unittest.TestCase):
+    def test_PageLRU_stale_while_revalidate(self):
+        _FakeArchive.loads = 0
+        with patch('birddog.core.Archive', _FakeArchive):
+            lru = PageLRU(ttl={'archive': 0})
+            page = lru.lookup('DAZHO', 'D')
+            self.assertEqual(_FakeArchive.loads, 1)
+
+            # expired but unchanged: served stale, revalidated without reloading
+            self.assertIs(lru.lookup('DAZHO', 'D'), page)
+            self.assertTrue(_wait_for(lambda: lru.stats['refreshes'] == 1))
+            self.assertEqual(_FakeArchive.loads, 1)
+
+            # changed on the wiki: still served stale, then replaced in the background
+            _FakeArchive.modified = '2024,02,01,10:00'
+            self.assertIs(lru.lookup('DAZHO', 'D'), page)
+            self.assertTrue(_wait_for(lambda: lru.stats['refreshes'] == 2))
+            self.assertEqual(_FakeArchive.loads, 2)
+            self.assertIsNot(lru.lookup('DAZHO', 'D'), page)
+            stats = lru.stats
+            self.assertEqual((stats['misses'], stats['stale'], stats['reloads']), (1, 3, 1))
+
+            # a failed refresh evicts the entry: the next lookup loads the page again
+            with patch.object(_FakeArchive, 'history', side_effect=RuntimeError('wiki down')):
+                page = lru.lookup('DAZHO', 'D')
+                self.assertTrue(_wait_for(lambda: lru.stats['failures'] == 1))
+            self.assertIsNot(lru.lookup('DAZHO', 'D'), page)
+            self.assertEqual((_FakeArchive.loads, lru.stats['misses']), (3, 2))
+
+    def test_PageLRU_default_subarchive(self):
+        # an archive looked up without a subarchive gets its first one
+        with patch('birddog.core.Page.__init__', lambda page, *args, **kwargs: None):
+            archive = PageLRU().lookup('DAK', None)
+        self.assertEqual(archive.subarchive, find_archive('DAK')['subarchive'])
+
+    def test_PageLRU_concurrency(self):
+        keys = [('DAZHO', 'D', *path) for path in
+                [(), ('1',), ('2',), ('1', '1'), ('1', '2'), ('2', '1'), ('1', '1', '1'), ('1', '2', '3')]]
+        with patch('birddog.core.Archive', _FakeTreePage):
+            # everything fits: each page is loaded exactly once however many threads miss on it
+            _FakeTreePage.loads.clear()
+            lru = PageLRU()
+            self.assertEqual(_hammer(lru.lookup, keys), [])
+            self.assertEqual(set(_FakeTreePage.loads.values()), {1})
+
+            # constant eviction and background refreshes under contention
+            lru = PageLRU(maxsize=3, ttl={'archive': 0, 'fond': 0})
+            self.assertEqual(_hammer(lru.lookup, keys), [])
+            self.assertLessEqual(len(lru._lru), 3)
+
+    def test_ComparedPage(self):
+        page = SimpleNamespace(name='DAZHO-D/1', kind='fond', refmod='',
+                               page={'lastmod': '2024', 'children': [[{'text': {'uk': '1'}}]]})
+        compared = ComparedPage(page, {'lastmod': '2024', 'refmod': '2023',
+                                       'children': [[{'text': {'uk': '1'}, 'edit': 'added'}]]})
+        self.assertEqual((compared.name, compared.kind), ('DAZHO-D/1', 'fond'))
+        self.assertEqual(compared.refmod, '2023')
+        self.assertEqual(compared.children[0][0]['edit'], 'added')
+        self.assertNotIn('edit', page.page['children'][0][0])
+
+    def test_compare_memo(self):
+        page = Fond.__new__(Fond)
+        page._spec = ('1', '/wiki/Архів:ТЕСТ/1')
+        page._parent = SimpleNamespace(name='UNITTEST-D')
+        page._page = {'lastmod': '2024,01,02,10:00', 'title': {'uk': 'б'}, 'description': {'uk': ''},
+                      'children': [[{'text': {'uk': '1'}}, {'text': {'uk': 'нове'}}]]}
+        reference = {**page._page, 'lastmod': '2023,01,01,10:00',
+                     'children': [[{'text': {'uk': '1'}}, {'text': {'uk': 'старе'}}]]}
+        history = [{'revid': 7, 'modified': '2024,01,02,10:00'}, {'revid': 3, 'modified': '2023,01,01,10:00'}]
+        loads = []
+        def version_data(date):
+            loads.append(date)
+            return reference
+        remove_cached_object('compare_cache/UNITTEST-D/1/7-3.json')
+        with patch.object(page, 'history', lambda **kwargs: history), \
+             patch.object(page, '_version_data', version_data), \
+             patch('birddog.core.compare_revisions', lambda *args: None): # diff not mappable
+            first = page.compared_to('2023,06,01')
+            second = page.compared_to('2023,06,01')
+            self.assertEqual(loads, ['2023,06,01']) # reference loaded and compared once
+            self.assertEqual(second.page, first.page)
+            self.assertEqual(second.children[0][1]['edit'], 'changed')
+            self.assertNotIn('edit', page.children[0][1])
+        remove_cached_object('compare_cache/UNITTEST-D/1/7-3.json')
+
+    def test_ChangeFeed(self):
+        archive = _fake_archive()
+        api = _FakeRecentChangesApi()
+        api.add('Архів:ТЕСТ/1/2/3', '2099-01-01T10:00:00Z')
+        api.add('Архів:ІНШИЙ/1/2/3', '2099-01-01T11:00:00Z') # other archive
+        api.add('Архів:ТЕСТ/9/1', '2099-01-01T12:00:00Z') # fond not in this subarchive
+        with patch('birddog.wiki.async_fetch_url', api.fetch):
+            feed = ChangeFeed(archive)
+            remove_cached_object(feed._cache_path)
+            feed.poll(force=True)
+            self.assertEqual(feed.changes, {'UNITTEST,D,1,2,3': '2099,01,01,10:00'})
+            self.assertIsNone(feed.changes_since('2000,01,01')) # older than the feed reaches
+
+            # the next poll starts at the high-water mark
+            api.add('Архів:ТЕСТ/1/2/3', '2099-01-02T10:00:00Z')
+            api.add('Архів:ТЕСТ/2', '2099-01-02T11:00:00Z')
+            feed.poll(force=True)
+            self.assertEqual(api.rcstarts[-1], '2099-01-01T12:00:00Z')
+            self.assertEqual(feed.changes_since('2099,01,02'), {
+                'UNITTEST,D,1,2,3': '2099,01,02,10:00',
+                'UNITTEST,D,2,,': '2099,01,02,11:00'})
+
+            # changes older than the wiki keeps recent changes are dropped
+            feed._changes['UNITTEST,D,3,,'] = '2000,01,01,10:00'
+            feed._since = '2000,01,01'
+            feed.poll(force=True)
+            self.assertNotIn('UNITTEST,D,3,,', feed.changes)
+            self.assertGreater(feed.since, '2000,01,01')
+            self.assertIsNone(feed.changes_since('2000,01,01'))
+            self.assertEqual(len(feed.changes_since('2099,01,02')), 2)
+
+            # a fresh feed picks up the persisted state without polling
+            feed.poll()
+            self.assertEqual(len(api.rcstarts), 3)
+            restored = ChangeFeed(archive)
+            restored.poll()
+            self.assertEqual(len(api.rcstarts), 3)
+            self.assertEqual(restored.changes, feed.changes)
+            remove_cached_object(feed._cache_path)
+
+    def test_ArchiveCrawler(self):
+        api = _FakeAllPagesApi()
+        lastmod = convert_utc_time(_FakeAllPagesApi.timestamp)
+        names = ('D/1', 'D/1/74', 'D/1/74/1', 'D', 'R')
+        paths = [f'page_cache/UNITTEST-{name}/{lastmod}.json' for name in names]
+        paths += [f'page_cache/UNITTEST-{name}/manifest.json' for name in names]
+        with patch('birddog.wiki.async_fetch_url', api.fetch), \
+             patch('birddog.wiki._existence_index', ExistenceIndex(persistent=False)), \
+             patch.dict('birddog.wiki._namespace_ids', clear=True), \
+             patch('birddog.core.Archive', _FakeCrawlArchive), \
+             patch('birddog.core.refresh_existence_index', lambda prefix, force=False: None), \
+             patch('birddog.core.batch_fetch_document_links', lambda titles: {}), \
+             patch('birddog.core._title_index', TitleIndex(persistent=False)) as title_index:
+            crawler = ArchiveCrawler('DAZHO')
+            for path in [crawler._cache_path, *paths]:
+                remove_cached_object(path)
+
+            progress = crawler.crawl(max_batches=1)
+            self.assertEqual((progress['pages'], progress['saved'], progress['done']), (2, 2, False))
+            self.assertEqual(progress['last'], 'ДАЖО/1/74')
+
+            # a new crawler resumes where the first stopped
+            updates = []
+            progress = ArchiveCrawler('DAZHO').crawl(progress_callback=updates.append)
+            self.assertEqual(len(updates), 3)
+            self.assertEqual(api.batches, 4)
+            self.assertTrue(progress['done'])
+            self.assertEqual([progress[key] for key in ('pages', 'saved', 'cached', 'unmapped', 'failed')],
+                             [6, 5, 0, 1, 0]) # 1/99 is not listed in its fond
+            self.assertEqual(progress['pending'], 0)
+            self.assertEqual(title_index.lookup('UNITTEST-D', '74'), ('74', _row_link('Архів:ДАЖО/1/74')))
+            case = unpack_page(load_cached_bytes(paths[2]))
+            self.assertEqual(case['children'], [[{'text': {'uk': '1-20', 'en': '1-20'}, 'link': None}]])
+            self.assertEqual(unpack_page(load_cached_bytes(paths[1]))['children'][0][0]['link'],
+                             _row_link('Архів:ДАЖО/1/74/1'))
+            manifest = load_cached_object(paths[6])['revisions'] # of D/1/74
+            self.assertEqual([item['modified'] for item in manifest], [lastmod])
+            self.assertEqual(manifest[0]['size'], len(load_cached_bytes(paths[1])))
+
+            # once done, the next crawl starts over and finds the pages in the cache
+            progress = ArchiveCrawler('DAZHO').crawl()
+            self.assertEqual((progress['pages'], progress['saved'], progress['cached']), (6, 0, 5))
+            self.assertEqual(ArchiveCrawler('DAZHO').progress()['pages'], 6)
+            for path in [crawler._cache_path, *paths]:
+                remove_cached_object(path)
+
+    def test_page_manifest(self):
+        parent = SimpleNamespace(name='UNITTEST-D/1/2', base=ARCHIVE_BASE)
+        spec = ('3', _row_link('Архів:UNITTEST/1/2/3'))
+        modified = '2024,03,01,10:00'
+        paths = [f'page_cache/UNITTEST-D/1/2/3/{name}.json' for name in (modified, 'manifest')]
+        calls = Counter()
+        def history(title, limit):
+            calls['history'] += 1
+            return [{'revid': 3, 'modified': modified}]
+        def read_page(url):
+            calls['read'] += 1
+            return {'title': {'uk': '3'}, 'children': []}
+        index = LatestRevisionIndex()
+        with patch('birddog.wiki._latest_revisions', index), \
+             patch('birddog.core._history_lru', SimpleNamespace(lookup=history)), \
+             patch('birddog.core.mw_read_page', read_page), \
+             patch('birddog.core._title_index', TitleIndex(persistent=False)):
+            for path in paths:
+                remove_cached_object(path)
+            self.assertEqual(Case(spec, parent).lastmod, modified) # loaded from the wiki
+            self.assertEqual(dict(calls), {'history': 2, 'read': 1}) # cache lookup and lastmod
+            manifest = load_cached_object(paths[1])['revisions']
+            self.assertEqual([(item['revid'], item['modified']) for item in manifest], [(3, modified)])
+            self.assertGreater(manifest[0]['size'], 0)
+
+            # without a change feed, the latest version is found from the history
+            self.assertEqual(Case(spec, parent).lastmod, modified)
+            self.assertEqual(dict(calls), {'history': 3, 'read': 1})
+
+            # with the latest revid known from the feed, the wiki is not asked
+            index.feed_polled('Архів:UNITTEST', [], time.time() - 60, time.time())
+            index.record('UNITTEST/1/2/3', 3)
+            self.assertEqual(Case(spec, parent).lastmod, modified)
+            self.assertEqual(dict(calls), {'history': 3, 'read': 1})
+
+            # a page stored before it had a manifest needs the history once
+            remove_cached_object(paths[1])
+            for _ in range(2):
+                self.assertEqual(Case(spec, parent).lastmod, modified)
+            self.assertEqual(dict(calls), {'history': 4, 'read': 1})
+            for path in paths:
+                remove_cached_object(path)
+
+    def test_lookup_prefetch(self):
+        parent = SimpleNamespace(name='UNITTEST-D', base=ARCHIVE_BASE)
+        calls = Counter()
+        def history(title, limit):
+            calls['history'] += 1
+            return [{'revid': 1, 'modified': '2024,03,01,10:00'}]
+        def histories(titles, limit):
+            calls['lookup_many'] += 1
+            return {}
+        def read_page(url):
+            if url.endswith('99'):
+                raise RuntimeError('no such page')
+            children = [[{'text': {'uk': '74'}, 'link': _row_link('Архів:UNITTEST/1/74')},
+                         {'text': {'uk': 'Опис'}, 'link': None}]] if url.endswith('/1') else []
+            return {'title': {'uk': url}, 'children': children}
+        with patch('birddog.core._history_lru', SimpleNamespace(lookup=history, lookup_many=histories)), \
+             patch('birddog.core.mw_read_page', read_page), \
+             patch('birddog.core.Page._cache_load', lambda self, version=None: False), \
+             patch('birddog.core.Page._cache_save', lambda self, revid=None: None), \
+             patch('birddog.core.batch_fetch_document_links', lambda titles: {}), \
+             patch('birddog.core._title_index', TitleIndex(persistent=False)):
+            fond = Fond(('1', _row_link('Архів:UNITTEST/1')), parent)
+            self.assertEqual(fond.lookup('74').name, 'UNITTEST-D/1/74')
+            self.assertEqual(calls['lookup_many'], 0) # a single lookup does not prefetch
+
+            # the last-ditch search loads every child, so it prefetches their histories once
+            with self.assertRaises(LookupError):
+                fond.lookup('99')
+            self.assertEqual(calls['lookup_many'], 1)
+
+    def test_TitleIndex(self):
+        index = TitleIndex(persistent=False)
+        fond = {'children': [
+            [{'text': {'uk': 'Р-12а', 'en': 'R-12a'}, 'link': _row_link('Архів:ДАЖО/Р-12а')}],
+            [{'text': {'uk': '7'}, 'link': _row_link('Архів:ДАЖО/Р/7')}],
+            [{'text': {'uk': '8'}, 'link': '/w/index.php?title=Архів:ДАЖО/8&action=edit&redlink=1'}],
+            [{'text': {'uk': 'Житомир'}, 'link': _row_link('Житомир')}]]}
+        index.record('UNITTEST-D/1-100', fond)
+        index.record('UNITTEST-D', {'children': fond['children'][1:2]}) # archive pages have no parent
+        spec = ('R-12a', _row_link('Архів:ДАЖО/Р-12а')) # the id as Page.lookup gives it
+        for entry_id in ('Р-12а', 'R-12a', 'Р–12а', 'Р-012а'):
+            self.assertEqual(index.lookup('UNITTEST-D', entry_id), spec)
+        self.assertEqual(index.lookup('UNITTEST-D', '7'), ('7', _row_link('Архів:ДАЖО/Р/7')))
+        for entry_id in ('8', 'Житомир', 'Р-13'):
+            self.assertIsNone(index.lookup('UNITTEST-D', entry_id))
+        self.assertIsNone(index.lookup('UNITTEST-D/1-100', '7'))
+
+        self.assertFalse(index.is_complete('UNITTEST-D', '2024,01,01,10:00'))
+        index.set_complete('UNITTEST-D', '2024,01,01,10:00')
+        self.assertTrue(index.is_complete('UNITTEST-D', '2024,01,01,10:00'))
+        self.assertFalse(index.is_complete('UNITTEST-D', '2024,02,01,10:00')) # the page changed
+
+        # a child that changes may list an entry the search missed
+        index.record('UNITTEST-D/1-100', {**fond, 'lastmod': '2024,01,01,10:00'})
+        index.set_complete('UNITTEST-D', '2024,01,01,10:00')
+        index.record('UNITTEST-D/1-100', {**fond, 'lastmod': '2024,01,01,10:00'}) # loaded again, unchanged
+        self.assertTrue(index.is_complete('UNITTEST-D', '2024,01,01,10:00'))
+        with patch('time.time', return_value=time.time() + 1):
+            index.record('UNITTEST-D/1-100', {**fond, 'lastmod': '2024,03,01,10:00'})
+        self.assertFalse(index.is_complete('UNITTEST-D', '2024,01,01,10:00'))
+
+    def test_TitleIndex_io(self):
+        # cache loads and saves run outside the index's lock; saves merge other workers' entries
+        index = TitleIndex()
+        stored = {}
+        def load(paths, fresh=False):
+            self.assertFalse(index._lock.locked())
+            return {path: stored[path] for path in paths if path in stored}
+        def save(items):
+            self.assertFalse(index._lock.locked())
+            stored.update(items)
+
+        row = [{'text': {'uk': '7'}, 'link': _row_link('Архів:ДАЖО/Р/7')}]
+        with patch('birddog.core.load_cached_objects', load), \
+             patch('birddog.core.save_cached_objects', save), \
+             patch('birddog.core.TITLE_INDEX_SAVE_INTERVAL', 0):
+            self.assertIsNone(index.lookup('UNITTEST-D', '7'))
+            other = TitleIndex()
+            other.record('UNITTEST-D/2', {'children': [row]}) # another worker
+            index.record('UNITTEST-D/1', {'children': [[{**row[0], 'text': {'uk': '8'}}]]})
+        pages = stored['title_index/UNITTEST-D.json']['pages']['UNITTEST-D']
+        self.assertEqual(set(pages), {'7', '8'})
+
     def test_Archive(self):
         page = Archive('DAZHO')
         print('base', page.base)
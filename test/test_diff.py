@@ -0,0 +1,54 @@
+import unittest
+from birddog.diff import (
+    row_keys,
+    column_map,
+    diff_rows,
+    )
+
+def _row(*texts, link=None):
+    row = [{'text': {'uk': t}} for t in texts]
+    if link:
+        row[0]['link'] = link
+    return row
+
+def _edits(rows):
+    return [[item.get('edit') for item in row] for row in rows]
+
+# ------------------ UTILITY UNIT TESTS ------------------
+class Test(unittest.TestCase):
+    def test_row_keys(self):
+        rows = [_row('1', 'a'), _row(' 1 ', 'b'), _row('2'), []]
+        self.assertEqual(row_keys(rows), [('1', 0), ('1', 1), ('2', 0), ('', 0)])
+
+    def test_column_map(self):
+        header = [{'uk': 'Назва'}, {'uk': 'Номер'}, {'uk': 'Роки'}]
+        ref_header = [{'uk': 'Номер'}, {'uk': 'Назва'}, {'uk': 'Дати'}]
+        self.assertEqual(column_map(header, ref_header), [1, 0, 2]) # renamed column keeps its place
+        self.assertIsNone(column_map(header, None))
+
+    def test_diff_rows(self):
+        ref_rows = [_row('1', 'a'), _row('2', 'b'), _row('3', 'c'), _row('3', 'd'), _row('4', 'e')]
+        rows = [_row('2', 'b'), _row('1', 'a'), _row('3', 'c'), _row('3', 'x'), _row('5', 'f')]
+        result, removed = diff_rows(rows, ref_rows)
+        self.assertEqual(_edits(result), [
+            ['moved', None],       # only one of the swapped pair is reported as moved
+            [None, None],
+            [None, None],
+            [None, 'changed'],     # duplicate id matched to its second occurrence
+            ['added', 'added']])
+        self.assertEqual(removed, [ref_rows[4]])
+        self.assertIs(result[2], rows[2]) # unchanged rows are not copied
+        self.assertNotIn('edit', rows[0][0]) # inputs untouched
+
+    def test_diff_rows_columns(self):
+        header = [{'uk': 'Номер'}, {'uk': 'Роки'}, {'uk': 'Назва'}]
+        ref_header = [{'uk': 'Номер'}, {'uk': 'Назва'}]
+        ref_rows = [_row('1', 'a', link='/wiki/1'), _row('2', 'b', link='/wiki/2')]
+        rows = [_row('1', '1900', 'a', link='/wiki/1'), _row('2', '1901', 'B', link='/wiki/2b')]
+        result, removed = diff_rows(rows, ref_rows, header, ref_header)
+        self.assertEqual(_edits(result), [[None, 'added', None], [None, 'added', 'changed']])
+        self.assertEqual([row[0]['link_edit'] for row in result], [None, 'changed'])
+        self.assertEqual(removed, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import gzip
+import json
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from birddog.pageformat import (
+    pack_page,
+    unpack_page,
+    PageFormatError,
+    )
+
+_RESOURCES = Path(__file__).resolve().parent / 'resources'
+
+def _golden_pages():
+    with open(_RESOURCES / 'wikitext_pages.json', encoding='utf8') as f:
+        return [case['page'] for case in json.load(f)]
+
+# ------------------ UTILITY UNIT TESTS ------------------
+class Test(unittest.TestCase):
+    def test_round_trip(self):
+        for page in _golden_pages():
+            data = pack_page(page)
+            self.assertEqual(unpack_page(data), page)
+            self.assertLess(len(data), len(json.dumps(page)))
+        with patch('birddog.pageformat.orjson', None):
+            page = _golden_pages()[0]
+            self.assertEqual(unpack_page(pack_page(page)), page)
+
+    def test_irregular_rows(self):
+        page = {'title': {'uk': 'ДАЖО/1'}, 'lastmod': '2024,03,01,10:00', 'children': [
+            [{'text': {'uk': '1', 'en': '1'}, 'link': '/wiki/A/1'}, {'text': {'uk': 'a'}, 'link': None}],
+            [{'text': {'uk': '2'}, 'link': 'https://example.org/2'}],                  # short row
+            [{'text': {'uk': '3'}, 'link': '/wiki/A/3', 'edit': 'added'}],             # extra key
+            [{'text': 'plain', 'link': None}, {'text': {'uk': None}, 'link': None}],   # other shapes
+            [],
+            [{'text': {}, 'link': 'no-slash'}, {'text': {'en': 'b'}, 'link': '/wiki/B/b'}]]}
+        self.assertEqual(unpack_page(pack_page(page)), page)
+        self.assertEqual(unpack_page(pack_page({'children': None})), {'children': None})
+        self.assertEqual(unpack_page(pack_page({'title': {'uk': 'x'}})), {'title': {'uk': 'x'}})
+
+    def test_legacy_and_unknown(self):
+        page = _golden_pages()[1]
+        self.assertEqual(unpack_page(json.dumps(page).encode('utf8')), page)
+        with self.assertRaises(PageFormatError):
+            unpack_page(gzip.compress(b'{"version": "v9"}'))
+        with patch('birddog.pageformat.zstandard', None), self.assertRaises(PageFormatError):
+            unpack_page(b'\x28\xb5\x2f\xfd' + b'\x00' * 8) # zstd without zstandard installed
+
+if __name__ == "__main__":
+    unittest.main()
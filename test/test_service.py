@@ -1,12 +1,15 @@
 import os
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch
 
 from io import BytesIO
 import openpyxl
 
-from birddog.service import app
+from birddog.service import app, ChangeFeedPoller
 from birddog.wiki import ARCHIVES
+from birddog.cache import CacheMissError
 
 # ------------------ WIKI UNIT TESTS ------------------ 
 
@@ -41,6 +44,69 @@ class Test(unittest.TestCase):
             self.assertTrue(item in data)
 
 
+    def test_change_feed_poller(self):
+        class FakeArchive:
+            def __init__(self, archive, subarchive):
+                self.name = f'{archive}-{subarchive}'
+                self.title_prefix = f'Архів:{archive}'
+
+        class FakeLRU:
+            def lookup(self, archive, subarchive):
+                return FakeArchive(archive, subarchive)
+
+        polled = []
+        class FakeFeed:
+            def __init__(self, archive):
+                self.name = archive.name
+            def poll(self):
+                polled.append(self.name)
+
+        refreshed = []
+        store = {'change_feeds/registry.json': [['DAZHO', 'D', ['a@example.com']], ['DAKO', 'R', ['b@example.com']]]}
+        with patch("birddog.service.load_cached_object", side_effect=lambda path, fresh=False: store[path]), \
+             patch("birddog.service.ChangeFeed.lookup", side_effect=FakeFeed), \
+             patch("birddog.service.refresh_existence_index", side_effect=refreshed.append):
+            ChangeFeedPoller(FakeLRU()).poll_once()
+        self.assertEqual(polled, ['DAKO-R', 'DAZHO-D'])
+        self.assertEqual(refreshed, ['Архів:DAKO', 'Архів:DAZHO'])
+
+    def test_change_feed_poller_watch(self):
+        store = {}
+        def load(path, fresh=False):
+            self.assertTrue(fresh) # other workers register their users too
+            if path not in store:
+                raise CacheMissError(path)
+            return store[path]
+        saves = []
+        def save(obj, path):
+            saves.append(path)
+            store[path] = obj
+
+        started = threading.Event()
+        with tempfile.TemporaryDirectory() as folder, \
+             patch("birddog.service.load_cached_object", side_effect=load), \
+             patch("birddog.service.save_cached_object", side_effect=save), \
+             patch.object(ChangeFeedPoller, "_run", lambda poller: started.set()):
+            poller = ChangeFeedPoller(None, lock_path=os.path.join(folder, 'poller.lock'))
+            poller.watch('DAZHO', 'D', 'a@example.com')
+            self.assertTrue(started.wait(5))
+            # two users watching DAZHO-D register it only once, a repeat watch does no I/O
+            poller.watch('DAZHO', 'D', 'b@example.com')
+            poller.watch('DAZHO', 'D', 'b@example.com')
+            self.assertEqual(store['change_feeds/registry.json'], [['DAZHO', 'D', ['a@example.com', 'b@example.com']]])
+            self.assertEqual(len(saves), 2)
+
+            # a worker that loaded the registry earlier still sees later registrations
+            other = ChangeFeedPoller(None, lock_path=os.path.join(folder, 'poller.lock'))
+            other.unwatch('DAZHO', 'D', 'a@example.com')
+            self.assertEqual(store['change_feeds/registry.json'], [['DAZHO', 'D', ['b@example.com']]])
+            poller.unwatch('DAZHO', 'D', 'b@example.com')
+            self.assertEqual(store['change_feeds/registry.json'], [])
+
+            # only one of the workers polls
+            self.assertTrue(poller._lead())
+            self.assertFalse(other._lead())
+
     # need this patch construct to test authenticated endpoints
     @patch("birddog.service.users.lookup")
     def test_page(self, mock_lookup):
@@ -65,7 +131,7 @@ class Test(unittest.TestCase):
         for i in range(1, len(address)):
             url = f"/page/{'/'.join(address[:i])}"
             _load_page_url(url, page_keys)
-            _load_page_url(url + "?compare=2023,12,31", page_keys | {"refmod"})
+            _load_page_url(url + "?compare=2023,12,31", page_keys | {"refmod", "removed"})
 
     @patch("birddog.service.users.lookup")
     def test_download(self, mock_lookup):
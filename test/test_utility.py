@@ -1,7 +1,19 @@
 from copy import copy
+import time
+import asyncio
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from birddog.utility import (
+    SingleFlight,
+    CallCounter,
+    fetch_url,
+    async_fetch_url,
+    run_sync,
+    fetch_stats,
+    MAX_CONCURRENT_FETCHES,
     lastmod,
+    to_utc_time,
     is_numeric,
     form_text_item,
     equal_text,
@@ -10,13 +22,141 @@ from birddog.utility import (
     translate_page,
     )
 
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _SlowHandler(_StubHandler):
+    """Counts the requests in flight at once."""
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with _SlowHandler.lock:
+            _SlowHandler.in_flight += 1
+            _SlowHandler.peak = max(_SlowHandler.peak, _SlowHandler.in_flight)
+        time.sleep(0.05)
+        with _SlowHandler.lock:
+            _SlowHandler.in_flight -= 1
+        super().do_GET()
+
 # ------------------ UTILITY UNIT TESTS ------------------ 
 class Test(unittest.TestCase):
+    def test_fetch_url_pooling(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/'
+            before = fetch_stats()
+            for _ in range(10):
+                self.assertEqual(fetch_url(url, json=True), {'ok': True})
+            after = fetch_stats()
+            self.assertEqual(after['requests'] - before['requests'], 10)
+            self.assertGreaterEqual(after['reused'] - before['reused'], 9)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_async_fetch_url_pooling(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/'
+            async def fetch_sequentially():
+                for _ in range(10):
+                    self.assertEqual(await async_fetch_url(url, json=True), {'ok': True})
+            before = fetch_stats()
+            run_sync(fetch_sequentially())
+            after = fetch_stats()
+            # the connections of the async client count too
+            self.assertEqual(after['connections'] - before['connections'], 1)
+            self.assertEqual(after['reused'] - before['reused'], 9)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_fetch_limit(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/'
+            async def fetch_many():
+                await asyncio.gather(*(async_fetch_url(url) for _ in range(10)))
+            threads = [threading.Thread(target=fetch_url, args=(url,)) for _ in range(10)]
+            threads.append(threading.Thread(target=run_sync, args=(fetch_many(),)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # one limit for synchronous and asynchronous fetches together
+            self.assertLessEqual(_SlowHandler.peak, MAX_CONCURRENT_FETCHES)
+            self.assertGreater(_SlowHandler.peak, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_call_counter(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/'
+            async def fetch_twice():
+                await asyncio.gather(async_fetch_url(url), async_fetch_url(url))
+            with CallCounter() as outer:
+                fetch_url(url)
+                with CallCounter() as inner:
+                    run_sync(fetch_twice()) # counted on the fetch loop too
+                fetch_url(url)
+            fetch_url(url)
+            self.assertEqual((outer.count, inner.count), (4, 2))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_single_flight(self):
+        flight = SingleFlight('unittest')
+        loads = []
+        def load(key):
+            loads.append(key)
+            time.sleep(0.2)
+            return key.upper()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('abc', load, 'abc')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(loads, ['abc'])
+        self.assertEqual(results, ['ABC'] * 8)
+        self.assertEqual(flight.coalesced, 7)
+        # errors reach every waiting caller, and the key can be loaded again afterwards
+        with self.assertRaises(ZeroDivisionError):
+            flight.do('abc', lambda: 1 / 0)
+        self.assertEqual(flight.do('abc', load, 'abc'), 'ABC')
+
     def test_lastmod(self):
         message = "Цю сторінку востаннє відредаговано о 19:15, 20 травня 2023."
         self.assertTrue(lastmod(message) == "2023,05,20,19:15")
         self.assertTrue(lastmod('xyz') == 'xyz')
 
+    def test_to_utc_time(self):
+        self.assertEqual(to_utc_time('2024,03,01,10:00'), '2024-03-01T10:00:00Z')
+        self.assertEqual(to_utc_time('2024'), '2024-01-01T00:00:00Z')
+        with self.assertRaises(ValueError):
+            to_utc_time('')
+
     def test_multilingual(self):
         for text in ['1', '12-13', '098-101']:
             self.assertTrue(is_numeric(text))
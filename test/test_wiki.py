@@ -1,6 +1,13 @@
 import os
+import time
+import json
+import asyncio
+import random
+import threading
 from copy import copy
 import unittest
+from unittest.mock import patch
+from urllib.parse import unquote, urlsplit, parse_qsl
 
 from birddog.wiki import (
     ARCHIVE_BASE,
@@ -10,19 +17,36 @@ from birddog.wiki import (
     sniff_subarchives,
     wiki_title,
     read_page,
+    mw_read_page,
+    get_page_history,
+    get_page_history_from_cutoff,
+    HistoryLRU,
+    ExistenceIndex,
+    LatestRevisionIndex,
+    batch_fetch_document_links,
     check_page_updates,
     check_page_changes,
+    compare_page_data,
+    page_annotations,
+    apply_page_annotations,
+    map_revision_diff,
+    get_revision_diff,
     report_page_changes,
     )
 
 from birddog.utility import (
     get_text,
+    run_sync,
     )
 
+from birddog.cache import remove_cached_object, CacheMissError
+
 from birddog.core import (
     Archive,
     )
 
+UNITTEST_RESOURCE_DIR = 'test/resources'
+
 # ------------------ WIKI UNIT TESTS ------------------ 
 
 def _page_url(archive, sub=None):
@@ -31,7 +55,103 @@ def _page_url(archive, sub=None):
         url += f'/{sub}'
     return url
 
+def _fake_history_response(revids):
+    return {'query': {'pages': {'1': {'title': 'Архів:ДАЖО/1', 'revisions': [
+        {'revid': revid, 'timestamp': f'2024-01-{revid:02d}T10:00:00Z'} for revid in revids]}}}}
+
+def _fake_content_response(titles):
+    return {'query': {'pages': {str(i): {
+        'title': f'Архів:{title}',
+        'revisions': [{'slots': {'main': {'*': f'[[File:{title.replace("/", "_")}.pdf|thumb]]'}}}]}
+        for i, title in enumerate(titles)}}}
+
+def _fake_latest_revisions_response(titles):
+    return {'query': {'pages': {str(i): {'title': title, 'revisions': [
+        {'revid': 100 + i, 'timestamp': '2024-02-01T10:00:00Z'}]}
+        for i, title in enumerate(titles) if not title.endswith('missing')}}}
+
+def _diff_html(*changes):
+    """compare API diff table with (deleted line, added line) rows; None for no line"""
+    html = '<tr><td colspan="2" class="diff-lineno">Line 5:</td><td colspan="2" class="diff-lineno">Line 5:</td></tr>'
+    for deleted, added in changes:
+        html += '<tr>'
+        html += (f'<td class="diff-marker" data-marker="−"></td><td class="diff-deletedline"><div>{deleted}</div></td>'
+                 if deleted is not None else '<td colspan="2" class="diff-empty"></td>')
+        html += (f'<td class="diff-marker" data-marker="+"></td><td class="diff-addedline"><div>{added}</div></td>'
+                 if added is not None else '<td colspan="2" class="diff-empty"></td>')
+        html += '</tr>'
+    return html
+
+class _FakeRevisionApi:
+    """prop=revisions with rvlimit/rvstart/rvstartid/rvend/rvcontinue (newest first)."""
+    def __init__(self, count):
+        # revid n was saved on day n
+        self.revisions = [
+            {'revid': n, 'timestamp': f'2024-{1 + (n - 1) // 28:02d}-{1 + (n - 1) % 28:02d}T12:00:00Z'}
+            for n in range(count, 0, -1)]
+        self.returned = 0
+        self.calls = 0
+
+    def add(self):
+        revid = self.revisions[0]['revid'] + 1
+        self.revisions.insert(0, {'revid': revid, 'timestamp': f'2025-01-{revid % 28 + 1:02d}T12:00:00Z'})
+
+    async def fetch(self, url, params=None, json=False):
+        params = params or dict(parse_qsl(urlsplit(url).query))
+        self.calls += 1
+        revisions = self.revisions
+        if 'rvcontinue' in params:
+            revisions = [r for r in revisions if r['revid'] <= int(params['rvcontinue'])]
+        if 'rvstartid' in params:
+            revisions = [r for r in revisions if r['revid'] <= int(params['rvstartid'])]
+        if 'rvstart' in params:
+            revisions = [r for r in revisions if r['timestamp'] <= params['rvstart']]
+        if 'rvend' in params:
+            revisions = [r for r in revisions if r['timestamp'] >= params['rvend']]
+        if 'rvendid' in params:
+            revisions = [r for r in revisions if r['revid'] >= int(params['rvendid'])]
+        titles = params['titles'].split('|')
+        if len(titles) > 1: # batches only get the latest revision of each title
+            self.returned += len(titles)
+            return {'query': {'pages': {str(i): {'title': t, 'revisions': revisions[:1]}
+                                        for i, t in enumerate(titles)}}}
+        limit = int(params.get('rvlimit', 1))
+        result = {'query': {'pages': {'1': {'title': params['titles'], 'revisions': revisions[:limit]}}}}
+        if len(revisions) > limit:
+            result['continue'] = {'rvcontinue': str(revisions[limit]['revid']), 'continue': '||'}
+        self.returned += len(revisions[:limit])
+        return result
+
 class Test(unittest.TestCase):
+    def test_async_wrappers(self):
+        in_flight = 0
+        max_in_flight = 0
+        calls = []
+
+        async def fake_fetch(url, params=None, json=False):
+            nonlocal in_flight, max_in_flight
+            calls.append(url)
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            if 'rvprop=content' in url:
+                titles = unquote(url.split('titles=')[1]).split('|')
+                return _fake_content_response([t.split(':', 1)[1] for t in titles])
+            return _fake_history_response([3, 2, 1])
+
+        with patch('birddog.wiki.async_fetch_url', fake_fetch):
+            history = get_page_history('ДАЖО/1', limit=3)
+            self.assertEqual([h['revid'] for h in history], [3, 2, 1])
+            self.assertEqual(history[0]['modified'], '2024,01,03,10:00')
+
+            calls.clear()
+            titles = [f'ДАЖО/1/{i}' for i in range(120)] # 50 titles per request
+            links = batch_fetch_document_links(titles)
+            self.assertEqual(len(calls), 3)
+            self.assertGreater(max_in_flight, 1) # chunks are fetched concurrently
+            self.assertEqual(links['ДАЖО/1/0'], ['/wiki/File:ДАЖО_1_0.pdf'])
+
     def test_read_page(self):
         page = read_page(_page_url("ДААРК"))
         print(get_text(page['title']), get_text(page['description']))
@@ -48,6 +168,377 @@ class Test(unittest.TestCase):
         for item in updates:
             print(f'   {item}: {updates[item]}')
 
+    def test_history_lookup_many(self):
+        calls = []
+
+        async def fake_fetch(url, params=None, json=False):
+            calls.append(params)
+            return _fake_latest_revisions_response(params['titles'].split('|'))
+
+        with patch('birddog.wiki.async_fetch_url', fake_fetch):
+            lru = HistoryLRU(persistent=False)
+            titles = [f'ДАЖО/1/74/{i}' for i in range(120)] + ['ДАЖО/missing']
+            result = lru.lookup_many(titles)
+            self.assertEqual(len(calls), 3) # 50 titles per request
+            self.assertEqual(set(result.keys()), set(titles))
+            self.assertEqual(len(result['ДАЖО/1/74/7']), 1)
+            self.assertEqual(result['ДАЖО/missing'], [])
+            calls.clear()
+            lru.lookup_many(titles[:120])
+            lru.lookup('ДАЖО/1/74/7', limit=1)
+            self.assertEqual(len(calls), 0) # all served from the LRU
+
+    def test_history_concurrency(self):
+        api = _FakeRevisionApi(30)
+        titles = [f'ДАЖО/1/74/{i}' for i in range(10)]
+        failures = []
+        def worker(seed):
+            rng = random.Random(seed)
+            for _ in range(100):
+                try:
+                    if rng.random() < 0.2:
+                        result = lru.lookup_many(rng.sample(titles, 3))
+                        histories = list(result.values())
+                    else:
+                        histories = [lru.lookup(rng.choice(titles), limit=rng.choice([1, 5, 30]))]
+                    for history in histories:
+                        if history[0]['revid'] != 30 or history != sorted(history, key=lambda h: -h['revid']):
+                            failures.append(history)
+                except Exception as e:
+                    failures.append(e)
+
+        with patch('birddog.wiki.async_fetch_url', api.fetch):
+            lru = HistoryLRU(maxsize=4, reset_limit=0.01, persistent=False)
+            pool = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+        self.assertEqual(failures, [])
+        self.assertLessEqual(len(lru._lru), 4)
+
+    def test_compare_page_data(self):
+        def page(lastmod, title, rows):
+            return {'lastmod': lastmod, 'title': {'uk': title}, 'description': {'uk': 'опис'},
+                    'children': [[{'text': {'uk': k}, 'link': link}, {'text': {'uk': v}}]
+                                 for k, v, link in rows]}
+        reference = page('2023', 'назва', [('1', 'a', '/wiki/1'), ('2', 'b', 'redlink'), ('4', 'e', '/wiki/4')])
+        current = page('2024', 'нова назва', [('1', 'a', '/wiki/1'), ('2', 'c', '/wiki/2'), ('3', 'd', '/wiki/3')])
+        before = json.dumps([current, reference])
+        result = compare_page_data(current, reference)
+        self.assertEqual(json.dumps([current, reference]), before) # inputs untouched
+        self.assertEqual(result['refmod'], '2023')
+        self.assertEqual((result['title']['edit'], result['description']['edit']), ('changed', None))
+        edits = [[(item.get('edit'), item.get('link_edit')) for item in row] for row in result['children']]
+        self.assertEqual(edits, [
+            [(None, None), (None, None)],
+            [(None, 'added'), ('changed', None)],
+            [('added', None), ('added', None)]])
+        self.assertEqual([[item['edit'] for item in row] for row in result['removed']], [['removed', 'removed']])
+        # unchanged rows and unannotated data are shared, not copied
+        self.assertIs(result['children'][0], current['children'][0])
+        self.assertIs(result['children'][1][1]['text'], current['children'][1][1]['text'])
+        # the compact stored form rebuilds the same result
+        annotations = page_annotations(result)
+        self.assertEqual(annotations['added'], [2])
+        self.assertEqual(apply_page_annotations(current, json.loads(json.dumps(annotations))), result)
+
+        check_page_changes(current, reference)
+        self.assertEqual(current['children'][1][1]['edit'], 'changed')
+
+    def test_map_revision_diff(self):
+        def row(key, text, link=True):
+            return [{'text': {'uk': key, 'en': key}, 'link': f'/wiki/Архів:ДАЖО/1/{key}' if link else None},
+                    {'text': {'uk': text}, 'link': None}]
+        page = {'lastmod': '2024', 'title': {'uk': 'ДАЖО/1'}, 'description': {'uk': 'опис'},
+                'header': [{'uk': 'Опис'}, {'uk': 'Назва'}],
+                'children': [row('1', 'a'), row('2', 'c'), row('3', 'd'), row('5', 'f')]}
+        html = _diff_html(
+            ('| [[/2|2]] || b', '| [[/2|2]] || <ins class="diffchange">c</ins>'),
+            (None, '| [[/3|3]] || d'),
+            ('| [[/4|4]] || e', None),
+            ('| [[/5|5]] || f', '|-'),
+            (None, '| [[/5|5]] || f'))
+
+        async def fake_fetch(url, params=None, json=False):
+            self.assertEqual((params['action'], params['fromrev'], params['torev']), ('compare', 10, 20))
+            return {'compare': {'*': html}}
+
+        with patch('birddog.wiki.async_fetch_url', fake_fetch):
+            deleted, added = get_revision_diff(10, 20)
+        self.assertEqual(added[0], '| [[/2|2]] || c')
+        result = map_revision_diff(page, 'Архів:ДАЖО/1', deleted, added, '2023')
+        self.assertEqual(result['refmod'], '2023')
+        self.assertIs(result['children'][0], page['children'][0]) # unchanged
+        self.assertEqual([[item.get('edit') for item in r] for r in result['children']], [
+            [None, None], [None, 'changed'], ['added', 'added'], ['moved', None]])
+        self.assertEqual(result['children'][1][0]['link_edit'], None)
+        self.assertEqual([get_text(r[0]['text']) for r in result['removed']], ['4'])
+        annotations = page_annotations(result)
+        self.assertEqual(apply_page_annotations(page, json.loads(json.dumps(annotations))), result)
+
+        # changes outside the table rows are not mapped
+        self.assertIsNone(map_revision_diff(page, 'Архів:ДАЖО/1', ['! Опис || Назва'], ['! Опис || Заголовок'], '2023'))
+        self.assertIsNone(map_revision_diff(page, 'Архів:ДАЖО/1', ['| назва = опис'], ['| назва = новий опис'], '2023'))
+        self.assertIsNone(map_revision_diff(page, 'Архів:ДАЖО/1', [], ['| [[/9|9]] || x'], '2023')) # not on the page
+
+    def test_mw_read_page(self):
+        wikitext = '''{{Архіви|назва=Опис справ|рік=1920}}
+[[Файл:ДАЖО 1-74-1.pdf|міні|Справа]]
+{| class="wikitable"
+! Справа || Назва
+|-
+| [[/1/]] || Перша справа
+|-
+| [[/2 а|2 а]] || Друга справа
+|}'''
+        calls = []
+        async def fake_fetch(url, params=None, json=False):
+            if params.get('prop') == 'revisions':
+                calls.append('revisions')
+                self.assertEqual(params['titles'], 'Архів:ДАЖО/1/74')
+                return {'query': {'pages': {'7': {'title': 'Архів:ДАЖО/1/74', 'revisions': [{
+                    'revid': 42, 'timestamp': '2024-03-01T10:00:00Z', 'slots': {'main': {'*': wikitext}}}]}}}}
+            calls.append('info')
+            self.assertEqual(sorted(params['titles'].split('|')), ['Архів:ДАЖО/1/74/1', 'Архів:ДАЖО/1/74/2_а'])
+            return {'query': {
+                'normalized': [{'from': 'Архів:ДАЖО/1/74/2_а', 'to': 'Архів:ДАЖО/1/74/2 а'}],
+                'pages': {'1': {'title': 'Архів:ДАЖО/1/74/1'},
+                          '-1': {'title': 'Архів:ДАЖО/1/74/2 а', 'missing': ''}}}}
+
+        with patch('birddog.wiki.async_fetch_url', fake_fetch), \
+             patch('birddog.wiki._existence_index', ExistenceIndex(persistent=False)):
+            page = mw_read_page(f'{ARCHIVE_BASE}/wiki/{wiki_title("ДАЖО/1/74")}')
+            self.assertEqual(calls, ['revisions', 'info'])
+            # link existence is known the second time
+            calls.clear()
+            self.assertEqual(mw_read_page(f'{ARCHIVE_BASE}/wiki/{wiki_title("ДАЖО/1/74")}'), page)
+            self.assertEqual(calls, ['revisions'])
+        self.assertEqual(set(page.keys()), set(
+            ['title', 'description', 'header', 'children', 'lastmod', 'link', 'doc_link', 'thumb_link']))
+        self.assertEqual((get_text(page['title']), page['description']['uk']), ('ДАЖО/1/74', 'Опис справ'))
+        self.assertEqual([h['uk'] for h in page['header']], ['Справа', 'Назва'])
+        self.assertEqual(page['lastmod'], '2024,03,01,10:00')
+        self.assertEqual(page['link'], f'{ARCHIVE_BASE}/wiki/%D0%90%D1%80%D1%85%D1%96%D0%B2:%D0%94%D0%90%D0%96%D0%9E/1/74')
+        # links as in the rendered page: relative, and redlinks for missing pages
+        self.assertEqual(unquote(page['children'][0][0]['link']), '/wiki/Архів:ДАЖО/1/74/1')
+        self.assertEqual(page['children'][0][0]['text']['uk'], '1')
+        self.assertEqual(unquote(page['children'][1][0]['link']),
+                         '/w/index.php?title=Архів:ДАЖО/1/74/2_а&action=edit&redlink=1')
+        self.assertEqual(unquote(page['doc_link']), '/wiki/File:ДАЖО_1-74-1.pdf')
+        self.assertTrue(unquote(page['thumb_link']).startswith(f'{ARCHIVE_BASE}/wiki/Special:FilePath/ДАЖО_1-74-1.pdf'))
+
+    def test_existence_index(self):
+        async def fake_fetch(url, params=None, json=False):
+            if params.get('meta') == 'siteinfo':
+                return {'query': {'namespaces': {'106': {'id': 106, '*': 'Архів'}}}}
+            self.assertEqual((params['list'], params['apprefix'], params['apnamespace']), ('allpages', 'ДАЖО', 106))
+            if 'apcontinue' not in params:
+                return {'query': {'allpages': [{'title': 'Архів:ДАЖО'}, {'title': 'Архів:ДАЖО/1'}]},
+                        'continue': {'apcontinue': 'ДАЖО/2', 'continue': '-||'}}
+            return {'query': {'allpages': [{'title': 'Архів:ДАЖО/2'}, {'title': 'Архів:ДАЖО2'}]}}
+
+        index = ExistenceIndex(max_age=60, persistent=False)
+        index.update({'Архів:ДАЖО/3': True, 'Архів:ДАЖО/4': False, 'Файл:Скан.pdf': True})
+        self.assertEqual(index.lookup(['Архів:ДАЖО/3', 'Архів:ДАЖО/4', 'Архів:ДАЖО/5', 'Файл:Скан.pdf']),
+                         {'Архів:ДАЖО/3': True, 'Архів:ДАЖО/4': False}) # other namespaces are not indexed
+        self.assertFalse(index.is_fresh('Архів:ДАЖО'))
+        with patch('birddog.wiki.async_fetch_url', fake_fetch), patch.dict('birddog.wiki._namespace_ids', clear=True):
+            index.refresh('Архів:ДАЖО')
+        self.assertTrue(index.is_fresh('Архів:ДАЖО'))
+        self.assertEqual(index.lookup(['Архів:ДАЖО/1', 'Архів:ДАЖО/2', 'Архів:ДАЖО/3', 'Архів:ДАЖО2']),
+                         {'Архів:ДАЖО/1': True, 'Архів:ДАЖО/2': True, 'Архів:ДАЖО/3': False})
+        with patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(index.lookup(['Архів:ДАЖО/1']), {}) # too old
+            self.assertFalse(index.is_fresh('Архів:ДАЖО'))
+
+    def test_existence_index_io(self):
+        # cache loads and saves run off the fetch loop and outside the index's lock
+        index = ExistenceIndex(max_age=60)
+        stored = {'existence_index/Архів:ДАЖО.json': {'refreshed': 0, 'pages': {'Архів:ДАЖО/1': [True, time.time()]}}}
+        io = []
+        def check_io():
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()
+            self.assertFalse(index._lock.locked())
+        def load(paths, fresh=False):
+            check_io()
+            io.append('fresh load' if fresh else 'load')
+            return {path: stored[path] for path in paths if path in stored}
+        def save(items):
+            check_io()
+            io.append('save')
+            stored.update(items)
+
+        with patch('birddog.wiki.load_cached_objects', load), \
+             patch('birddog.wiki.save_cached_objects', save), \
+             patch('birddog.wiki.EXISTENCE_SAVE_INTERVAL', 0):
+            self.assertEqual(run_sync(index.async_lookup(['Архів:ДАЖО/1', 'Архів:ДАЖО/2'])), {'Архів:ДАЖО/1': True})
+            # saved by another worker since this one loaded the index
+            stored['existence_index/Архів:ДАЖО.json'] = {'refreshed': 0, 'pages': {
+                'Архів:ДАЖО/1': [True, time.time()], 'Архів:ДАЖО/3': [True, time.time()]}}
+            run_sync(index.async_update({'Архів:ДАЖО/2': False}))
+            self.assertEqual(run_sync(index.async_lookup(['Архів:ДАЖО/2'])), {'Архів:ДАЖО/2': False})
+        self.assertEqual(io, ['load', 'fresh load', 'save']) # loaded once, merged before saving
+        pages = stored['existence_index/Архів:ДАЖО.json']['pages']
+        self.assertEqual({title: entry[0] for title, entry in pages.items()},
+                         {'Архів:ДАЖО/1': True, 'Архів:ДАЖО/2': False, 'Архів:ДАЖО/3': True})
+
+    def test_mw_read_page_golden(self):
+        # page data as parsed by mwparserfromhell alone, before the table tokenizer
+        with open(f'{UNITTEST_RESOURCE_DIR}/wikitext_pages.json') as f:
+            cases = json.load(f)
+        for case in cases:
+            wikitext = case['wikitext']
+            full_title = wiki_title(case['page_title'])
+            async def fake_fetch(url, params=None, json=False):
+                if params.get('prop') == 'revisions':
+                    return {'query': {'pages': {'1': {'title': full_title, 'revisions': [{
+                        'revid': 1, 'timestamp': '2024-03-01T10:00:00Z', 'slots': {'main': {'*': wikitext}}}]}}}}
+                if params.get('generator') == 'links':
+                    return {'query': {}}
+                return {'query': {'pages': {
+                    str(i): {'title': t} for i, t in enumerate(params['titles'].split('|'))}}}
+
+            with patch('birddog.wiki.async_fetch_url', fake_fetch), \
+                 patch('birddog.wiki._existence_index', ExistenceIndex(persistent=False)):
+                page = mw_read_page(f'{ARCHIVE_BASE}/wiki/{full_title}')
+            self.assertEqual(page, case['page'], case['name'])
+
+    def test_history_from_cutoff(self):
+        api = _FakeRevisionApi(200)
+        with patch('birddog.wiki.async_fetch_url', api.fetch):
+            history = get_page_history_from_cutoff('ДАЖО/1', '2024,05,01')
+            # revids 113..200 are on/after May 1st, revid 112 was current on that date
+            self.assertEqual(history[0]['revid'], 200)
+            self.assertEqual(history[-1]['revid'], 112)
+            self.assertEqual(len(history), 89)
+            self.assertEqual(api.returned, 89) # every revision fetched exactly once
+            self.assertEqual(api.calls, 3)
+
+            history = get_page_history_from_cutoff('ДАЖО/1', '2023')
+            self.assertEqual(len(history), 200)
+            self.assertTrue(history[-1]['created'])
+
+            # extending a cached history only fetches the missing tail
+            lru = HistoryLRU(persistent=False)
+            lru.lookup_by_cutoff('ДАЖО/1', '2024,07,01')
+            api.returned = 0
+            history = lru.lookup_by_cutoff('ДАЖО/1', '2024,05,01')
+            self.assertEqual(history[-1]['revid'], 112)
+            self.assertEqual(len(history), 89)
+            self.assertEqual(api.returned, 57) # revids 168..112, not the cached 200..169
+
+            # a cached history that ends at the first revision learns that it is whole
+            lru = HistoryLRU(persistent=False)
+            self.assertEqual(len(lru.lookup('ДАЖО/1', limit=200)), 200) # not known to be whole
+            history = lru.lookup_by_cutoff('ДАЖО/1', '2023')
+            self.assertEqual(len(history), 200)
+            self.assertTrue(history[-1]['created'])
+            api.calls = 0
+            self.assertEqual(len(lru.lookup_by_cutoff('ДАЖО/1', '2023')), 200)
+            self.assertEqual(api.calls, 0)
+
+    def test_history_persistence(self):
+        title = 'UNITTEST/history'
+        api = _FakeRevisionApi(120)
+        with patch('birddog.wiki.async_fetch_url', api.fetch):
+            lru = HistoryLRU()
+            remove_cached_object(lru._cache_path(title))
+            self.assertEqual(len(lru.lookup_by_cutoff(title, '2023')), 120)
+
+            # a restarted worker only needs an rvlimit=1 probe
+            api.calls = api.returned = 0
+            lru = HistoryLRU()
+            self.assertEqual(lru.lookup(title, limit=1)[0]['revid'], 120)
+            self.assertEqual(len(lru.lookup_by_cutoff(title, '2023')), 120)
+            self.assertEqual((api.calls, api.returned), (1, 1))
+
+            # after expiry only the new revisions are fetched
+            api.add()
+            api.add()
+            api.calls = api.returned = 0
+            lru = HistoryLRU(reset_limit=0)
+            history = lru.lookup_by_cutoff(title, '2023')
+            self.assertEqual([h['revid'] for h in history[:3]], [122, 121, 120])
+            self.assertEqual(len(history), 122)
+            self.assertEqual((api.calls, api.returned), (2, 4)) # probe + revisions 122..120
+            remove_cached_object(lru._cache_path(title))
+
+    def test_latest_revision_index(self):
+        index = LatestRevisionIndex(max_age=60, persistent=False)
+        index.record('UNITTEST/1', 5)
+        self.assertIsNone(index.latest('UNITTEST/1')) # no change feed covers the archive yet
+        now = time.time()
+        index.feed_polled('Архів:UNITTEST', [{'title': 'Архів:UNITTEST/2 a', 'revid': 7}], now - 3600, now)
+        self.assertEqual(index.latest('UNITTEST/1'), 5)
+        self.assertEqual(index.latest('UNITTEST/2_a'), 7)
+        self.assertIsNone(index.latest('UNITTEST/3')) # never seen
+        self.assertIsNone(index.latest('UNITTEST2/1')) # another archive
+
+        # the next poll continues the coverage and reports a newer revision
+        index.feed_polled('Архів:UNITTEST', [{'title': 'Архів:UNITTEST/1', 'revid': 9}], now - 10, now + 1)
+        index.record('UNITTEST/1', 5) # e.g. an older history: does not replace the newer one
+        self.assertEqual(index.latest('UNITTEST/1'), 9)
+
+        # a poll that leaves a gap starts the coverage over
+        index.feed_polled('Архів:UNITTEST', [], now + 100, now + 200)
+        self.assertIsNone(index.latest('UNITTEST/1'))
+        index.record('UNITTEST/1', 9, now + 300)
+        self.assertEqual(index.latest('UNITTEST/1'), 9)
+
+        # the index is not trusted once the feed has not been polled for max_age
+        index = LatestRevisionIndex(max_age=0, persistent=False)
+        index.feed_polled('Архів:UNITTEST', [], now - 3600, now)
+        index.record('UNITTEST/1', 5)
+        self.assertIsNone(index.latest('UNITTEST/1'))
+
+    def test_latest_revision_index_shared(self):
+        # a worker that does not poll the feeds answers from what the polling one saved
+        store = {}
+        def load(path):
+            if path not in store:
+                raise CacheMissError(path)
+            return json.loads(json.dumps(store[path]))
+        def save(obj, path):
+            store[path] = obj
+
+        now = time.time()
+        with patch('birddog.wiki.load_cached_object', load), patch('birddog.wiki.save_cached_object', save):
+            leader = LatestRevisionIndex(max_age=60)
+            follower = LatestRevisionIndex(max_age=60)
+            self.assertIsNone(follower.latest('UNITTEST/1'))
+            leader.record('UNITTEST/2', 4, now - 7200)
+            leader.feed_polled('Архів:UNITTEST', [{'title': 'Архів:UNITTEST/1', 'revid': 5}], now - 3600, now)
+            with patch('birddog.wiki.LATEST_REVISION_RELOAD', 0):
+                self.assertEqual(follower.latest('UNITTEST/1'), 5)
+                self.assertIsNone(follower.latest('UNITTEST/2')) # recorded before the coverage started
+
+                # a restarted leader continues the coverage it saved
+                leader = LatestRevisionIndex(max_age=60)
+                leader.feed_polled('Архів:UNITTEST', [{'title': 'Архів:UNITTEST/3', 'revid': 8}], now - 10, now + 1)
+                self.assertEqual(leader.latest('UNITTEST/1'), 5)
+                self.assertEqual(LatestRevisionIndex(max_age=60).latest('UNITTEST/3'), 8)
+            self.assertEqual(store['latest_revisions/UNITTEST.json']['coverage'], [now - 3600, now + 1])
+
+    def test_history_latest_revisions(self):
+        # only heads the wiki just reported are recorded, as of when it reported them
+        api = _FakeRevisionApi(200)
+        index = LatestRevisionIndex(persistent=False)
+        with patch('birddog.wiki.async_fetch_url', api.fetch), patch('birddog.wiki._latest_revisions', index):
+            lru = HistoryLRU(persistent=False)
+            lru.lookup('ДАЖО/1', limit=10)
+            validated = time.time()
+            # the feed covers the archive from after the head was validated
+            index.feed_polled('Архів:ДАЖО', [], validated + 1, validated + 2)
+            self.assertIsNone(index.latest('ДАЖО/1'))
+            with patch('time.time', return_value=validated + 1.5):
+                lru.lookup_by_cutoff('ДАЖО/1', '2023') # extends the tail of the history in memory
+            self.assertIsNone(index.latest('ДАЖО/1'))
+            with patch('time.time', return_value=validated + 3):
+                lru.revalidate('ДАЖО/1')
+            self.assertEqual(index.latest('ДАЖО/1'), 200)
+
     def test_change_check(self):
         pass
 
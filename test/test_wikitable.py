@@ -0,0 +1,36 @@
+import unittest
+from birddog.wikitable import (
+    parse_cell,
+    split_table,
+    )
+
+# ------------------ WIKITABLE UNIT TESTS ------------------
+class Test(unittest.TestCase):
+    def test_parse_cell(self):
+        self.assertEqual(parse_cell('Журнали засідань'), ('Журнали засідань', [], None))
+        self.assertEqual(parse_cell('[[/12/]]'), ('/12/', ['/12/'], None))
+        self.assertEqual(parse_cell("Справи про [[Шлюб|шлюби]] та [[ Розлучення ]]"),
+                         ('Справи про шлюби та  Розлучення ', ['Шлюб', 'Розлучення'], None))
+        self.assertEqual(parse_cell('Рядок з [https://example.org/x?a=1&b=2 посиланням]'),
+                         ('Рядок з посиланням', [], 'https://example.org/x?a=1&b=2'))
+        self.assertEqual(parse_cell("'''''Жирний курсив''''' та ''курсив'' д'Артаньяна"),
+                         ("Жирний курсив та курсив д'Артаньяна", [], None))
+        # left to the full parser
+        for cell in ['Текст {{ref|1}}', 'Рядок<br/>з тегом', 'a&nbsp;b', 'http://example.org bare',
+                     "''незакритий курсив", "'''a ''b''' c''", '* список', 'Рядок з [ дужками ]',
+                     '[[//example.org]]', "[[x|''y'']]"]:
+            self.assertIsNone(parse_cell(cell), cell)
+
+    def test_split_table(self):
+        before, rows, after = split_table(
+            '{{Архіви|назва=Опис}}\n{| class="navbox"\n| [[ДАЖО]]\n|}\n'
+            '{| class="wikitable sortable"\n! Опис || Назва\n|-\n| [[/1/]] || Перший \n\n|-\n|}\nКінець')
+        self.assertEqual(before, '{{Архіви|назва=Опис}}\n{| class="navbox"\n| [[ДАЖО]]\n|}')
+        self.assertEqual(rows, ['! Опис || Назва', '| [[/1/]] || Перший'])
+        self.assertEqual(after, '\nКінець')
+        self.assertIsNone(split_table('{{Архіви|примітки=\n{| class="wikitable"\n| 1\n|}\n}}')) # in a template
+        self.assertIsNone(split_table('{| class="wikitable"\n| 1\n')) # not closed
+        self.assertIsNone(split_table('* [[/1/]]\n* [[/2/]]')) # no table
+
+if __name__ == "__main__":
+    unittest.main()